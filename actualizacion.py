@@ -0,0 +1,161 @@
+"""Actualización en bloque de valores de indicadores por código (API JSON).
+
+Cada elemento ``{codigo, valor_real?, valor_planificado?, referencias?}``
+cambia solo los campos que trae; ``referencias`` sustituye el diccionario
+completo y se valida contra el tipo de comparación. Los códigos se resuelven
+con una consulta por bloque, todos los cambios se aplican con UPDATE en
+bloque por clave primaria y los indicadores afectados se re-evalúan juntos,
+todo en una sola transacción. Los valores anteriores se leen con los códigos
+para dejar el cambio en ``indicator_history``.
+"""
+import math
+from numbers import Real
+
+from sqlalchemy import select, update
+
+from agregacion import marcar_sucios
+from analitica import marcar_series
+from cambios import marcar_modificadas
+from cubo import marcar_indicadores
+from evaluacion_lote import reevaluar_ids
+from extensions import db
+from historial import registrar_cambios
+from models import ComparisonType, Indicator
+
+MAX_ELEMENTOS = 50000
+CAMPOS = ('valor_real', 'valor_planificado', 'referencias')
+_REFERENCIAS = ('ref1', 'ref2', 'ref3', 'ref4')
+_TAMANO_BLOQUE = 900
+
+
+def _en_bloques(valores):
+    valores = list(valores)
+    for inicio in range(0, len(valores), _TAMANO_BLOQUE):
+        yield valores[inicio:inicio + _TAMANO_BLOQUE]
+
+
+def _numero(valor, campo):
+    if valor is None:
+        return None
+    if isinstance(valor, bool) or not isinstance(valor, (Real, str)):
+        raise ValueError(f"'{campo}' debe ser numérico")
+    try:
+        numero = float(valor)
+    except ValueError:
+        raise ValueError(f"'{campo}' debe ser numérico") from None
+    if not math.isfinite(numero):
+        raise ValueError(f"'{campo}' debe ser un número finito")
+    return numero
+
+
+def preparar(elemento):
+    """Devuelve ``(codigo, cambios)`` de un elemento; lanza ValueError si no es válido"""
+    if not isinstance(elemento, dict):
+        raise ValueError('El elemento debe ser un objeto')
+    codigo = elemento.get('codigo')
+    if not isinstance(codigo, str) or not codigo.strip():
+        raise ValueError("Falta 'codigo'")
+    desconocidos = set(elemento) - {'codigo', *CAMPOS}
+    if desconocidos:
+        raise ValueError(f"Campos no admitidos: {', '.join(sorted(desconocidos))}")
+
+    cambios = {}
+    for campo in ('valor_real', 'valor_planificado'):
+        if campo in elemento:
+            cambios[campo] = _numero(elemento[campo], campo)
+    if 'referencias' in elemento:
+        referencias = elemento['referencias']
+        if not isinstance(referencias, dict):
+            raise ValueError("'referencias' debe ser un objeto")
+        if set(referencias) - set(_REFERENCIAS):
+            raise ValueError(f"Referencias admitidas: {', '.join(_REFERENCIAS)}")
+        cambios['referencias'] = {k: _numero(v, k) for k, v in referencias.items() if v is not None}
+    if not cambios:
+        raise ValueError(f"Sin campos que actualizar ({', '.join(CAMPOS)})")
+    return codigo.strip(), cambios
+
+
+def _cargar(codigos):
+    """codigo -> (id, codigo del tipo de comparación, parent_id, {campo: valor anterior}) por bloques"""
+    encontrados = {}
+    for bloque in _en_bloques(codigos):
+        consulta = (select(Indicator.codigo, Indicator.id, ComparisonType.codigo, Indicator.parent_id,
+                           *(getattr(Indicator, campo) for campo in CAMPOS))
+                    .join(ComparisonType, Indicator.comparison_type_id == ComparisonType.id)
+                    .where(Indicator.codigo.in_(bloque)))
+        for codigo, id_, tipo, padre, *anteriores in db.session.execute(consulta):
+            encontrados[codigo] = (id_, tipo, padre, dict(zip(CAMPOS, anteriores)))
+    return encontrados
+
+
+def actualizar(elementos):
+    """Aplica los elementos en una transacción y devuelve el resultado de cada uno
+
+    Los elementos no válidos o con código desconocido se informan y no
+    impiden aplicar el resto. Si un código se repite, sus cambios se
+    combinan en orden. Un error de base de datos deshace todo y se propaga.
+    """
+    resultados = [None] * len(elementos)
+    preparados = {}
+    for indice, elemento in enumerate(elementos):
+        try:
+            codigo, cambios = preparar(elemento)
+        except ValueError as e:
+            resultados[indice] = {'indice': indice, 'codigo': elemento.get('codigo') if isinstance(elemento, dict)
+                                  else None, 'estado': 'error', 'error': str(e)}
+            continue
+        indices, combinados = preparados.setdefault(codigo, ([], {}))
+        indices.append(indice)
+        combinados.update(cambios)
+
+    existentes = _cargar(preparados)
+    filas = []
+    for codigo, (indices, cambios) in preparados.items():
+        error = None
+        if codigo not in existentes:
+            error = f'Indicador desconocido: {codigo}'
+        elif 'referencias' in cambios:
+            try:
+                Indicator.validar_referencias(existentes[codigo][1], cambios['referencias'])
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            for indice in indices:
+                resultados[indice] = {'indice': indice, 'codigo': codigo, 'estado': 'error', 'error': error}
+            continue
+        filas.append(dict(cambios, id=existentes[codigo][0]))
+
+    if filas:
+        ids = [f['id'] for f in filas]
+        try:
+            # El ORM agrupa en executemany las filas consecutivas con las mismas columnas
+            filas.sort(key=lambda f: sorted(f))
+            db.session.execute(update(Indicator), filas)
+            anteriores = {id_: valores for id_, _, _, valores in existentes.values()}
+            registrar_cambios(db.session, ((f['id'], campo, anteriores[f['id']][campo], valor)
+                                           for f in filas for campo, valor in f.items() if campo != 'id'))
+            reevaluar_ids(ids)
+            marcar_sucios(db.session, [existentes[codigo][2] for codigo in preparados if codigo in existentes])
+            marcar_modificadas(db.session, Indicator.__tablename__)
+            marcar_indicadores(db.session, ids)
+            # El plan y las referencias cambian la analítica de la serie
+            marcar_series(db.session, [f['id'] for f in filas if f.keys() - {'id', 'valor_real'}])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        evaluaciones = {}
+        for bloque in _en_bloques(ids):
+            evaluaciones.update(db.session.execute(
+                select(Indicator.id, Indicator.ultima_evaluacion).where(Indicator.id.in_(bloque))).all())
+        for codigo, (indices, _) in preparados.items():
+            if codigo not in existentes or resultados[indices[0]] is not None:
+                continue
+            id_ = existentes[codigo][0]
+            for indice in indices:
+                resultados[indice] = {'indice': indice, 'codigo': codigo, 'id': id_, 'estado': 'actualizado',
+                                      'ultima_evaluacion': evaluaciones.get(id_)}
+
+    return {'recibidos': len(elementos), 'actualizados': len(filas),
+            'errores': sum(1 for r in resultados if r['estado'] == 'error'), 'resultados': resultados}
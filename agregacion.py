@@ -0,0 +1,210 @@
+"""Agregación jerárquica de indicadores según su ``AggregationMethod``.
+
+El valor de cada indicador padre se calcula a partir de sus hijos directos.
+Cuando cambia un indicador solo se recalcula la ruta sucia hasta la raíz,
+procesando los ancestros por niveles de abajo hacia arriba con una consulta
+y un UPDATE por nivel. Un padre que se queda sin hijos (se borró o se movió
+el último) deja de ser agregado y su ``valor_real`` pasa a NULL. Los valores
+que cambian quedan en el historial con ``registrar_cambios``.
+"""
+import numpy as np
+from sqlalchemy import case, event, inspect, update
+from sqlalchemy.orm import Session
+
+from cambios import marcar_modificadas
+from cubo import marcar_indicadores
+from evaluacion_lote import reevaluar_ids
+from extensions import db
+from historial import registrar_cambios
+from models import Indicator, AggregationMethod
+
+_TAMANO_BLOQUE = 900
+
+# Atributos cuyo cambio invalida el valor agregado del padre
+_ATRIBUTOS_HOJA = ('valor_real', 'valor_planificado')
+
+
+def _en_bloques(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), _TAMANO_BLOQUE):
+        yield ids[inicio:inicio + _TAMANO_BLOQUE]
+
+
+def agregar(metodo, valores, pesos=None):
+    """Agrega los valores de los hijos con el método SUM, AVG o WAVG
+
+    Los hijos sin valor se ignoran. WAVG pondera por ``valor_planificado`` y,
+    si ningún hijo tiene peso, se comporta como AVG. Devuelve ``None`` si no
+    hay valores que agregar o el método no se reconoce.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    con_valor = ~np.isnan(valores)
+    if not con_valor.any():
+        return None
+    valores = valores[con_valor]
+
+    if metodo == 'SUM':
+        return float(valores.sum())
+    if metodo == 'AVG':
+        return float(valores.mean())
+    if metodo == 'WAVG':
+        pesos = np.nan_to_num(np.asarray(pesos, dtype=np.float64)[con_valor])
+        if not pesos.sum():
+            return float(valores.mean())
+        return float(np.average(valores, weights=pesos))
+    return None
+
+
+def _padres(ids):
+    """Devuelve {id: parent_id} de los indicadores indicados"""
+    padre = {}
+    for bloque in _en_bloques(ids):
+        padre.update(db.session.query(Indicator.id, Indicator.parent_id)
+                     .filter(Indicator.id.in_(bloque)))
+    return padre
+
+
+def _recalcular_nivel(nodos, vaciados=frozenset()):
+    """Recalcula y guarda el valor agregado de un conjunto de nodos independientes
+
+    Los nodos de ``vaciados`` que ya no tienen hijos quedan sin valor; el
+    resto de nodos sin hijos (hojas) no se tocan.
+    """
+    metodos = dict(db.session.query(AggregationMethod.id, AggregationMethod.codigo))
+    for bloque in _en_bloques(nodos):
+        metodo_por_nodo, anteriores = {}, {}
+        for id_, metodo_id, valor in (db.session.query(Indicator.id, Indicator.aggregation_method_id,
+                                                        Indicator.valor_real)
+                                      .filter(Indicator.id.in_(bloque))):
+            metodo_por_nodo[id_] = metodos.get(metodo_id)
+            anteriores[id_] = valor
+        hijos = {}
+        for padre_id, valor, peso in (db.session.query(Indicator.parent_id, Indicator.valor_real,
+                                                       Indicator.valor_planificado)
+                                      .filter(Indicator.parent_id.in_(bloque))):
+            valores, pesos = hijos.setdefault(padre_id, ([], []))
+            valores.append(np.nan if valor is None else valor)
+            pesos.append(np.nan if peso is None else peso)
+
+        nuevos = {id_: agregar(metodo_por_nodo[id_], *hijos[id_]) if id_ in hijos else None
+                  for id_ in bloque if (id_ in hijos or id_ in vaciados) and id_ in metodo_por_nodo}
+        if nuevos:
+            registrar_cambios(db.session, ((id_, 'valor_real', anteriores[id_], valor)
+                                           for id_, valor in nuevos.items()))
+            db.session.execute(
+                update(Indicator)
+                .where(Indicator.id.in_(list(nuevos)))
+                .values(valor_real=case(nuevos, value=Indicator.id))
+                .execution_options(synchronize_session=False)
+            )
+            marcar_modificadas(db.session, Indicator.__tablename__)
+            marcar_indicadores(db.session, nuevos)
+
+
+def _recalcular(padre, sucios, vaciados=frozenset()):
+    """Recalcula los nodos sucios y sus ancestros de abajo hacia arriba
+
+    ``padre`` debe contener el parent_id de todos los nodos de la ruta.
+    Un nodo solo se procesa cuando ya se procesaron todos sus hijos sucios.
+    """
+    pendientes = {id_: 0 for id_ in sucios}
+    for id_ in sucios:
+        if padre.get(id_) in pendientes:
+            pendientes[padre[id_]] += 1
+
+    nivel = [id_ for id_, n in pendientes.items() if n == 0]
+    while nivel:
+        _recalcular_nivel(nivel, vaciados)
+        siguiente = []
+        for id_ in nivel:
+            id_padre = padre.get(id_)
+            if id_padre in pendientes:
+                pendientes[id_padre] -= 1
+                if pendientes[id_padre] == 0:
+                    siguiente.append(id_padre)
+        nivel = siguiente
+    return set(sucios)
+
+
+def recalcular_desde(ids, vaciados=()):
+    """Recalcula los indicadores indicados y toda su ruta hasta la raíz
+
+    ``vaciados`` son los que perdieron algún hijo: si ya no les queda
+    ninguno, su valor pasa a NULL. Devuelve el conjunto de ids
+    recalculados. No hace commit.
+    """
+    padre = {}
+    frontera = {id_ for id_ in ids if id_ is not None}
+    sucios = set(frontera)
+    while frontera:
+        nuevos = _padres(frontera)
+        padre.update(nuevos)
+        frontera = {p for p in nuevos.values() if p is not None and p not in sucios}
+        sucios |= frontera
+
+    recalculados = _recalcular(padre, sucios, set(vaciados))
+    reevaluar_ids(recalculados)
+    return recalculados
+
+
+def recalcular_todo():
+    """Recalcula todos los indicadores que tienen hijos. No hace commit."""
+    padre = dict(db.session.query(Indicator.id, Indicator.parent_id))
+    con_hijos = {p for p in padre.values() if p is not None}
+    recalculados = _recalcular(padre, con_hijos)
+    reevaluar_ids(recalculados)
+    return recalculados
+
+
+def marcar_sucios(session, ids, vaciados=()):
+    """Registra indicadores a recalcular en el próximo commit de la sesión
+
+    ``vaciados``: padres que perdieron hijos (antiguo padre de un indicador
+    movido o borrado); también se recalculan.
+    """
+    vaciados = {id_ for id_ in vaciados if id_ is not None}
+    session.info.setdefault('agregacion_sucios', set()).update(
+        id_ for id_ in ids if id_ is not None)
+    session.info['agregacion_sucios'].update(vaciados)
+    session.info.setdefault('agregacion_vaciados', set()).update(vaciados)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios(session, flush_context):
+    sucios, vaciados = set(), set()
+    for obj in session.new:
+        if isinstance(obj, Indicator):
+            sucios.add(obj.parent_id)
+    for obj in session.deleted:
+        if isinstance(obj, Indicator):
+            vaciados.add(obj.parent_id)
+    for obj in session.dirty:
+        if not isinstance(obj, Indicator):
+            continue
+        estado = inspect(obj)
+        historial = estado.attrs.parent_id.history
+        if historial.has_changes():
+            vaciados.update(historial.deleted)
+            sucios.update(historial.added)
+        if any(estado.attrs[a].history.has_changes() for a in _ATRIBUTOS_HOJA):
+            sucios.add(obj.parent_id)
+        if estado.attrs.aggregation_method_id.history.has_changes():
+            sucios.add(obj.id)
+    if (sucios | vaciados) - {None}:
+        marcar_sucios(session, sucios, vaciados)
+
+
+# Se antepone al resto de before_commit para que vean los valores ya agregados
+@event.listens_for(Session, 'before_commit', insert=True)
+def _recalcular_antes_de_confirmar(session):
+    session.flush()
+    sucios = session.info.pop('agregacion_sucios', None)
+    vaciados = session.info.pop('agregacion_vaciados', ())
+    if sucios:
+        recalcular_desde(sucios, vaciados)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_sucios(session):
+    session.info.pop('agregacion_sucios', None)
+    session.info.pop('agregacion_vaciados', None)
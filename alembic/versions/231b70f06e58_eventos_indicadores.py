@@ -0,0 +1,43 @@
+"""Eventos de cambio de estado de indicadores
+
+``indicator_events``, de la que lee el flujo SSE en orden de id, y su índice
+por fecha con el que se purgan los eventos pasada la retención. Empieza
+vacía: solo recoge los cambios de estado posteriores.
+
+Revision ID: 231b70f06e58
+Revises: 534eb621dbfc
+Create Date: 2026-10-18 09:57:31.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '231b70f06e58'
+down_revision: Union[str, None] = '534eb621dbfc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('indicator_events',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('indicator_id', sa.Integer(), nullable=False),
+                    sa.Column('estado_anterior', sa.String(length=20), nullable=True),
+                    sa.Column('estado_nuevo', sa.String(length=20), nullable=True),
+                    sa.Column('valor_real', sa.Float(), nullable=True),
+                    sa.Column('perspective_id', sa.Integer(), nullable=True),
+                    sa.Column('estructura_id', sa.Integer(), nullable=True),
+                    sa.Column('fecha', sa.DateTime(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_indicator_events_fecha'), 'indicator_events', ['fecha'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_indicator_events_fecha'), table_name='indicator_events')
+    op.drop_table('indicator_events')
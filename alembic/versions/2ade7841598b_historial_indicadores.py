@@ -0,0 +1,59 @@
+"""Historial de cambios de indicadores
+
+``indicator_history`` y su índice por (indicador, fecha del cambio), con el
+que se pagina el historial de cada indicador. Las bases creadas con
+``modelo.sql`` ya tienen la tabla: solo se crea lo que falte.
+
+Revision ID: 2ade7841598b
+Revises: f209ee60b5ba
+Create Date: 2026-10-18 09:48:53.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2ade7841598b'
+down_revision: Union[str, None] = 'f209ee60b5ba'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLA = 'indicator_history'
+INDICE = 'idx_indicator_history_indicador_fecha'
+
+
+def _existentes():
+    """(tabla existe, índice existe); en modo --sql no hay base que inspeccionar"""
+    if op.get_context().as_sql:
+        return False, False
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(TABLA):
+        return False, False
+    return True, INDICE in {i['name'] for i in inspector.get_indexes(TABLA)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tabla, indice = _existentes()
+    if not tabla:
+        op.create_table(TABLA,
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('indicator_id', sa.Integer(), nullable=False),
+                        sa.Column('campo_modificado', sa.String(length=50), nullable=False),
+                        sa.Column('valor_anterior', sa.Text(), nullable=True),
+                        sa.Column('valor_nuevo', sa.Text(), nullable=True),
+                        sa.Column('fecha_cambio', sa.DateTime(), nullable=True),
+                        sa.Column('usuario', sa.String(length=50), nullable=False),
+                        sa.ForeignKeyConstraint(['indicator_id'], ['indicators.id'], ),
+                        sa.PrimaryKeyConstraint('id'))
+    if not indice:
+        op.create_index(INDICE, TABLA, ['indicator_id', 'fecha_cambio'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(INDICE, table_name=TABLA)
+    op.drop_table(TABLA)
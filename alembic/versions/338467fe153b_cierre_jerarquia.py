@@ -0,0 +1,55 @@
+"""Tabla de cierre de la jerarquía organizacional
+
+``organizational_structure_paths`` (una fila por par ancestro-descendiente)
+y los índices por estructura de ``indicators`` y ``equipos_fisicos`` con los
+que se filtra por subárbol. La tabla se rellena con
+``jerarquia.reconstruir_cierre``.
+
+Revision ID: 338467fe153b
+Revises: 97e8d2b927ea
+Create Date: 2026-10-18 09:14:37.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '338467fe153b'
+down_revision: Union[str, None] = '97e8d2b927ea'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('organizational_structure_paths',
+                    sa.Column('ancestro_id', sa.Integer(), nullable=False),
+                    sa.Column('descendiente_id', sa.Integer(), nullable=False),
+                    sa.Column('profundidad', sa.Integer(), nullable=False),
+                    sa.Column('activo', sa.Boolean(), nullable=False),
+                    sa.ForeignKeyConstraint(['ancestro_id'], ['organizational_structures.id'], ),
+                    sa.ForeignKeyConstraint(['descendiente_id'], ['organizational_structures.id'], ),
+                    sa.PrimaryKeyConstraint('ancestro_id', 'descendiente_id'))
+    op.create_index(op.f('ix_organizational_structure_paths_descendiente_id'), 'organizational_structure_paths',
+                    ['descendiente_id'], unique=False)
+    op.create_index(op.f('ix_indicators_estructura_jerarquica_id'), 'indicators', ['estructura_jerarquica_id'],
+                    unique=False)
+    op.create_index(op.f('ix_equipos_fisicos_estructura_id'), 'equipos_fisicos', ['estructura_id'], unique=False)
+
+    # En modo --sql no hay filas que leer: el relleno queda para ``flask kpi rebuild-org-paths``
+    if not op.get_context().as_sql:
+        from jerarquia import reconstruir_cierre
+
+        reconstruir_cierre(conexion=op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_equipos_fisicos_estructura_id'), table_name='equipos_fisicos')
+    op.drop_index(op.f('ix_indicators_estructura_jerarquica_id'), table_name='indicators')
+    op.drop_index(op.f('ix_organizational_structure_paths_descendiente_id'),
+                  table_name='organizational_structure_paths')
+    op.drop_table('organizational_structure_paths')
@@ -0,0 +1,63 @@
+"""Columnas espaciales de equipos e indicadores
+
+``latitud``, ``longitud`` y la celda geohash ``celda_geo`` (indexada) en
+``equipos_fisicos`` e ``indicators``; en PostgreSQL, además, los índices GiST
+sobre ``point(longitud, latitud)`` de ``modelo.sql``. También los índices por
+``indicator_dimensions.provincia`` e ``indicator_equipment.equipo_id`` de las
+consultas por zona. Las filas existentes se rellenan con
+``geografia.reconstruir``.
+
+Revision ID: 534eb621dbfc
+Revises: c34847dd63d9
+Create Date: 2026-10-17 10:48:05.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '534eb621dbfc'
+down_revision: Union[str, None] = 'c34847dd63d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLAS = ('equipos_fisicos', 'indicators')
+INDICES_GIST = {'equipos_fisicos': 'idx_equipos_punto', 'indicators': 'idx_indicators_punto'}
+INDICES = {'indicator_dimensions': 'provincia', 'indicator_equipment': 'equipo_id'}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for tabla in TABLAS:
+        op.add_column(tabla, sa.Column('latitud', sa.Float(), nullable=True))
+        op.add_column(tabla, sa.Column('longitud', sa.Float(), nullable=True))
+        op.add_column(tabla, sa.Column('celda_geo', sa.String(length=12), nullable=True))
+        op.create_index(op.f(f'ix_{tabla}_celda_geo'), tabla, ['celda_geo'], unique=False)
+    for tabla, columna in INDICES.items():
+        op.create_index(op.f(f'ix_{tabla}_{columna}'), tabla, [columna], unique=False)
+    if op.get_context().dialect.name == 'postgresql':
+        for tabla, indice in INDICES_GIST.items():
+            op.execute(f'CREATE INDEX {indice} ON {tabla} USING gist (point(longitud, latitud))')
+
+    # En modo --sql no hay filas que leer: el relleno queda para ``flask kpi rebuild-geo``
+    if not op.get_context().as_sql:
+        from geografia import reconstruir
+
+        reconstruir(conexion=op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_context().dialect.name == 'postgresql':
+        for indice in INDICES_GIST.values():
+            op.execute(f'DROP INDEX {indice}')
+    for tabla, columna in INDICES.items():
+        op.drop_index(op.f(f'ix_{tabla}_{columna}'), table_name=tabla)
+    for tabla in reversed(TABLAS):
+        op.drop_index(op.f(f'ix_{tabla}_celda_geo'), table_name=tabla)
+        op.drop_column(tabla, 'celda_geo')
+        op.drop_column(tabla, 'longitud')
+        op.drop_column(tabla, 'latitud')
@@ -0,0 +1,50 @@
+"""Índices de búsqueda por nombre
+
+Índices por ``nombre`` de ``indicators`` y ``organizational_structures`` con
+los que se pagina por nombre en los selectores; en PostgreSQL, además, la
+extensión ``pg_trgm`` y los índices GIN de trigramas de ``modelo.sql`` para
+la búsqueda por subcadena (ILIKE).
+
+Revision ID: 59c993230561
+Revises: 338467fe153b
+Create Date: 2026-10-18 09:23:50.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '59c993230561'
+down_revision: Union[str, None] = '338467fe153b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLAS = ('indicators', 'organizational_structures')
+INDICES_TRIGRAMAS = {
+    'idx_indicators_nombre_trgm': ('indicators', 'nombre'),
+    'idx_indicators_codigo_trgm': ('indicators', 'codigo'),
+    'idx_org_nombre_trgm': ('organizational_structures', 'nombre'),
+    'idx_org_codigo_trgm': ('organizational_structures', 'codigo'),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for tabla in TABLAS:
+        op.create_index(op.f(f'ix_{tabla}_nombre'), tabla, ['nombre'], unique=False)
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for indice, (tabla, columna) in INDICES_TRIGRAMAS.items():
+            op.execute(f'CREATE INDEX {indice} ON {tabla} USING gin ({columna} gin_trgm_ops)')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_context().dialect.name == 'postgresql':
+        for indice in INDICES_TRIGRAMAS:
+            op.execute(f'DROP INDEX {indice}')
+    for tabla in reversed(TABLAS):
+        op.drop_index(op.f(f'ix_{tabla}_nombre'), table_name=tabla)
@@ -0,0 +1,31 @@
+"""Índice por indicador padre
+
+Índice sobre ``indicators.parent_id`` con el que se cargan los hijos de un
+indicador y se recorre el árbol de indicadores.
+
+Revision ID: 97e8d2b927ea
+Revises: e3e39f462188
+Create Date: 2026-10-18 09:05:12.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '97e8d2b927ea'
+down_revision: Union[str, None] = 'e3e39f462188'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_indicators_parent_id'), 'indicators', ['parent_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_indicators_parent_id'), table_name='indicators')
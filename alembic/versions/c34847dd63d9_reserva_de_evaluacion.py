@@ -0,0 +1,37 @@
+"""Reserva de evaluación en indicators
+
+Columnas de la reserva por filas del planificador (``evaluacion_reservada_hasta``
+y ``evaluacion_reservada_por``) y el índice por (periodicidad, fecha de la
+última evaluación) con el que se buscan los indicadores vencidos.
+
+Revision ID: c34847dd63d9
+Revises: 2ade7841598b
+Create Date: 2026-10-17 10:12:41.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c34847dd63d9'
+down_revision: Union[str, None] = '2ade7841598b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('indicators', sa.Column('evaluacion_reservada_hasta', sa.DateTime(), nullable=True))
+    op.add_column('indicators', sa.Column('evaluacion_reservada_por', sa.String(length=100), nullable=True))
+    op.create_index('idx_indicators_periodicidad_evaluacion', 'indicators',
+                    ['periodicity_id', 'fecha_ultima_evaluacion'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_indicators_periodicidad_evaluacion', table_name='indicators')
+    op.drop_column('indicators', 'evaluacion_reservada_por')
+    op.drop_column('indicators', 'evaluacion_reservada_hasta')
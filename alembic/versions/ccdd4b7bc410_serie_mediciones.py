@@ -0,0 +1,38 @@
+"""Serie histórica de mediciones
+
+``indicator_measurements``: un punto por indicador y período, al que la
+ingesta masiva (``flask kpi ingest``) agrega filas sin reescribir nunca las
+existentes. Empieza vacía: no hay puntos anteriores que rellenar.
+
+Revision ID: ccdd4b7bc410
+Revises: 59c993230561
+Create Date: 2026-10-18 09:31:08.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ccdd4b7bc410'
+down_revision: Union[str, None] = '59c993230561'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('indicator_measurements',
+                    sa.Column('indicator_id', sa.Integer(), nullable=False),
+                    sa.Column('periodo_inicio', sa.Date(), nullable=False),
+                    sa.Column('valor', sa.Float(), nullable=False),
+                    sa.Column('registrado_en', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['indicator_id'], ['indicators.id'], ),
+                    sa.PrimaryKeyConstraint('indicator_id', 'periodo_inicio'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('indicator_measurements')
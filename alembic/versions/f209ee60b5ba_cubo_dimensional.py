@@ -0,0 +1,76 @@
+"""Cubo dimensional de indicadores
+
+``indicator_dimensions`` (las dimensiones de cada indicador ya extraídas de
+sus campos JSON) e ``indicator_cube`` (una fila preagregada por combinación
+de dimensiones), con sus índices. Ambas se rellenan con ``cubo.reconstruir``.
+
+Revision ID: f209ee60b5ba
+Revises: ccdd4b7bc410
+Create Date: 2026-10-18 09:40:26.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f209ee60b5ba'
+down_revision: Union[str, None] = 'ccdd4b7bc410'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columnas_celda():
+    return [sa.Column('perspective_id', sa.Integer(), nullable=True),
+            sa.Column('periodicity_id', sa.Integer(), nullable=True),
+            sa.Column('estructura_id', sa.Integer(), nullable=True),
+            sa.Column('anio', sa.Integer(), nullable=True),
+            sa.Column('trimestre', sa.String(length=10), nullable=True),
+            sa.Column('mes', sa.Integer(), nullable=True),
+            sa.Column('provincia', sa.String(length=100), nullable=True),
+            sa.Column('municipio', sa.String(length=100), nullable=True),
+            sa.Column('centro_costo', sa.String(length=50), nullable=True)]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('indicator_dimensions',
+                    sa.Column('indicator_id', sa.Integer(), nullable=False),
+                    sa.Column('clave', sa.String(length=40), nullable=False),
+                    *_columnas_celda(),
+                    sa.Column('valor_real', sa.Float(), nullable=True),
+                    sa.Column('valor_planificado', sa.Float(), nullable=True),
+                    sa.Column('ultima_evaluacion', sa.String(length=20), nullable=True),
+                    sa.PrimaryKeyConstraint('indicator_id'))
+    op.create_index(op.f('ix_indicator_dimensions_clave'), 'indicator_dimensions', ['clave'], unique=False)
+    op.create_table('indicator_cube',
+                    sa.Column('clave', sa.String(length=40), nullable=False),
+                    *_columnas_celda(),
+                    sa.Column('indicadores', sa.Integer(), nullable=False),
+                    sa.Column('con_valor', sa.Integer(), nullable=False),
+                    sa.Column('suma_real', sa.Float(), nullable=True),
+                    sa.Column('con_planificado', sa.Integer(), nullable=False),
+                    sa.Column('suma_planificado', sa.Float(), nullable=True),
+                    sa.Column('bien', sa.Integer(), nullable=False),
+                    sa.Column('regular', sa.Integer(), nullable=False),
+                    sa.Column('mal', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('clave'))
+    op.create_index(op.f('ix_indicator_cube_perspective_id'), 'indicator_cube', ['perspective_id'], unique=False)
+    op.create_index(op.f('ix_indicator_cube_estructura_id'), 'indicator_cube', ['estructura_id'], unique=False)
+
+    # En modo --sql no hay filas que leer: el relleno queda para ``flask kpi rebuild-cube``
+    if not op.get_context().as_sql:
+        from cubo import reconstruir
+
+        reconstruir(conexion=op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_indicator_cube_estructura_id'), table_name='indicator_cube')
+    op.drop_index(op.f('ix_indicator_cube_perspective_id'), table_name='indicator_cube')
+    op.drop_table('indicator_cube')
+    op.drop_index(op.f('ix_indicator_dimensions_clave'), table_name='indicator_dimensions')
+    op.drop_table('indicator_dimensions')
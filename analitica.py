@@ -0,0 +1,305 @@
+"""Analítica de tendencia de la serie histórica de indicadores.
+
+La historia de un indicador, o de todo su subárbol (``parent_id``), se lee
+de ``indicator_measurements`` en una sola consulta y se pasa a arreglos de
+NumPy ordenados por (indicador, período). Sobre ellos se calculan, sin bucles
+por punto:
+
+- media móvil de los últimos ``ventana`` períodos,
+- variación respecto al período anterior (absoluta y relativa),
+- cumplimiento del plan (valor / ``valor_planificado``),
+- estado BIEN/REGULAR/MAL de cada punto con la regla del tipo de comparación,
+  y el tiempo en cada estado en días (períodos × ``Periodicity.dias``).
+
+Los períodos se numeran como en ``mediciones`` (días desde 1970-01-01 entre
+``dias``), así que un hueco en la serie no se confunde con el período
+anterior. Los resultados se guardan por (indicador, subárbol, ventana, desde)
+y se descartan cuando llegan valores nuevos de alguno de sus indicadores.
+
+Los commits de otros procesos no avisan a esta caché: un resultado guardado
+se revalida cada ``ANALITICA_VERIFICACION`` segundos con una huella barata
+de sus indicadores (número y último período de mediciones, número y
+``updated_at`` máximo de los indicadores consultados), y caduca a los
+``ANALITICA_TTL`` segundos en cualquier caso (reglas y periodicidades).
+"""
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from cambios import suscribir
+from cuadro_mando import ESTADOS, OTROS
+from evaluacion_lote import Columnas, clasificar, construir_columnas
+from extensions import db
+from models import ComparisonType, Indicator, IndicatorMeasurement, Periodicity
+
+VENTANA_POR_DEFECTO = 3
+MAX_VENTANA = 120
+MAX_ENTRADAS = 256
+VERIFICACION_POR_DEFECTO = 5  # Segundos entre revalidaciones de un resultado
+TTL_POR_DEFECTO = 300  # Segundos de vida de un resultado
+_CATEGORIAS = (*ESTADOS, OTROS)
+
+
+def _ids_consultados(indicador_id, subarbol):
+    """Subconsulta con el indicador y, si se pide, todos sus descendientes"""
+    if not subarbol:
+        return select(Indicator.id).where(Indicator.id == indicador_id)
+    arbol = select(Indicator.id).where(Indicator.id == indicador_id).cte('arbol', recursive=True)
+    # UNION (no UNION ALL) descarta repetidos y corta un posible ciclo de parent_id
+    arbol = arbol.union(select(Indicator.id).where(Indicator.parent_id == arbol.c.id))
+    return select(arbol.c.id)
+
+
+def _lista(arreglo):
+    """Lista JSON de un arreglo float: NaN pasa a ``None``"""
+    return [None if x != x else x for x in arreglo.tolist()]
+
+
+def cargar(indicador_id, subarbol=False, desde=None):
+    """Lee la serie y los datos de cada indicador
+
+    Devuelve ``(indicadores, g, periodos, valores)``: ``indicadores`` es la
+    lista de filas (id, codigo, valor_planificado, referencias, tipo, dias)
+    y ``g`` el índice en ella de cada punto.
+    """
+    ids = _ids_consultados(indicador_id, subarbol)
+    indicadores = db.session.execute(
+        select(Indicator.id, Indicator.codigo, Indicator.valor_planificado, Indicator.referencias,
+               ComparisonType.codigo, Periodicity.dias)
+        .join(ComparisonType, Indicator.comparison_type_id == ComparisonType.id)
+        .join(Periodicity, Indicator.periodicity_id == Periodicity.id)
+        .where(Indicator.id.in_(ids))
+        .order_by(Indicator.id)
+    ).all()
+
+    consulta = (select(IndicatorMeasurement.indicator_id, IndicatorMeasurement.periodo_inicio,
+                       IndicatorMeasurement.valor)
+                .where(IndicatorMeasurement.indicator_id.in_(ids))
+                .order_by(IndicatorMeasurement.indicator_id, IndicatorMeasurement.periodo_inicio))
+    if desde is not None:
+        consulta = consulta.where(IndicatorMeasurement.periodo_inicio >= desde)
+    filas = db.session.execute(consulta).all()
+
+    n = len(filas)
+    puntos_ids = np.fromiter((f[0] for f in filas), dtype=np.int64, count=n)
+    periodos = np.array([f[1] for f in filas], dtype='datetime64[D]')
+    valores = np.fromiter((f[2] for f in filas), dtype=np.float64, count=n)
+    g = np.searchsorted(np.array([i[0] for i in indicadores], dtype=np.int64), puntos_ids)
+    return indicadores, g, periodos, valores
+
+
+def calcular(indicadores, g, periodos, valores, ventana=VENTANA_POR_DEFECTO):
+    """Calcula la analítica de los puntos ya cargados (ver ``cargar``)"""
+    n = len(valores)
+    dias = np.array([i[5] for i in indicadores], dtype=np.int64)
+    plan = np.array([np.nan if i[2] is None else i[2] for i in indicadores], dtype=np.float64)
+
+    # Número de período, como en mediciones.inicio_periodo (la época de NumPy es 1970-01-01)
+    numero = periodos.astype(np.int64) // dias[g] if n else np.zeros(0, dtype=np.int64)
+    anterior = np.zeros(n, dtype=bool)
+    anterior[1:] = (g[1:] == g[:-1]) & (numero[1:] - numero[:-1] == 1)
+
+    variacion = np.full(n, np.nan)
+    variacion[1:] = np.where(anterior[1:], valores[1:] - valores[:-1], np.nan)
+    variacion_pct = np.full(n, np.nan)
+    previo = np.concatenate(([np.nan], valores[:-1]))
+    con_base = anterior & (previo != 0)
+    variacion_pct[con_base] = variacion[con_base] / np.abs(previo[con_base])
+
+    # Media de los puntos del mismo indicador con período en (p - ventana, p]:
+    # una clave creciente por (indicador, período) y sumas acumuladas
+    if n:
+        relativo = numero - numero.min()
+        clave = g * (int(relativo.max()) + ventana + 1) + relativo
+        inicio = np.searchsorted(clave, clave - ventana, side='right')
+        acumulado = np.concatenate(([0.0], np.cumsum(valores)))
+        posicion = np.arange(n)
+        media_movil = (acumulado[posicion + 1] - acumulado[inicio]) / (posicion + 1 - inicio)
+    else:
+        media_movil = np.zeros(0)
+
+    plan_punto = plan[g]
+    cumplimiento = np.full(n, np.nan)
+    con_plan = ~np.isnan(plan_punto) & (plan_punto != 0)
+    cumplimiento[con_plan] = valores[con_plan] / plan_punto[con_plan]
+
+    # Estados: las referencias se leen una vez por indicador y se reparten a sus puntos
+    base = construir_columnas([(i[0], 1.0, i[3], i[4]) for i in indicadores])
+    sin_valor = valores == 0
+    irregular = np.zeros(len(indicadores), dtype=bool)
+    irregular[list(base.irregulares)] = True
+    irregulares = {int(p): (valores[p], indicadores[g[p]][3], indicadores[g[p]][4])
+                   for p in np.flatnonzero(irregular[g] & ~sin_valor)}
+    estados = clasificar(Columnas(g, valores, sin_valor, base.refs[g], base.presentes[g],
+                                  base.codigos[g], irregulares))
+
+    categoria = np.full(n, len(ESTADOS), dtype=np.int64)
+    for k, estado in enumerate(ESTADOS):
+        categoria[estados == estado] = k
+    periodos_en = np.zeros((len(indicadores), len(_CATEGORIAS)), dtype=np.int64)
+    np.add.at(periodos_en, (g, categoria), 1)
+    dias_en = periodos_en * dias[:, None]
+
+    # Racha actual: tramo final de períodos consecutivos con el mismo estado
+    corte = ~anterior.copy()
+    corte[1:] |= estados[1:] != estados[:-1]
+    tramo_inicio = np.maximum.accumulate(np.where(corte, np.arange(n), 0)) if n else corte
+    ultimo = np.searchsorted(g, np.arange(len(indicadores)), side='right') - 1
+
+    resultado = []
+    for k, (id_, codigo, valor_planificado, _, tipo, dias_periodo) in enumerate(indicadores):
+        desde_k = ultimo[k - 1] + 1 if k else 0
+        tramo = slice(desde_k, ultimo[k] + 1)
+        racha = None
+        if ultimo[k] >= desde_k:
+            periodos_racha = int(ultimo[k] - tramo_inicio[ultimo[k]] + 1)
+            racha = {'estado': estados[ultimo[k]], 'periodos': periodos_racha,
+                     'dias': periodos_racha * dias_periodo}
+        resultado.append({
+            'id': id_, 'codigo': codigo, 'tipo': tipo, 'dias_periodo': dias_periodo,
+            'valor_planificado': valor_planificado,
+            'serie': {
+                'periodo': [str(p) for p in periodos[tramo]],
+                'valor': _lista(valores[tramo]),
+                'media_movil': _lista(media_movil[tramo]),
+                'variacion': _lista(variacion[tramo]),
+                'variacion_pct': _lista(variacion_pct[tramo]),
+                'cumplimiento': _lista(cumplimiento[tramo]),
+                'estado': estados[tramo].tolist(),
+            },
+            'tiempo_en_estado': dict(zip(_CATEGORIAS, dias_en[k].tolist())),
+            'racha': racha,
+        })
+    return {'ventana': ventana, 'puntos': n, 'indicadores': resultado,
+            'tiempo_en_estado': dict(zip(_CATEGORIAS, dias_en.sum(axis=0).tolist()))}
+
+
+class CacheAnalitica:
+    """Resultados por consulta, descartados cuando cambia alguno de sus indicadores"""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular_, huella_=None):
+        """Devuelve el resultado de ``clave``; ``calcular_()`` da ``(resultado, ids)`` si falta
+
+        ``huella_()`` resume el estado compartido del que depende el resultado:
+        si cambia al revalidarlo, otro proceso modificó los datos y se recalcula.
+        """
+        configuracion = current_app.config
+        verificacion = configuracion.get('ANALITICA_VERIFICACION', VERIFICACION_POR_DEFECTO)
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and ahora >= entrada[4]:
+                del self._entradas[clave]
+                entrada = None
+            if entrada is not None and (huella_ is None or ahora < entrada[3]):
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            generacion = self._generacion
+
+        huella = huella_() if huella_ is not None else None
+        with self._lock:
+            if entrada is not None and huella == entrada[2] and self._entradas.get(clave) is entrada:
+                self._entradas[clave] = (*entrada[:3], ahora + verificacion, entrada[4])
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+        resultado, ids = calcular_()
+        with self._lock:
+            # Si algo cambió mientras se calculaba, el resultado se entrega pero no se guarda
+            if generacion == self._generacion:
+                self._entradas[clave] = (resultado, frozenset(ids), huella, ahora + verificacion,
+                                         ahora + configuracion.get('ANALITICA_TTL', TTL_POR_DEFECTO))
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+        return resultado
+
+    def invalidar_ids(self, ids):
+        """Descarta los resultados que incluyen alguno de los indicadores"""
+        ids = set(ids)
+        with self._lock:
+            self._generacion += 1
+            for clave in [c for c, entrada in self._entradas.items() if not entrada[1].isdisjoint(ids)]:
+                del self._entradas[clave]
+
+    def invalidar(self, tabla=None):
+        with self._lock:
+            self._generacion += 1
+            self._entradas.clear()
+
+
+cache_analitica = CacheAnalitica()
+
+# Las reglas y la duración de los períodos afectan a todos los resultados
+for _tabla in (ComparisonType.__tablename__, Periodicity.__tablename__):
+    suscribir(_tabla, cache_analitica.invalidar)
+
+
+def huella(indicador_id, subarbol=False):
+    """Número y último período de las mediciones, y número y ``updated_at`` máximo de los indicadores"""
+    ids = _ids_consultados(indicador_id, subarbol)
+    mediciones = db.session.execute(
+        select(func.count(), func.max(IndicatorMeasurement.periodo_inicio))
+        .where(IndicatorMeasurement.indicator_id.in_(ids))).one()
+    indicadores = db.session.execute(
+        select(func.count(Indicator.id), func.max(Indicator.updated_at)).where(Indicator.id.in_(ids))).one()
+    return (*mediciones, *indicadores)
+
+
+def analizar(indicador_id, ventana=VENTANA_POR_DEFECTO, subarbol=False, desde=None):
+    """Analítica del indicador (o de su subárbol) con caché; lanza ValueError si la ventana no es válida"""
+    if not 1 <= ventana <= MAX_VENTANA:
+        raise ValueError(f'La ventana debe estar entre 1 y {MAX_VENTANA}')
+
+    def calcular_():
+        indicadores, g, periodos, valores = cargar(indicador_id, subarbol, desde)
+        # El propio indicador cuenta aunque no exista aún: su alta también invalida
+        return calcular(indicadores, g, periodos, valores, ventana), [indicador_id, *(i[0] for i in indicadores)]
+
+    return cache_analitica.obtener((indicador_id, bool(subarbol), ventana, desde), calcular_,
+                                   lambda: huella(indicador_id, subarbol))
+
+
+def marcar_series(session, ids):
+    """Registra indicadores cuya serie o datos cambiaron fuera del ORM, para invalidar al confirmar"""
+    session.info.setdefault('analitica_pendientes', set()).update(id_ for id_ in ids if id_ is not None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios(session, flush_context):
+    ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Indicator):
+            # El padre también: un indicador que entra en su subárbol cambia ese resultado
+            ids.update((obj.id, obj.parent_id))
+        elif isinstance(obj, IndicatorMeasurement):
+            ids.add(obj.indicator_id)
+    if ids:
+        marcar_series(session, ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_al_confirmar(session):
+    pendientes = session.info.pop('analitica_pendientes', None)
+    if pendientes:
+        cache_analitica.invalidar_ids(pendientes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_pendientes(session):
+    session.info.pop('analitica_pendientes', None)
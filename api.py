@@ -0,0 +1,209 @@
+"""API JSON (blueprint ``api``, bajo ``/api``).
+
+Los módulos de cada endpoint se importan dentro de la vista: un worker solo
+carga lo que usa y el arranque no paga por los demás (``precalentar`` los
+importa antes del fork cuando se precarga la aplicación).
+"""
+import io
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy.exc import SQLAlchemyError
+
+from busqueda import buscar, LIMITE_POR_DEFECTO
+from models import Indicator, OrganizationalStructure
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+def respuesta_busqueda(modelo, *criterios):
+    """Respuesta JSON paginada para los selectores con búsqueda"""
+    try:
+        filas, siguiente = buscar(modelo, request.args.get('q', '').strip(),
+                                  limite=request.args.get('limit', LIMITE_POR_DEFECTO, type=int),
+                                  cursor=request.args.get('cursor'),
+                                  contiene=request.args.get('modo') == 'contiene',
+                                  criterios=criterios)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(resultados=[{'id': f.id, 'codigo': f.codigo, 'nombre': f.nombre} for f in filas],
+                   siguiente=siguiente)
+
+@api.route('/indicadores/buscar')
+def buscar_indicadores():
+    return respuesta_busqueda(Indicator)
+
+@api.route('/estructuras/buscar')
+def buscar_estructuras():
+    return respuesta_busqueda(OrganizationalStructure, OrganizationalStructure.activo.isnot(False))
+
+@api.route('/cubo')
+def consultar_cubo():
+    import cubo
+
+    agrupar = [d for d in request.args.get('agrupar', '').split(',') if d]
+    filtros = {d: v for d, v in request.args.items() if d in cubo.DIMENSIONES and v != ''}
+    try:
+        filas = cubo.consultar(agrupar, filtros)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(agrupar=agrupar, filtros=filtros, filas=filas)
+
+@api.route('/cuadro-mando')
+def resumen_cuadro_mando():
+    import cuadro_mando
+
+    estructura_id = request.args.get('estructura', type=int)
+    # Revalidación sin calcular: el ETag depende solo de la versión de datos
+    etag, modificado = cuadro_mando.cache_resumen.etag(estructura_id)
+    respuesta = Response(mimetype='application/json')
+    respuesta.set_etag(etag)
+    respuesta.last_modified = modificado
+    respuesta.cache_control.no_cache = True
+    if respuesta.make_conditional(request).status_code == 304:
+        return respuesta
+
+    datos, etag, modificado = cuadro_mando.resumen(estructura_id)
+    respuesta = jsonify(datos)
+    if etag is not None:
+        respuesta.set_etag(etag)
+    respuesta.last_modified = modificado
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+@api.route('/eventos')
+def flujo_eventos():
+    import eventos
+
+    # Un hilo por cliente: para muchos paneles, ``flask kpi events`` sirve la misma ruta con asyncio
+    filtro = eventos.crear_filtro(perspective_id=request.args.get('perspectiva', type=int),
+                                  estructura_id=request.args.get('estructura', type=int))
+    desde_id = eventos.leer_ultimo(request.headers.get('Last-Event-ID') or request.args.get('ultimo'))
+    return Response(stream_with_context(eventos.flujo(filtro, desde_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/geo')
+def buscar_geo():
+    import geografia
+
+    try:
+        bbox = request.args.get('bbox')
+        rectangulo = tuple(float(v) for v in bbox.split(',')) if bbox else None
+        if rectangulo is not None and len(rectangulo) != 4:
+            raise ValueError('bbox debe ser min_lon,min_lat,max_lon,max_lat')
+        lat, lon = request.args.get('lat', type=float), request.args.get('lon', type=float)
+        resultado = geografia.buscar(
+            rectangulo=rectangulo,
+            centro=(lat, lon) if lat is not None and lon is not None else None,
+            radio_km=request.args.get('radio_km', type=float),
+            provincia=request.args.get('provincia') or None,
+            limite=request.args.get('limit', geografia.LIMITE_POR_DEFECTO, type=int))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(resultado)
+
+@api.route('/indicadores/<int:id>/historial')
+def historial_indicador(id):
+    import historial
+
+    try:
+        desde = request.args.get('desde')
+        hasta = request.args.get('hasta')
+        filas, siguiente = historial.consultar(
+            id, campo=request.args.get('campo') or None,
+            desde=datetime.fromisoformat(desde) if desde else None,
+            hasta=datetime.fromisoformat(hasta) if hasta else None,
+            cursor=request.args.get('cursor'),
+            limite=request.args.get('limit', historial.LIMITE_POR_DEFECTO, type=int))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(cambios=[{'id': f.id, 'campo': f.campo_modificado, 'valor_anterior': f.valor_anterior,
+                             'valor_nuevo': f.valor_nuevo, 'fecha': f.fecha_cambio.isoformat(),
+                             'usuario': f.usuario} for f in filas],
+                   siguiente=siguiente)
+
+@api.route('/indicadores/<int:id>/analitica')
+def analitica_indicador(id):
+    import analitica
+
+    try:
+        desde = request.args.get('desde')
+        resultado = analitica.analizar(
+            id, ventana=request.args.get('ventana', analitica.VENTANA_POR_DEFECTO, type=int),
+            subarbol=request.args.get('subarbol', '') in ('1', 'true', 'si'),
+            desde=datetime.fromisoformat(desde).date() if desde else None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(resultado)
+
+@api.route('/telemetria', methods=['POST'])
+def recibir_telemetria():
+    import telemetria
+
+    if request.is_json:
+        datos = request.get_json(silent=True)
+        if datos is None:
+            return jsonify({'error': 'JSON no válido'}), 400
+        lecturas = datos if isinstance(datos, list) else [datos]
+    else:
+        # NDJSON: una lectura por línea, leída a medida que llega
+        lecturas = (linea for linea in request.stream if linea.strip())
+    telemetria.volcador.iniciar(current_app._get_current_object())
+    return jsonify(telemetria.registrar(lecturas, telemetria.coalescedor)), 202
+
+@api.route('/indicadores/actualizar', methods=['POST'])
+def actualizar_indicadores():
+    import actualizacion
+
+    datos = request.get_json(silent=True)
+    elementos = datos.get('indicadores') if isinstance(datos, dict) else datos
+    if not isinstance(elementos, list):
+        return jsonify({'error': "Se espera una lista de indicadores (o {'indicadores': [...]})"}), 400
+    if len(elementos) > actualizacion.MAX_ELEMENTOS:
+        return jsonify({'error': f'Máximo {actualizacion.MAX_ELEMENTOS} indicadores por petición'}), 413
+    try:
+        return jsonify(actualizacion.actualizar(elementos))
+    except SQLAlchemyError as e:
+        return jsonify({'error': f'Error de base de datos: {str(e)}'}), 500
+
+@api.route('/simulacion', methods=['POST'])
+def simular_cambios():
+    import simulacion
+
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict):
+        return jsonify({'error': 'Se esperaba un objeto JSON'}), 400
+    indicadores = datos.get('indicadores') or []
+    if not isinstance(indicadores, list):
+        return jsonify({'error': "'indicadores' debe ser una lista"}), 400
+    if len(indicadores) > simulacion.MAX_ELEMENTOS:
+        return jsonify({'error': f'Máximo {simulacion.MAX_ELEMENTOS} indicadores por petición'}), 413
+    try:
+        resultado = simulacion.simular(indicadores, tipos=datos.get('tipos'), perspectivas=datos.get('perspectivas'),
+                                       limite=request.args.get('limit', simulacion.LIMITE_POR_DEFECTO, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(resultado)
+
+@api.route('/indicadores/importar', methods=['POST'])
+def importar_indicadores():
+    from importacion import importar, leer_registros, MAX_ERRORES, TAMANO_LOTE
+
+    archivo = request.files.get('archivo')
+    if archivo is None:
+        return jsonify({'error': "Falta el archivo (campo 'archivo')"}), 400
+    formato = request.form.get('formato') or (
+        'jsonl' if (archivo.filename or '').endswith(('.jsonl', '.ndjson')) else 'csv')
+    if formato not in ('csv', 'jsonl'):
+        return jsonify({'error': f'Formato no soportado: {formato}'}), 400
+
+    errores = []
+    def al_error(detalle):
+        if len(errores) < MAX_ERRORES:
+            errores.append(detalle)
+
+    texto = io.TextIOWrapper(archivo.stream, encoding='utf-8', newline='')
+    resumen = importar(leer_registros(texto, formato),
+                       tamano_lote=request.form.get('batch_size', TAMANO_LOTE, type=int),
+                       al_error=al_error)
+    resumen['detalle_errores'] = errores
+    return jsonify(resumen)
@@ -1,116 +1,105 @@
-from flask import Flask, render_template, redirect, request, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from forms import KPIForm
-from extensions import Config
-from models import db, Indicator, Perspective, AggregationMethod, ComparisonType, Periodicity, OrganizationalStructure
+"""Fábrica de la aplicación.
+
+``create_app`` registra los blueprints de vistas HTML (``vistas``) y de API
+(``api``); los módulos pesados de cada endpoint se importan al usarlos. En
+despliegues con varios workers conviene precargar la aplicación en el
+proceso maestro para que los workers hereden módulos y cachés ya calientes:
+
+    CACHE_WARMUP=True gunicorn --preload -w 8 'app:create_app()'
+
+La creación de tablas ya no ocurre al arrancar: ``flask kpi init-db`` crea
+el esquema en una base de datos nueva y ``alembic upgrade head`` pone al día
+una existente.
+
+``DATABASE_URL`` es obligatoria: sin ella la aplicación no arranca, para no
+servir en silencio desde un SQLite vacío. En desarrollo (``KPI_DESARROLLO=True``
+o ``FLASK_DEBUG``) se usa SQLite en ``instance/kpis.db``.
+"""
+import gc
 import os
-from dotenv import load_dotenv
-from sqlalchemy.exc import SQLAlchemyError
-
-load_dotenv()
-
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
-
-# Funciones auxiliares para obtener opciones de la BD
-def get_perspective_choices():
-    return [(p.id, p.nombre) for p in Perspective.query.order_by(Perspective.nombre).all()]
-
-def get_aggregation_method_choices():
-    return [(m.id, m.nombre) for m in AggregationMethod.query.order_by(AggregationMethod.nombre).all()]
-
-def get_comparison_type_choices():
-    return [(t.id, t.nombre) for t in ComparisonType.query.order_by(ComparisonType.nombre).all()]
-
-def get_periodicity_choices():
-    return [(p.id, p.nombre) for p in Periodicity.query.order_by(Periodicity.nombre).all()]
-
-def get_organizational_structure_choices():
-    return [(o.id, o.nombre) for o in OrganizationalStructure.query.order_by(OrganizationalStructure.nombre).all()]
-
-def get_parent_kpi_choices():
-    return [(k.id, k.nombre) for k in Indicator.query.order_by(Indicator.nombre).all()]
-
-@app.route('/')
-def index():
-    return redirect(url_for('list_kpis'))
-
-@app.route('/kpis')
-def list_kpis():
-    kpis = Indicator.query.all()
-    return render_template('list_kpis.html', kpis=kpis)
-
-@app.route('/kpi/create', methods=['GET', 'POST'])
-def create_kpi():
-    form = KPIForm()
-
-    # Poblar todos los campos select
-    form.perspective.choices = [('', '-- Seleccione Perspectiva --')] + [(p.id, p.nombre) for p in Perspective.query.order_by(Perspective.nombre).all()]
-    form.aggregation_method.choices = [('', '-- Seleccione Método --')] + get_aggregation_method_choices()
-    form.comparison_type.choices = [('', '-- Seleccione Tipo --')] + get_comparison_type_choices()
-    form.periodicity.choices = [('', '-- Seleccione Periodicidad --')] + get_periodicity_choices()
-    form.organizational_structure_id.choices = [('', '-- Ninguna --')] + get_organizational_structure_choices()
-    form.parent_id.choices = [('', '-- Ninguno --')] + get_parent_kpi_choices()
-
-    if form.validate_on_submit():
-        try:
-            kpi = Indicator(
-                name=form.nombre.data,
-                perspective_id=form.perspective.data,
-                aggregation_method_id=form.aggregation_method.data,
-                comparison_type_id=form.comparison_type.data,
-                periodicity_id=form.periodicity.data,
-                organizational_structure_id=form.organizational_structure_id.data if form.organizational_structure_id.data else None,
-                parent_id=form.parent_id.data if form.parent_id.data else None,
-                target_value=float(form.target_value.data) if form.target_value.data else None,
-                min_value=float(form.min_value.data) if form.min_value.data else None,
-                max_value=float(form.max_value.data) if form.max_value.data else None
-            )
-            
-            db.session.add(kpi)
-            db.session.commit()
-            flash('KPI creado exitosamente!', 'success')
-            return redirect(url_for('list_kpis'))
-            
-        except ValueError as e:
-            db.session.rollback()
-            flash(f'Error en valores numéricos: {str(e)}', 'danger')
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            flash(f'Error de base de datos: {str(e)}', 'danger')
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error inesperado: {str(e)}', 'danger')
-
-    return render_template('create_kpi.html', form=form)
-
-@app.route('/kpi/edit/<int:id>', methods=['GET', 'POST'])
-def edit_kpi(id):
-    kpi = Indicator.query.get_or_404(id)
-    form = KPIForm(obj=kpi)
-    
-    # Poblar los mismos campos que en create
-    form.perspective.choices = get_perspective_choices()
-    form.aggregation_method.choices = get_aggregation_method_choices()
-    form.comparison_type.choices = get_comparison_type_choices()
-    form.periodicity.choices = get_periodicity_choices()
-    form.organizational_structure_id.choices = [('', '-- Ninguna --')] + get_organizational_structure_choices()
-    form.parent_id.choices = [('', '-- Ninguno --')] + get_parent_kpi_choices()
-
-    if form.validate_on_submit():
-        try:
-            form.populate_obj(kpi)
-            db.session.commit()
-            flash('KPI actualizado exitosamente!', 'success')
-            return redirect(url_for('list_kpis'))
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al actualizar KPI: {str(e)}', 'danger')
-
-    return render_template('edit_kpi.html', form=form, kpi=kpi)
 
-if __name__ == '__main__':
+from flask import Flask
+
+from comandos import kpi_cli
+from extensions import BD_DESARROLLO, Config, db
+from metricas import instrumentar
+import fragmentos
+# Módulos con listeners de sesión: deben estar cargados antes del primer commit
+import agregacion  # registra el recálculo jerárquico al confirmar cambios
+import cubo  # mantiene las dimensiones del cubo de indicadores
+import eventos  # registra las transiciones de estado de los indicadores
+import geografia  # mantiene las columnas espaciales de los indicadores
+import historial  # registra los cambios de indicadores en indicator_history
+import jerarquia  # mantiene la tabla de cierre de estructuras organizacionales
+
+# Módulos que las vistas importan bajo demanda y que ``precalentar`` carga antes del fork
+MODULOS_DIFERIDOS = ('forms', 'exportacion', 'importacion', 'actualizacion', 'mediciones', 'analitica',
+                     'cuadro_mando', 'simulacion', 'telemetria')
+
+def create_app(config=None):
+    """Crea la aplicación; ``config`` es una clase de configuración o un dict que se aplica sobre ``Config``"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    if not app.config.get('SQLALCHEMY_DATABASE_URI'):
+        if not (app.config.get('DESARROLLO') or app.debug):
+            raise RuntimeError('Falta DATABASE_URL (KPI_DESARROLLO=True usa SQLite en instance/kpis.db)')
+        app.config['SQLALCHEMY_DATABASE_URI'] = BD_DESARROLLO
+
+    db.init_app(app)
+    app.cli.add_command(kpi_cli)
+    instrumentar(app)
+    fragmentos.configurar(app)
+
+    from api import api
+    from vistas import kpis
+    app.register_blueprint(kpis)
+    app.register_blueprint(api)
+
+    if app.config.get('CACHE_WARMUP'):
+        precalentar(app)
+    return app
+
+def precalentar(app):
+    """Carga módulos diferidos, catálogos, reglas y plantillas, y cierra las conexiones
+
+    Pensado para el proceso maestro antes del fork: los workers heredan todo
+    por copy-on-write y abren sus propias conexiones al primer uso.
+    """
+    import importlib
+
+    from catalogos import CATALOGOS, opciones
+    from models import ComparisonType
+    from reglas import cache_reglas
+
+    for nombre in MODULOS_DIFERIDOS:
+        importlib.import_module(nombre)
+
     with app.app_context():
-        db.create_all()
-    app.run(debug=os.getenv('FLASK_DEBUG', 'False') == 'True')
\ No newline at end of file
+        for tabla in CATALOGOS:
+            opciones(tabla)
+        for codigo in db.session.scalars(db.select(ComparisonType.codigo)):
+            cache_reglas.regla(codigo)
+        for plantilla in app.jinja_env.list_templates():
+            app.jinja_env.get_template(plantilla)
+        db.session.remove()
+        # Un worker no debe reutilizar sockets abiertos por el maestro
+        for engine in db.engines.values():
+            engine.dispose()
+
+    # Objetos ya creados fuera del recolector: el GC de los workers no los toca (menos copias de páginas)
+    gc.freeze()
+
+def __getattr__(nombre):
+    """``app`` se crea al pedirlo (``from app import app``, ``flask run``), no al importar el módulo"""
+    if nombre == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+if __name__ == '__main__':
+    create_app().run(debug=os.getenv('FLASK_DEBUG', 'False') == 'True')
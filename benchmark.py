@@ -0,0 +1,401 @@
+"""Benchmarks reproducibles con datos sintéticos.
+
+Crea una base de datos (SQLite temporal por defecto, o la de ``--database``)
+con un catálogo sintético determinista, mide las operaciones principales de
+la aplicación y escribe el resultado en JSON. Con ``--comparar`` se contrasta
+contra una ejecución anterior y se termina con código 1 si alguna medición
+empeora más que ``--umbral``.
+
+    python benchmark.py --indicadores 20000 --salida base.json
+    python benchmark.py --indicadores 20000 --comparar base.json --umbral 0.25
+
+También mide el arranque: un proceso nuevo (importar, ``create_app`` y
+primera petición) y un worker creado con fork desde un maestro precargado,
+que es lo que hace ``gunicorn --preload``. El objetivo de arranque vale
+para ese camino: si la mediana del worker supera ``--objetivo-arranque``, si
+el worker no heredó los módulos precargados o si no se puede medir (sin
+``os.fork``), el código de salida es 1. ``--objetivo-arranque 0`` lo desactiva.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def generar_datos(db, indicadores=5000, estructuras=500, ramas=4, profundidad_kpi=4, equipos=1000,
+                  semilla=42):
+    """Puebla la base de datos con un catálogo sintético determinista"""
+    from sqlalchemy import insert, update
+
+    from models import (Indicator, Perspective, ComparisonType, Periodicity, AggregationMethod,
+                        OrganizationalStructure, HierarchyLevel, EquipoFisico, indicator_equipment)
+    from geografia import columnas_coordenadas
+    from reglas import FORMULAS_BASE
+
+    azar = random.Random(semilla)
+    sesion = db.session
+
+    perspectivas = [('FIN', 'Financiera', '#2ecc71'), ('CLI', 'Clientes', '#3498db'),
+                    ('PRO', 'Procesos internos', '#f1c40f'), ('APR', 'Aprendizaje', '#9b59b6')]
+    sesion.execute(insert(Perspective), [{'codigo': c, 'nombre': n, 'color_hex': color, 'orden': i}
+                                         for i, (c, n, color) in enumerate(perspectivas)])
+    sesion.execute(insert(ComparisonType), [{'codigo': c, 'nombre': c, 'descripcion': c,
+                                             'formula_evaluacion': f} for c, f in FORMULAS_BASE.items()])
+    sesion.execute(insert(AggregationMethod), [{'codigo': c, 'nombre': c} for c in ('SUM', 'AVG', 'WAVG')])
+    sesion.execute(insert(Periodicity), [{'codigo': c, 'nombre': c, 'dias': d} for c, d in
+                                         (('DIARIA', 1), ('SEMANAL', 7), ('MENSUAL', 30),
+                                          ('TRIMESTRAL', 90), ('ANUAL', 365))])
+
+    # Árbol organizacional por niveles: cada nodo tiene hasta ``ramas`` hijos
+    niveles = []
+    nivel, padres, creadas = 0, [None], 0
+    while creadas < estructuras:
+        nivel += 1
+        niveles.append({'codigo': f'N{nivel}', 'nombre': f'Nivel {nivel}', 'nivel': nivel})
+        filas = []
+        for padre in padres:
+            for _ in range(1 if padre is None else ramas):
+                if creadas + len(filas) >= estructuras:
+                    break
+                filas.append({'codigo': f'E{creadas + len(filas)}', 'nombre': f'Estructura {creadas + len(filas)}',
+                              'parent_id': padre, 'nivel': nivel, 'activo': True})
+        sesion.execute(insert(HierarchyLevel), [niveles[-1]])
+        nivel_id = sesion.query(HierarchyLevel.id).filter_by(codigo=f'N{nivel}').scalar()
+        for fila in filas:
+            fila['level_id'] = nivel_id
+            del fila['nivel']
+        sesion.execute(insert(OrganizationalStructure), filas)
+        creadas += len(filas)
+        padres = [id_ for (id_,) in sesion.query(OrganizationalStructure.id)
+                  .filter(OrganizationalStructure.codigo.in_([f['codigo'] for f in filas]))]
+
+    ids = lambda modelo: [id_ for (id_,) in sesion.query(modelo.id).order_by(modelo.id)]
+    ids_perspectivas, ids_periodicidades = ids(Perspective), ids(Periodicity)
+    ids_metodos, ids_estructuras = ids(AggregationMethod), ids(OrganizationalStructure)
+    tipos = dict(sesion.query(ComparisonType.codigo, ComparisonType.id))
+
+    def referencias(tipo):
+        a, b = sorted(azar.uniform(0, 100) for _ in range(2))
+        if tipo == 'TYPE1':
+            return {'ref1': b, 'ref2': a}
+        if tipo == 'TYPE2':
+            return {'ref1': a, 'ref2': b}
+        r = sorted(azar.uniform(0, 100) for _ in range(4))
+        return {'ref1': r[2], 'ref2': r[1], 'ref3': r[3], 'ref4': r[0]}
+
+    filas = []
+    for i in range(indicadores):
+        tipo = azar.choice(list(tipos))
+        filas.append({
+            'codigo': f'KPI{i:07d}', 'nombre': f'Indicador {azar.randrange(10 ** 6):06d} {i}',
+            'unidad_medida': azar.choice(['%', 'CUP', 'u', 'h']),
+            'perspective_id': azar.choice(ids_perspectivas), 'comparison_type_id': tipos[tipo],
+            'periodicity_id': azar.choice(ids_periodicidades), 'aggregation_method_id': azar.choice(ids_metodos),
+            'estructura_jerarquica_id': azar.choice(ids_estructuras),
+            'valor_real': azar.choice([None, azar.uniform(0, 100)]) if azar.random() < 0.1 else azar.uniform(0, 100),
+            'valor_planificado': azar.uniform(50, 100), 'referencias': referencias(tipo),
+            'tiempo_dimension': {'año': azar.choice([2023, 2024, 2025]), 'trimestre': azar.randint(1, 4)},
+            'ubicacion_geografica': {'provincia': azar.choice(['La Habana', 'Matanzas', 'Cienfuegos',
+                                                               'Holguín', 'Santiago de Cuba'])},
+            'centro_costo': f'CC{azar.randrange(50):02d}', 'evaluacion_automatica': True,
+        })
+    sesion.execute(insert(Indicator), filas)
+    id_por_codigo = dict(sesion.query(Indicator.codigo, Indicator.id))
+
+    # Árboles de KPIs: los indicadores se reparten en capas consecutivas y el
+    # 80 % de cada capa cuelga de un indicador de la capa anterior
+    capa = max(1, indicadores // profundidad_kpi)
+    codigos = [f['codigo'] for f in filas]
+    enlaces = []
+    for i, codigo in enumerate(codigos):
+        numero = min(i // capa, profundidad_kpi - 1)
+        if numero and azar.random() < 0.8:
+            anterior = codigos[(numero - 1) * capa:numero * capa]
+            enlaces.append({'id': id_por_codigo[codigo], 'parent_id': id_por_codigo[azar.choice(anterior)]})
+    if enlaces:
+        sesion.execute(update(Indicator), enlaces)
+
+    equipos_nuevos = []
+    for i in range(equipos):
+        coordenadas = f'{azar.uniform(19.8, 23.2):.5f},{azar.uniform(-84.9, -74.1):.5f}'
+        equipos_nuevos.append(dict({'codigo_activo': f'ACT{i:07d}', 'nombre': f'Equipo {i}',
+                                    'estructura_id': azar.choice(ids_estructuras), 'coordenadas': coordenadas,
+                                    'estado': 'OPERATIVO'}, **columnas_coordenadas(coordenadas)))
+    sesion.execute(insert(EquipoFisico), equipos_nuevos)
+    ids_indicadores = list(id_por_codigo.values())
+    vinculos = {(id_equipo, azar.choice(ids_indicadores))
+                for id_equipo in ids(EquipoFisico) for _ in range(azar.randint(1, 3))}
+    if vinculos:
+        sesion.execute(insert(indicator_equipment), [{'equipo_id': e, 'indicator_id': i} for e, i in vinculos])
+    sesion.commit()
+
+    from agregacion import recalcular_todo
+    from cubo import reconstruir
+    from evaluacion_lote import reevaluar
+    from jerarquia import reconstruir_cierre
+
+    reconstruir_cierre()
+    recalcular_todo()
+    sesion.commit()
+    reevaluar()
+    reconstruir()
+    sesion.commit()
+
+
+def medir(funcion, repeticiones):
+    """Ejecuta ``funcion`` varias veces y devuelve estadísticas en milisegundos"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return _estadisticas(tiempos)
+
+
+def _estadisticas(tiempos):
+    """Mínimo, mediana, p95 y máximo de una lista de tiempos en milisegundos"""
+    tiempos = sorted(tiempos)
+    return {'repeticiones': len(tiempos), 'min_ms': tiempos[0], 'mediana_ms': statistics.median(tiempos),
+            'p95_ms': tiempos[min(len(tiempos) - 1, int(round(0.95 * (len(tiempos) - 1))))],
+            'max_ms': tiempos[-1]}
+
+
+def ejecutar(app, db, repeticiones=20):
+    """Mide las operaciones de la aplicación sobre los datos ya generados"""
+    from sqlalchemy.orm import joinedload
+
+    from busqueda import buscar
+    from catalogos import cache_catalogos, opciones
+    from evaluacion_lote import evaluar_lote
+    from models import Indicator, OrganizationalStructure, Perspective
+
+    cliente = app.test_client()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    def get(url):
+        def peticion():
+            respuesta = cliente.get(url)
+            assert respuesta.status_code == 200, (url, respuesta.status_code)
+        return peticion
+
+    with app.app_context():
+        perspectiva = db.session.query(Perspective.id).order_by(Perspective.id).limit(1).scalar()
+        estructura = db.session.query(OrganizationalStructure.id).order_by(OrganizationalStructure.id).limit(1).scalar()
+        formulario = {'perspective': perspectiva, 'periodicity': 1, 'comparison_type': 1,
+                      'aggregation_method': 1, 'unidad_medida': '%', 'valor_real': '75',
+                      'organizational_structure_id': estructura, 'referencia1': '80', 'referencia2': '60'}
+
+    creados = iter(range(10 ** 9))
+
+    def crear():
+        n = next(creados)
+        respuesta = cliente.post('/kpi/create', data=dict(formulario, codigo=f'BENCH{n:07d}',
+                                                          nombre=f'Benchmark {n}'))
+        assert respuesta.status_code == 302, respuesta.status_code
+
+    resultados = {
+        'list_kpis': medir(get('/kpis'), repeticiones),
+        'list_kpis_filtrado': medir(get(f'/kpis?perspective={perspectiva}&estado=BIEN&q=1'), repeticiones),
+        'list_kpis_subarbol': medir(get(f'/kpis?estructura={estructura}'), repeticiones),
+        'create_kpi_get': medir(get('/kpi/create'), repeticiones),
+        'create_kpi_post': medir(crear, repeticiones),
+        'buscar_indicadores_api': medir(get('/api/indicadores/buscar?q=Indicador 1'), repeticiones),
+    }
+
+    with app.app_context():
+        def cargar():
+            return (Indicator.query.options(joinedload(Indicator.comparison_type)).all())
+
+        indicadores = cargar()
+        resultados['cargar_catalogo_indicadores'] = medir(cargar, max(1, repeticiones // 5))
+        resultados['indicator_evaluar_catalogo'] = medir(lambda: [i.evaluar() for i in indicadores],
+                                                         max(1, repeticiones // 5))
+        resultados['evaluar_lote_catalogo'] = medir(evaluar_lote, max(1, repeticiones // 5))
+
+        def catalogos():
+            for tabla in ('perspectives', 'comparison_types', 'periodicities', 'aggregation_methods',
+                          'organizational_structures'):
+                opciones(tabla)
+
+        def catalogos_en_frio():
+            cache_catalogos.invalidar()
+            catalogos()
+
+        resultados['catalogos_en_cache'] = medir(catalogos, repeticiones)
+        resultados['catalogos_en_frio'] = medir(catalogos_en_frio, repeticiones)
+        resultados['buscar_estructuras'] = medir(lambda: buscar(OrganizationalStructure, 'Estructura 1'),
+                                                 repeticiones)
+    return resultados
+
+
+# Tiempos desde el inicio del intérprete: importar, crear la aplicación y servir /kpis
+_ARRANQUE_EN_FRIO = '''
+import json, time
+inicio = time.perf_counter()
+from app import create_app
+importado = time.perf_counter()
+app = create_app()
+creado = time.perf_counter()
+assert app.test_client().get('/kpis').status_code == 200
+fin = time.perf_counter()
+print(json.dumps({'total': fin - inicio, 'importar': importado - inicio,
+                  'crear': creado - importado, 'peticion': fin - creado}))
+'''
+
+
+# Maestro precargado como con ``gunicorn --preload``, en un intérprete limpio: nada llega ya importado ni
+# caliente desde las mediciones anteriores. Cada worker con fork sirve /kpis y devuelve su tiempo.
+_ARRANQUE_PRECARGADO = '''
+import json, os, sys, time
+from app import MODULOS_DIFERIDOS, create_app
+maestro = create_app({'CACHE_WARMUP': True})
+precargados = all(nombre in sys.modules for nombre in MODULOS_DIFERIDOS)
+tiempos = []
+for _ in range(int(sys.argv[1])):
+    lectura, escritura = os.pipe()
+    inicio = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(lectura)
+        correcto = maestro.test_client().get('/kpis').status_code == 200
+        os.write(escritura, str(time.perf_counter() - inicio).encode())
+        os._exit(0 if correcto else 1)
+    os.close(escritura)
+    with os.fdopen(lectura) as f:
+        segundos = f.read()
+    _, estado = os.waitpid(pid, 0)
+    assert estado == 0, 'El worker no pudo servir /kpis'
+    tiempos.append(float(segundos))
+print(json.dumps({'precargados': precargados, 'tiempos': tiempos}))
+'''
+
+
+def medir_arranque(repeticiones=5):
+    """Arranque en frío (proceso nuevo) y de un worker con fork desde un maestro precargado"""
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    resultados = {}
+    fases = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, '-c', _ARRANQUE_EN_FRIO], capture_output=True, text=True,
+                                check=True, cwd=directorio)
+        fases.append(json.loads(salida.stdout.splitlines()[-1]))
+    resultados['arranque_en_frio'] = _estadisticas([f['total'] * 1000 for f in fases])
+    for fase in ('importar', 'crear', 'peticion'):
+        resultados['arranque_en_frio'][f'{fase}_mediana_ms'] = statistics.median(f[fase] * 1000 for f in fases)
+
+    if not hasattr(os, 'fork'):
+        return resultados
+    salida = subprocess.run([sys.executable, '-c', _ARRANQUE_PRECARGADO, str(repeticiones)], capture_output=True,
+                            text=True, check=True, cwd=directorio)
+    precarga = json.loads(salida.stdout.splitlines()[-1])
+    if not precarga['precargados']:
+        raise RuntimeError('CACHE_WARMUP no precargó los módulos diferidos en el maestro')
+    resultados['arranque_worker_fork'] = _estadisticas([t * 1000 for t in precarga['tiempos']])
+    return resultados
+
+
+def comparar(actual, base, umbral):
+    """Devuelve las mediciones cuya mediana empeora más que ``umbral`` (fracción) respecto de ``base``"""
+    regresiones = []
+    for nombre, medicion in actual['resultados'].items():
+        anterior = base.get('resultados', {}).get(nombre)
+        if anterior is None or not anterior['mediana_ms']:
+            continue
+        cambio = medicion['mediana_ms'] / anterior['mediana_ms'] - 1
+        if cambio > umbral:
+            regresiones.append({'medicion': nombre, 'base_ms': anterior['mediana_ms'],
+                                'actual_ms': medicion['mediana_ms'], 'cambio': cambio})
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--indicadores', type=int, default=5000)
+    parser.add_argument('--estructuras', type=int, default=500)
+    parser.add_argument('--ramas', type=int, default=4, help='Hijos por estructura organizacional')
+    parser.add_argument('--profundidad-kpi', type=int, default=4, help='Niveles de los árboles de KPIs')
+    parser.add_argument('--equipos', type=int, default=1000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--database', help='URI de la base de datos (por defecto, un SQLite temporal)')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, stdout)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior')
+    parser.add_argument('--umbral', type=float, default=0.25,
+                        help='Empeoramiento máximo de la mediana (0.25 = 25%%)')
+    parser.add_argument('--objetivo-arranque', type=float, default=200,
+                        help='Mediana máxima (ms) hasta la respuesta de un worker precargado (0 = sin objetivo)')
+    parser.add_argument('--repeticiones-arranque', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    temporal = None
+    if args.database is None:
+        temporal = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        temporal.close()
+        args.database = f'sqlite:///{temporal.name}'
+    # La configuración se lee al importar la aplicación
+    os.environ['DATABASE_URL'] = args.database
+
+    from app import create_app
+    from extensions import db
+
+    app = create_app()
+
+    try:
+        inicio = time.perf_counter()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            generar_datos(db, args.indicadores, args.estructuras, args.ramas, args.profundidad_kpi,
+                          args.equipos, args.semilla)
+        segundos_generacion = time.perf_counter() - inicio
+
+        import sqlalchemy
+        resultado = {
+            'meta': {'fecha': datetime.utcnow().isoformat(), 'python': platform.python_version(),
+                     'sqlalchemy': sqlalchemy.__version__, 'motor': args.database.split(':', 1)[0],
+                     'parametros': {k: v for k, v in vars(args).items()
+                                    if k not in ('database', 'salida', 'comparar')},
+                     'segundos_generacion': segundos_generacion},
+            'resultados': ejecutar(app, db, args.repeticiones),
+        }
+        resultado['resultados'].update(medir_arranque(args.repeticiones_arranque))
+    finally:
+        if temporal is not None:
+            os.unlink(temporal.name)
+
+    codigo_salida = 0
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regresiones = comparar(resultado, json.load(f), args.umbral)
+        resultado['regresiones'] = regresiones
+        for r in regresiones:
+            print(f"REGRESIÓN {r['medicion']}: {r['base_ms']:.2f} ms -> {r['actual_ms']:.2f} ms "
+                  f"({r['cambio']:+.0%})", file=sys.stderr)
+        codigo_salida = 1 if regresiones else 0
+    worker = resultado['resultados'].get('arranque_worker_fork')
+    if args.objetivo_arranque and worker is None:
+        print('ARRANQUE: sin os.fork no se puede medir el worker precargado', file=sys.stderr)
+        codigo_salida = 1
+    elif args.objetivo_arranque and worker['mediana_ms'] > args.objetivo_arranque:
+        print(f"ARRANQUE: primera respuesta de un worker en {worker['mediana_ms']:.1f} ms "
+              f"(objetivo {args.objetivo_arranque:.0f} ms)", file=sys.stderr)
+        codigo_salida = 1
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+    return codigo_salida
+
+
+if __name__ == '__main__':
+    sys.exit(main())
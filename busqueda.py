@@ -0,0 +1,57 @@
+"""Búsqueda paginada por prefijo o subcadena para los selectores de la UI.
+
+Ordena por (nombre, id) y pagina con un cursor opaco sobre la última fila
+devuelta (keyset), de modo que cada página cuesta lo mismo sin importar
+cuántas se hayan recorrido antes.
+"""
+import base64
+import json
+
+from sqlalchemy import or_, tuple_
+
+from extensions import db
+
+LIMITE_POR_DEFECTO = 20
+LIMITE_MAXIMO = 100
+
+
+def codificar_cursor(*valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """Devuelve la tupla de valores del cursor o lanza ValueError si no es válido"""
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Cursor no válido") from e
+
+
+def patron_like(texto, contiene):
+    """Patrón LIKE escapado para buscar por prefijo o por subcadena"""
+    texto = texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{texto}%' if contiene else f'{texto}%'
+
+
+def buscar(modelo, texto='', limite=LIMITE_POR_DEFECTO, cursor=None, contiene=False, criterios=()):
+    """Busca registros de ``modelo`` por ``nombre`` o ``codigo``
+
+    Devuelve ``(filas, siguiente_cursor)`` donde cada fila es (id, codigo,
+    nombre) y ``siguiente_cursor`` es ``None`` en la última página.
+    """
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    consulta = db.session.query(modelo.id, modelo.codigo, modelo.nombre).filter(*criterios)
+    if texto:
+        patron = patron_like(texto, contiene)
+        consulta = consulta.filter(or_(modelo.nombre.ilike(patron, escape='\\'),
+                                       modelo.codigo.ilike(patron, escape='\\')))
+    if cursor:
+        nombre, id_ = decodificar_cursor(cursor)
+        consulta = consulta.filter(tuple_(modelo.nombre, modelo.id) > tuple_(nombre, id_))
+
+    filas = consulta.order_by(modelo.nombre, modelo.id).limit(limite + 1).all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1].nombre, filas[-1].id)
+    return filas, siguiente
@@ -0,0 +1,45 @@
+"""Avisos de tablas modificadas una vez confirmada la transacción.
+
+Las cachés del proceso se suscriben a una tabla y se invalidan solo cuando
+un commit que la tocó termina bien. Los cambios hechos con sentencias Core
+(``update()``/``insert()`` en bloque) no pasan por el flush del ORM, así que
+quien los emite debe registrarlos con ``marcar_modificadas``.
+"""
+from collections import defaultdict
+from itertools import chain
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_suscriptores = defaultdict(list)
+
+
+def suscribir(tabla, funcion):
+    """Registra ``funcion(tabla)`` para que se llame tras cada commit que modifique la tabla"""
+    _suscriptores[tabla].append(funcion)
+    return funcion
+
+
+def marcar_modificadas(session, *tablas):
+    """Registra tablas modificadas fuera del ORM en la transacción actual"""
+    session.info.setdefault('tablas_modificadas', set()).update(tablas)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar(session, flush_context):
+    tablas = {obj.__table__.name for obj in chain(session.new, session.dirty, session.deleted)
+              if hasattr(obj, '__table__')}
+    if tablas:
+        marcar_modificadas(session, *tablas)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notificar(session):
+    for tabla in session.info.pop('tablas_modificadas', ()):
+        for funcion in _suscriptores.get(tabla, ()):
+            funcion(tabla)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar(session):
+    session.info.pop('tablas_modificadas', None)
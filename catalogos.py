@@ -0,0 +1,83 @@
+"""Caché de proceso para los catálogos de referencia.
+
+Perspectivas, tipos de comparación, periodicidades, métodos de agregación y
+estructuras organizacionales casi nunca cambian, pero el formulario de KPIs
+y las vistas de creación/edición los consultan en cada petición. Las
+opciones ``(id, nombre)`` se guardan en memoria con un TTL y se invalidan
+en cuanto se confirma un cambio en la tabla correspondiente.
+"""
+import threading
+import time
+
+from flask import current_app
+
+from cambios import suscribir
+from extensions import db
+from models import Perspective, ComparisonType, Periodicity, AggregationMethod, OrganizationalStructure
+
+TTL_POR_DEFECTO = 300
+
+CATALOGOS = {
+    modelo.__tablename__: modelo
+    for modelo in (Perspective, ComparisonType, Periodicity, AggregationMethod,
+                   OrganizationalStructure)
+}
+
+
+class CacheCatalogos:
+    """Opciones de catálogo en memoria con TTL, invalidación y contadores"""
+
+    def __init__(self):
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self._generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _ttl(self):
+        return current_app.config.get('CATALOG_CACHE_TTL', TTL_POR_DEFECTO)
+
+    def opciones(self, tabla):
+        """Devuelve la lista de (id, nombre) del catálogo ordenada por nombre"""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(tabla)
+            if entrada is not None and entrada[0] > ahora:
+                self.aciertos += 1
+                return list(entrada[1])
+            self.fallos += 1
+            generacion = self._generacion
+
+        modelo = CATALOGOS[tabla]
+        opciones = [tuple(fila) for fila in
+                    db.session.query(modelo.id, modelo.nombre).order_by(modelo.nombre)]
+        with self._lock:
+            # No guardar datos leídos antes de una invalidación concurrente
+            if generacion == self._generacion:
+                self._entradas[tabla] = (ahora + self._ttl(), opciones)
+        return list(opciones)
+
+    def invalidar(self, tabla=None):
+        """Descarta un catálogo o, sin argumentos, todos"""
+        with self._lock:
+            self._generacion += 1
+            if tabla is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(tabla, None)
+
+    def estadisticas(self):
+        with self._lock:
+            return {'aciertos': self.aciertos, 'fallos': self.fallos,
+                    'catalogos': sorted(self._entradas)}
+
+
+cache_catalogos = CacheCatalogos()
+
+for _tabla in CATALOGOS:
+    suscribir(_tabla, cache_catalogos.invalidar)
+
+
+def opciones(tabla):
+    """Atajo a ``cache_catalogos.opciones``"""
+    return cache_catalogos.opciones(tabla)
@@ -0,0 +1,211 @@
+"""Comandos de mantenimiento de KPIs (``flask kpi ...``)."""
+import click
+from flask.cli import AppGroup
+
+from extensions import db
+from models import Indicator, Perspective, Periodicity, OrganizationalStructure
+
+kpi_cli = AppGroup('kpi', help='Comandos de mantenimiento de KPIs')
+
+
+def _id_por_codigo(modelo, codigo):
+    """Resuelve el id de un catálogo a partir de su código"""
+    if codigo is None:
+        return None
+    registro = modelo.query.filter_by(codigo=codigo).first()
+    if registro is None:
+        raise click.BadParameter(f'No existe {modelo.__tablename__} con código {codigo}')
+    return registro.id
+
+
+@kpi_cli.command('init-db')
+def init_db():
+    """Crea las tablas que falten (en producción, usar las migraciones de alembic)"""
+    db.create_all()
+    click.echo('Tablas creadas')
+
+
+@kpi_cli.command('reevaluate')
+@click.option('--chunk-size', default=900, show_default=True, type=click.IntRange(min=1),
+              help='Indicadores por bloque (un UPDATE y un commit por bloque)')
+@click.option('--perspective', help='Código de la perspectiva')
+@click.option('--structure', help='Código de la estructura organizacional')
+@click.option('--periodicity', help='Código de la periodicidad')
+def reevaluate(chunk_size, perspective, structure, periodicity):
+    """Re-evalúa en bloque los indicadores con evaluación automática"""
+    from evaluacion_lote import reevaluar
+
+    resultado = reevaluar(
+        tamano_lote=chunk_size,
+        perspective_id=_id_por_codigo(Perspective, perspective),
+        estructura_id=_id_por_codigo(OrganizationalStructure, structure),
+        periodicity_id=_id_por_codigo(Periodicity, periodicity),
+    )
+    click.echo(f"{resultado['procesados']} indicadores re-evaluados en "
+               f"{resultado['segundos']:.2f}s ({resultado['filas_por_segundo']:.0f} filas/s)")
+
+
+@kpi_cli.command('rebuild-org-paths')
+def rebuild_org_paths():
+    """Regenera la tabla de cierre de la jerarquía organizacional"""
+    from jerarquia import reconstruir_cierre
+
+    filas = reconstruir_cierre()
+    db.session.commit()
+    click.echo(f'{filas} rutas de estructura organizacional regeneradas')
+
+
+@kpi_cli.command('ingest')
+@click.argument('archivo', type=click.File('r', encoding='utf-8'))
+@click.option('--batch-size', default=50000, show_default=True, type=click.IntRange(min=1),
+              help='Puntos por lote (una transacción por lote)')
+def ingest(archivo, batch_size):
+    """Carga mediciones históricas desde un CSV con columnas codigo,fecha,valor"""
+    from mediciones import ingerir, leer_csv
+
+    ids_por_codigo = dict(db.session.query(Indicator.codigo, Indicator.id))
+    rechazadas = []
+
+    def al_error(error):
+        rechazadas.append(error)
+        click.echo(f"Línea {error['linea']} ({error['codigo']}): {error['error']}", err=True)
+
+    resultado = ingerir(
+        leer_csv(archivo, ids_por_codigo, al_error), tamano_lote=batch_size,
+        progreso=lambda total: click.echo(f"... {total['recibidos']} puntos procesados"))
+    click.echo(f"{resultado['insertados']} de {resultado['recibidos']} puntos insertados "
+               f"({resultado['descartados']} descartados, {len(rechazadas)} filas rechazadas) en "
+               f"{resultado['segundos']:.2f}s ({resultado['puntos_por_segundo']:.0f} puntos/s)")
+
+
+@kpi_cli.command('import')
+@click.argument('archivo', type=click.File('r', encoding='utf-8', lazy=False))
+@click.option('--format', 'formato', type=click.Choice(['csv', 'jsonl']),
+              help='Formato del archivo (por defecto, según la extensión)')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Registros por lote (una transacción por lote)')
+def import_(archivo, formato, batch_size):
+    """Importa o actualiza indicadores (por código) desde un CSV o JSONL"""
+    from importacion import importar, leer_registros
+
+    formato = formato or ('jsonl' if archivo.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    resultado = importar(
+        leer_registros(archivo, formato), tamano_lote=batch_size,
+        al_error=lambda e: click.echo(f"Línea {e['linea']} ({e['codigo']}): {e['error']}", err=True),
+        progreso=lambda total: click.echo(f"... {total['leidos']} registros procesados"))
+    click.echo(f"{resultado['insertados']} indicadores creados, {resultado['actualizados']} "
+               f"actualizados y {resultado['errores']} registros rechazados")
+
+
+@kpi_cli.command('export')
+@click.argument('salida', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'formato', default='csv', show_default=True, type=click.Choice(['csv', 'jsonl']))
+@click.option('--perspective', help='Código de la perspectiva')
+@click.option('--structure', help='Código de la estructura organizacional (incluye su subárbol)')
+@click.option('--periodicity', help='Código de la periodicidad')
+@click.option('--status', 'estado', help='Última evaluación (BIEN, REGULAR, MAL, ...)')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Filas leídas por viaje a la base de datos')
+def export(salida, formato, perspective, structure, periodicity, estado, batch_size):
+    """Exporta los indicadores con su evaluación a CSV o JSONL (por defecto, a stdout)"""
+    import listado
+    from exportacion import exportar
+
+    criterios = listado.criterios(
+        perspective_id=_id_por_codigo(Perspective, perspective),
+        periodicity_id=_id_por_codigo(Periodicity, periodicity),
+        estructura_id=_id_por_codigo(OrganizationalStructure, structure),
+        estado=estado,
+    )
+    for trozo in exportar(formato, criterios, tamano_bloque=batch_size):
+        salida.write(trozo)
+
+
+@kpi_cli.command('rebuild-cube')
+def rebuild_cube():
+    """Regenera las dimensiones y el cubo preagregado de indicadores"""
+    from cubo import reconstruir
+
+    celdas = reconstruir()
+    db.session.commit()
+    click.echo(f'{celdas} celdas del cubo regeneradas')
+
+
+@kpi_cli.command('rebuild-geo')
+def rebuild_geo():
+    """Recalcula latitud, longitud y celda geohash de equipos e indicadores"""
+    from geografia import reconstruir
+
+    filas = reconstruir()
+    db.session.commit()
+    click.echo(f'{filas} filas con coordenadas recalculadas')
+
+
+@kpi_cli.command('scheduler')
+@click.option('--workers', default=4, show_default=True, type=click.IntRange(min=1),
+              help='Hilos que evalúan lotes en paralelo')
+@click.option('--batch-size', default=500, show_default=True, type=click.IntRange(min=1),
+              help='Indicadores por lote reservado')
+@click.option('--interval', default=60.0, show_default=True, type=click.FloatRange(min=0),
+              help='Segundos entre rondas')
+@click.option('--jitter', default=0.1, show_default=True, type=click.FloatRange(0, 1),
+              help='Variación aleatoria del intervalo (0.1 = ±10%)')
+@click.option('--lease', default=300, show_default=True, type=click.IntRange(min=1),
+              help='Segundos que dura la reserva de un lote')
+@click.option('--max-pending', type=click.IntRange(min=1),
+              help='Lotes reservados sin terminar antes de dejar de reservar (por defecto, 2 por hilo)')
+@click.option('--once', is_flag=True, help='Ejecuta una sola ronda y termina')
+def scheduler(workers, batch_size, interval, jitter, lease, max_pending, once):
+    """Evalúa solo los indicadores vencidos según su periodicidad"""
+    import signal
+
+    from flask import current_app
+    from planificador import Planificador
+
+    planificador = Planificador(current_app._get_current_object(), trabajadores=workers,
+                                tamano_lote=batch_size, intervalo=interval, jitter=jitter,
+                                duracion_reserva=lease, max_pendientes=max_pending)
+    if not once:
+        signal.signal(signal.SIGTERM, lambda *_: planificador.detener())
+        click.echo(f'Planificador {planificador.propietario} en marcha (Ctrl+C para detener)')
+    resultado = planificador.ejecutar(una_vez=once)
+    click.echo(f"{resultado['evaluados']} indicadores evaluados en {resultado['lotes']} lotes "
+               f"({resultado['errores']} con error) en {resultado['rondas']} rondas")
+
+
+@kpi_cli.command('events')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=9200, show_default=True, type=click.IntRange(1, 65535))
+@click.option('--interval', default=2.0, show_default=True, type=click.FloatRange(min=0.1),
+              help='Segundos entre consultas de eventos si no llega ningún aviso')
+def events(host, port, interval):
+    """Servidor SSE de cambios de estado (GET /api/eventos) para muchos suscriptores"""
+    import asyncio
+
+    from flask import current_app
+    from eventos import RUTA, servir
+
+    click.echo(f'Eventos SSE en http://{host}:{port}{RUTA} (Ctrl+C para detener)')
+    try:
+        asyncio.run(servir(current_app._get_current_object(), host, port, interval))
+    except KeyboardInterrupt:
+        pass
+
+
+@kpi_cli.command('telemetry')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=9100, show_default=True, type=click.IntRange(1, 65535))
+@click.option('--window', default=0.5, show_default=True, type=click.FloatRange(min=0.01),
+              help='Segundos en los que se agrupan las lecturas de un indicador antes de escribir')
+def telemetry(host, port, window):
+    """Servidor TCP de telemetría: una lectura JSON por línea (codigo_activo, valor, fecha)"""
+    import asyncio
+
+    from flask import current_app
+    from telemetria import servir
+
+    click.echo(f'Telemetría escuchando en {host}:{port} (Ctrl+C para detener)')
+    try:
+        asyncio.run(servir(current_app._get_current_object(), host, port, window))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,163 @@
+"""Resumen del cuadro de mando por perspectiva.
+
+Cuenta los indicadores BIEN/REGULAR/MAL/SIN_VALOR de cada perspectiva con
+un único GROUP BY sobre ``ultima_evaluacion``, opcionalmente limitado al
+subárbol de una estructura. Los resultados se guardan en memoria asociados
+a una versión de datos que avanza con cada commit del proceso que toca
+indicadores, perspectivas o estructuras; la versión sirve también de ETag
+para que los navegadores que consultan periódicamente reciban 304 sin
+recalcular nada.
+
+Los commits de otros procesos (otros workers, el planificador, la ingesta,
+la importación) no avisan a esta caché. Cada ``RESUMEN_VERIFICACION``
+segundos se lee una huella barata de la base de datos (último evento de
+estado y número e id máximo de indicadores): cualquier cambio de estado o
+alta/baja de indicadores hecho en otro proceso la altera y hace avanzar la
+versión. Lo que la huella no ve (renombrar una perspectiva, mover un
+indicador de estructura desde otro proceso) caduca a los ``RESUMEN_TTL``
+segundos.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from cambios import suscribir
+from extensions import db
+from jerarquia import subarbol
+from models import Indicator, IndicatorEvent, Perspective
+
+ESTADOS = ('BIEN', 'REGULAR', 'MAL', 'SIN_VALOR')
+# Los estados de error (REFERENCIAS_INCOMPLETAS, TIPO_NO_VALIDO...) se cuentan aparte
+OTROS = 'OTROS'
+MAX_ENTRADAS = 256
+VERIFICACION_POR_DEFECTO = 5  # Segundos entre lecturas de la huella
+TTL_POR_DEFECTO = 300  # Segundos de vida de un resumen
+
+# Tablas cuyos cambios alteran el resumen
+TABLAS = ('indicators', 'perspectives', 'organizational_structures', 'organizational_structure_paths')
+
+
+class CacheResumen:
+    """Resúmenes calculados por estructura, válidos mientras no cambie la versión de datos"""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas = {}
+        # La marca inicial distingue procesos: un ETag de otro proceso nunca coincide por azar
+        self._inicio = f'{time.time_ns():x}'
+        self.version = 0
+        self.modificado = datetime.now(timezone.utc).replace(microsecond=0)
+        self._huella = None
+        self._verificar = 0.0
+        self._vence = 0.0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def avanzar(self, tabla=None):
+        """Nueva versión de datos; descarta los resúmenes calculados"""
+        with self._lock:
+            self._avanzar()
+
+    def _avanzar(self):
+        self.version += 1
+        self.modificado = datetime.now(timezone.utc).replace(microsecond=0)
+        self._entradas.clear()
+
+    def sincronizar(self):
+        """Avanza la versión si caducó o si la huella de la base de datos cambió desde la última lectura"""
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora < self._verificar and ahora < self._vence:
+                return
+            self._verificar = ahora + current_app.config.get('RESUMEN_VERIFICACION', VERIFICACION_POR_DEFECTO)
+        actual = huella()
+        with self._lock:
+            if actual != self._huella or ahora >= self._vence:
+                self._huella = actual
+                self._vence = ahora + current_app.config.get('RESUMEN_TTL', TTL_POR_DEFECTO)
+                self._avanzar()
+
+    def _etag(self, version, estructura_id):
+        return f'{self._inicio}-{version}-{estructura_id or 0}'
+
+    def etag(self, estructura_id=None):
+        """ETag de la versión actual para la estructura, sin calcular el resumen"""
+        self.sincronizar()
+        with self._lock:
+            return self._etag(self.version, estructura_id), self.modificado
+
+    def obtener(self, estructura_id=None):
+        """Devuelve ``(resumen, etag, modificado)``, calculándolo si hace falta"""
+        self.sincronizar()
+        with self._lock:
+            version = self.version
+            entrada = self._entradas.get(estructura_id)
+            if entrada is not None:
+                self.aciertos += 1
+                return entrada
+            self.fallos += 1
+
+        datos = calcular(estructura_id)
+        with self._lock:
+            # Si hubo un commit mientras se calculaba, el resultado puede estar desfasado
+            if version != self.version:
+                return datos, None, self.modificado
+            entrada = (datos, self._etag(version, estructura_id), self.modificado)
+            if len(self._entradas) >= self.max_entradas:
+                self._entradas.pop(next(iter(self._entradas)))
+            self._entradas[estructura_id] = entrada
+            return entrada
+
+    def estadisticas(self):
+        with self._lock:
+            return {'version': self.version, 'aciertos': self.aciertos, 'fallos': self.fallos,
+                    'entradas': len(self._entradas)}
+
+
+cache_resumen = CacheResumen()
+
+for _tabla in TABLAS:
+    suscribir(_tabla, cache_resumen.avanzar)
+
+
+def huella():
+    """Estado compartido entre procesos que cambia con cada transición de estado o alta/baja de indicadores"""
+    return tuple(db.session.execute(select(
+        select(func.max(IndicatorEvent.id)).scalar_subquery(),
+        select(func.count(Indicator.id)).scalar_subquery(),
+        select(func.max(Indicator.id)).scalar_subquery())).one())
+
+
+def calcular(estructura_id=None):
+    """Conteo por perspectiva y estado en una sola consulta, ordenado por ``Perspective.orden``"""
+    estado = func.coalesce(Indicator.ultima_evaluacion, 'SIN_VALOR')
+    conteos = [func.sum(case((estado == e, 1), else_=0)).label(e) for e in ESTADOS]
+    condicion = Indicator.perspective_id == Perspective.id
+    if estructura_id is not None:
+        condicion &= Indicator.estructura_jerarquica_id.in_(subarbol(estructura_id))
+    consulta = (select(Perspective.id, Perspective.codigo, Perspective.nombre, Perspective.color_hex,
+                       Perspective.orden, func.count(Indicator.id).label('total'), *conteos)
+                .outerjoin(Indicator, condicion)
+                .group_by(Perspective.id, Perspective.codigo, Perspective.nombre, Perspective.color_hex,
+                          Perspective.orden)
+                .order_by(Perspective.orden, Perspective.nombre))
+
+    perspectivas = []
+    for fila in db.session.execute(consulta):
+        estados = {e: int(getattr(fila, e) or 0) for e in ESTADOS}
+        estados[OTROS] = fila.total - sum(estados.values())
+        perspectivas.append({'id': fila.id, 'codigo': fila.codigo, 'nombre': fila.nombre,
+                             'color_hex': fila.color_hex, 'orden': fila.orden, 'total': fila.total,
+                             'estados': estados})
+    totales = {e: sum(p['estados'][e] for p in perspectivas) for e in (*ESTADOS, OTROS)}
+    return {'estructura_id': estructura_id, 'perspectivas': perspectivas, 'totales': totales,
+            'total': sum(p['total'] for p in perspectivas)}
+
+
+def resumen(estructura_id=None):
+    """Atajo a ``cache_resumen.obtener``"""
+    return cache_resumen.obtener(estructura_id)
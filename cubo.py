@@ -0,0 +1,298 @@
+"""Cubo dimensional (OLAP) sobre los indicadores.
+
+Las dimensiones de cada indicador (perspectiva, periodicidad, estructura,
+año/trimestre/mes de ``tiempo_dimension``, provincia/municipio de
+``ubicacion_geografica`` y centro de costo) se extraen una sola vez al
+escribir y se guardan en ``indicator_dimensions``. ``indicator_cube`` tiene
+una fila preagregada por combinación de dimensiones; cuando cambia un
+indicador se resta su aportación anterior a la celda que deja y se suma la
+nueva a la que llega, con ``INSERT ... ON CONFLICT DO UPDATE`` de incrementos
+en la misma transacción (sin borrar ni re-agregar celdas compartidas, así
+que escritores concurrentes sobre la misma celda no chocan). Las consultas
+agrupan el cubo, no la tabla de indicadores. ``flask kpi rebuild-cube``
+recalcula las sumas desde cero.
+"""
+import hashlib
+import json
+from itertools import chain
+
+from sqlalchemy import case, delete, event, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from extensions import db
+from jerarquia import subarbol
+from models import Indicator, IndicatorCube, IndicatorDimension, OrganizationalStructure
+
+_TAMANO_BLOQUE = 900
+
+# Columnas que identifican una celda del cubo, en el orden de la clave
+COLUMNAS_CELDA = ('perspective_id', 'periodicity_id', 'estructura_id', 'anio', 'trimestre', 'mes',
+                  'provincia', 'municipio', 'centro_costo')
+
+# Dimensiones por las que se puede agrupar o filtrar y su columna en el cubo
+DIMENSIONES = {
+    'perspectiva': IndicatorCube.perspective_id,
+    'periodicidad': IndicatorCube.periodicity_id,
+    'estructura': IndicatorCube.estructura_id,
+    'nivel': OrganizationalStructure.level_id,
+    'anio': IndicatorCube.anio,
+    'trimestre': IndicatorCube.trimestre,
+    'mes': IndicatorCube.mes,
+    'provincia': IndicatorCube.provincia,
+    'municipio': IndicatorCube.municipio,
+    'centro_costo': IndicatorCube.centro_costo,
+}
+
+_ENTEROS = {'perspectiva', 'periodicidad', 'estructura', 'nivel', 'anio', 'mes'}
+
+_ESTADOS = {'BIEN': 'bien', 'REGULAR': 'regular', 'MAL': 'mal'}
+_CONTADORES = ('indicadores', 'con_valor', 'con_planificado', *_ESTADOS.values())
+
+
+def _en_bloques(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), _TAMANO_BLOQUE):
+        yield ids[inicio:inicio + _TAMANO_BLOQUE]
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _texto(valor, largo):
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return None
+    return str(valor).strip()[:largo]
+
+
+def _trimestre(valor):
+    numero = _entero(valor)
+    if numero is not None:
+        return f'Q{numero}' if 1 <= numero <= 4 else None
+    texto = _texto(valor, 10)
+    return texto.upper() if texto else None
+
+
+def dimensiones(indicador):
+    """Dimensiones y medidas de una fila de indicador, con la clave de su celda"""
+    tiempo = indicador.tiempo_dimension if isinstance(indicador.tiempo_dimension, dict) else {}
+    lugar = indicador.ubicacion_geografica if isinstance(indicador.ubicacion_geografica, dict) else {}
+    fila = {
+        'indicator_id': indicador.id,
+        'perspective_id': indicador.perspective_id,
+        'periodicity_id': indicador.periodicity_id,
+        'estructura_id': indicador.estructura_jerarquica_id,
+        'anio': _entero(tiempo.get('año', tiempo.get('anio'))),
+        'trimestre': _trimestre(tiempo.get('trimestre')),
+        'mes': _entero(tiempo.get('mes')),
+        'provincia': _texto(lugar.get('provincia'), 100),
+        'municipio': _texto(lugar.get('municipio'), 100),
+        'centro_costo': _texto(indicador.centro_costo, 50),
+        'valor_real': indicador.valor_real,
+        'valor_planificado': indicador.valor_planificado,
+        'ultima_evaluacion': indicador.ultima_evaluacion,
+    }
+    celda = json.dumps([fila[c] for c in COLUMNAS_CELDA])
+    fila['clave'] = hashlib.sha1(celda.encode()).hexdigest()
+    return fila
+
+
+# Columnas de ``indicators`` de las que se extraen las dimensiones
+_COLUMNAS_INDICADOR = (Indicator.id, Indicator.perspective_id, Indicator.periodicity_id,
+                       Indicator.estructura_jerarquica_id, Indicator.tiempo_dimension,
+                       Indicator.ubicacion_geografica, Indicator.centro_costo,
+                       Indicator.valor_real, Indicator.valor_planificado,
+                       Indicator.ultima_evaluacion)
+
+
+def _consulta_indicadores():
+    return db.session.query(*_COLUMNAS_INDICADOR)
+
+
+def _recalcular_celdas(claves, conexion):
+    """Vuelve a agregar las celdas indicadas a partir de ``indicator_dimensions``"""
+    d = IndicatorDimension
+    for bloque in _en_bloques(claves):
+        conexion.execute(delete(IndicatorCube).where(IndicatorCube.clave.in_(bloque)))
+        columnas = [getattr(d, c) for c in COLUMNAS_CELDA]
+        seleccion = (select(d.clave, *columnas,
+                            func.count(), func.count(d.valor_real), func.sum(d.valor_real),
+                            func.count(d.valor_planificado), func.sum(d.valor_planificado),
+                            *[func.sum(case((d.ultima_evaluacion == estado, 1), else_=0))
+                              for estado in ('BIEN', 'REGULAR', 'MAL')])
+                     .where(d.clave.in_(bloque))
+                     .group_by(d.clave, *columnas))
+        conexion.execute(insert(IndicatorCube).from_select(
+            ['clave', *COLUMNAS_CELDA, 'indicadores', 'con_valor', 'suma_real', 'con_planificado',
+             'suma_planificado', 'bien', 'regular', 'mal'], seleccion))
+
+
+def _insert_con_conflicto(tabla):
+    """``insert`` del dialecto actual, que admite ``on_conflict_do_update``"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(tabla)
+    return sqlite.insert(tabla)
+
+
+def _aportar(deltas, fila, signo):
+    """Suma (signo 1) o resta (signo -1) la aportación de una fila de dimensiones a su celda"""
+    delta = deltas.get(fila['clave'])
+    if delta is None:
+        delta = deltas[fila['clave']] = dict({c: fila[c] for c in COLUMNAS_CELDA}, clave=fila['clave'],
+                                             suma_real=None, suma_planificado=None,
+                                             **{c: 0 for c in _CONTADORES})
+    delta['indicadores'] += signo
+    for valor, contador, suma in ((fila['valor_real'], 'con_valor', 'suma_real'),
+                                  (fila['valor_planificado'], 'con_planificado', 'suma_planificado')):
+        if valor is not None:
+            delta[contador] += signo
+            delta[suma] = (delta[suma] or 0.0) + signo * valor
+    if fila['ultima_evaluacion'] in _ESTADOS:
+        delta[_ESTADOS[fila['ultima_evaluacion']]] += signo
+
+
+def _aplicar_deltas(deltas):
+    """Aplica los incrementos a las celdas y borra las que quedan vacías"""
+    deltas = [d for _, d in sorted(deltas.items())  # Mismo orden de bloqueo en todos los escritores
+              if any(d[c] for c in _CONTADORES) or d['suma_real'] or d['suma_planificado']]
+    if not deltas:
+        return
+    cubo = IndicatorCube.__table__
+    sentencia = _insert_con_conflicto(cubo)
+    nuevo = sentencia.excluded
+    incrementos = {c: cubo.c[c] + nuevo[c] for c in _CONTADORES}
+    for contador, suma in (('con_valor', 'suma_real'), ('con_planificado', 'suma_planificado')):
+        # Sin valores en la celda la suma vuelve a NULL (como el SUM de la reconstrucción)
+        incrementos[suma] = case((cubo.c[contador] + nuevo[contador] > 0,
+                                  func.coalesce(cubo.c[suma], 0.0) + func.coalesce(nuevo[suma], 0.0)),
+                                 else_=None)
+    db.session.execute(sentencia.on_conflict_do_update(index_elements=[cubo.c.clave], set_=incrementos), deltas)
+    for bloque in _en_bloques([d['clave'] for d in deltas]):
+        db.session.execute(delete(IndicatorCube).where(IndicatorCube.clave.in_(bloque),
+                                                       IndicatorCube.indicadores <= 0))
+
+
+def refrescar(ids):
+    """Actualiza las dimensiones de los indicadores y aplica la diferencia a sus celdas. No hace commit."""
+    d = IndicatorDimension
+    tabla = d.__table__
+    deltas = {}
+    for bloque in _en_bloques(ids):
+        # FOR UPDATE: otro escritor del mismo indicador espera y luego parte de esta versión
+        anteriores = db.session.execute(
+            select(d.indicator_id, d.clave, *[getattr(d, c) for c in COLUMNAS_CELDA],
+                   d.valor_real, d.valor_planificado, d.ultima_evaluacion)
+            .where(d.indicator_id.in_(bloque)).order_by(d.indicator_id).with_for_update()).mappings().all()
+        for fila in anteriores:
+            _aportar(deltas, fila, -1)
+
+        filas = [dimensiones(i) for i in _consulta_indicadores().filter(Indicator.id.in_(bloque))]
+        for fila in filas:
+            _aportar(deltas, fila, 1)
+        if filas:
+            sentencia = _insert_con_conflicto(tabla)
+            db.session.execute(sentencia.on_conflict_do_update(
+                index_elements=[tabla.c.indicator_id],
+                set_={c.name: sentencia.excluded[c.name] for c in tabla.c if c.name != 'indicator_id'}), filas)
+        borrados = {f['indicator_id'] for f in anteriores} - {f['indicator_id'] for f in filas}
+        if borrados:
+            db.session.execute(delete(d).where(d.indicator_id.in_(borrados)))
+    _aplicar_deltas(deltas)
+    return len(deltas)
+
+
+def reconstruir(tamano_bloque=5000, conexion=None):
+    """Regenera el cubo completo leyendo los indicadores por bloques. No hace commit.
+
+    ``conexion`` permite usarla sin aplicación (la migración que crea las tablas).
+    """
+    conexion = conexion if conexion is not None else db.session
+    conexion.execute(delete(IndicatorCube))
+    conexion.execute(delete(IndicatorDimension))
+    filas = []
+    for indicador in conexion.execute(select(*_COLUMNAS_INDICADOR).order_by(Indicator.id)
+                                      .execution_options(yield_per=tamano_bloque)):
+        filas.append(dimensiones(indicador))
+        if len(filas) == tamano_bloque:
+            conexion.execute(insert(IndicatorDimension), filas)
+            filas = []
+    if filas:
+        conexion.execute(insert(IndicatorDimension), filas)
+    _recalcular_celdas(conexion.scalars(select(IndicatorDimension.clave).distinct()).all(), conexion)
+    return conexion.scalar(select(func.count()).select_from(IndicatorCube))
+
+
+def consultar(agrupar, filtros=None):
+    """Agrupa el cubo por las dimensiones de ``agrupar`` y aplica ``filtros``
+
+    ``filtros`` es un dict dimensión -> valor; ``estructura`` incluye todo su
+    subárbol. Lanza ValueError si alguna dimensión no existe.
+    """
+    filtros = filtros or {}
+    desconocidas = (set(agrupar) | set(filtros)) - set(DIMENSIONES)
+    if desconocidas:
+        raise ValueError(f"Dimensiones no válidas: {', '.join(sorted(desconocidas))}")
+
+    columnas = [DIMENSIONES[d].label(d) for d in agrupar]
+    consulta = select(*columnas,
+                      func.sum(IndicatorCube.indicadores).label('indicadores'),
+                      func.sum(IndicatorCube.con_valor).label('con_valor'),
+                      func.sum(IndicatorCube.suma_real).label('suma_real'),
+                      func.sum(IndicatorCube.con_planificado).label('con_planificado'),
+                      func.sum(IndicatorCube.suma_planificado).label('suma_planificado'),
+                      func.sum(IndicatorCube.bien).label('bien'),
+                      func.sum(IndicatorCube.regular).label('regular'),
+                      func.sum(IndicatorCube.mal).label('mal'))
+    if 'nivel' in agrupar or 'nivel' in filtros:
+        consulta = consulta.outerjoin(OrganizationalStructure,
+                                      IndicatorCube.estructura_id == OrganizationalStructure.id)
+    else:
+        consulta = consulta.select_from(IndicatorCube)
+
+    for dimension, valor in filtros.items():
+        if dimension in _ENTEROS:
+            valor = int(valor)
+        if dimension == 'estructura':
+            consulta = consulta.where(IndicatorCube.estructura_id.in_(subarbol(valor)))
+        else:
+            consulta = consulta.where(DIMENSIONES[dimension] == valor)
+
+    consulta = consulta.group_by(*columnas).order_by(*columnas)
+    resultado = []
+    for fila in db.session.execute(consulta):
+        fila = fila._asdict()
+        fila['promedio_real'] = fila['suma_real'] / fila['con_valor'] if fila['con_valor'] else None
+        fila['cumplimiento'] = (fila['suma_real'] / fila['suma_planificado']
+                                if fila['suma_real'] is not None and fila['suma_planificado'] else None)
+        resultado.append(fila)
+    return resultado
+
+
+def marcar_indicadores(session, ids):
+    """Registra indicadores modificados fuera del ORM para refrescar el cubo al confirmar"""
+    session.info.setdefault('cubo_pendientes', set()).update(id_ for id_ in ids if id_ is not None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios(session, flush_context):
+    ids = {obj.id for obj in chain(session.new, session.dirty, session.deleted)
+           if isinstance(obj, Indicator)}
+    if ids:
+        marcar_indicadores(session, ids)
+
+
+@event.listens_for(Session, 'before_commit')
+def _refrescar_antes_de_confirmar(session):
+    session.flush()
+    pendientes = session.info.pop('cubo_pendientes', None)
+    if pendientes:
+        refrescar(pendientes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_pendientes(session):
+    session.info.pop('cubo_pendientes', None)
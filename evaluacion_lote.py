@@ -0,0 +1,203 @@
+"""Evaluación vectorizada de indicadores en lote.
+
+Reproduce exactamente los estados de ``Indicator.evaluar`` pero clasificando
+todo el catálogo de una vez con la versión vectorizada de las fórmulas de
+``reglas``, a partir de una sola consulta que trae únicamente las columnas
+necesarias.
+"""
+import time
+from collections import namedtuple
+from datetime import datetime
+from numbers import Real
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy import case, update
+
+from cambios import marcar_modificadas
+from cubo import marcar_indicadores
+from eventos import registrar_transiciones
+from extensions import db
+from models import Indicator, ComparisonType
+from reglas import cache_reglas
+
+REFERENCIAS = ('ref1', 'ref2', 'ref3', 'ref4')
+
+# Enteros por encima de este valor pierden precisión al pasar a float64
+_MAX_ENTERO_EXACTO = 2 ** 53
+
+Columnas = namedtuple('Columnas', ['ids', 'valores', 'sin_valor', 'refs', 'presentes',
+                                   'codigos', 'irregulares'])
+
+
+def _es_numero(valor):
+    """Indica si una referencia puede compararse en float64 sin cambiar el resultado"""
+    if not isinstance(valor, Real):
+        return False
+    if isinstance(valor, int) and abs(valor) > _MAX_ENTERO_EXACTO:
+        return False
+    return True
+
+
+def construir_columnas(filas):
+    """Convierte filas (id, valor_real, referencias, codigo) en arreglos columnares
+
+    Las filas cuyas referencias no son numéricas se marcan como irregulares;
+    ``clasificar`` las resuelve con la lógica fila a fila para conservar
+    exactamente el mismo resultado (incluidos los ERROR_EVALUACION).
+    """
+    n = len(filas)
+    ids = np.empty(n, dtype=np.int64)
+    valores = np.zeros(n, dtype=np.float64)
+    sin_valor = np.zeros(n, dtype=bool)
+    refs = np.zeros((n, len(REFERENCIAS)), dtype=np.float64)
+    presentes = np.zeros((n, len(REFERENCIAS)), dtype=bool)
+    codigos = np.empty(n, dtype=object)
+    irregulares = {}
+
+    for i, (id_, valor, referencias, codigo) in enumerate(filas):
+        ids[i] = id_
+        codigos[i] = codigo
+        if not valor:
+            sin_valor[i] = True
+            continue
+        valores[i] = valor
+
+        referencias = referencias or {}
+        if not isinstance(referencias, dict):
+            irregulares[i] = (valor, referencias, codigo)
+            continue
+        for j, clave in enumerate(REFERENCIAS):
+            if clave not in referencias:
+                continue
+            ref = referencias[clave]
+            if not _es_numero(ref):
+                irregulares[i] = (valor, referencias, codigo)
+                break
+            refs[i, j] = ref
+            presentes[i, j] = True
+
+    return Columnas(ids, valores, sin_valor, refs, presentes, codigos, irregulares)
+
+
+def cargar_columnas(*criterios, limite=None):
+    """Carga en una sola consulta las columnas necesarias para evaluar"""
+    filas = (db.session.query(Indicator.id, Indicator.valor_real, Indicator.referencias,
+                              ComparisonType.codigo)
+             .join(ComparisonType, Indicator.comparison_type_id == ComparisonType.id)
+             .filter(*criterios)
+             .order_by(Indicator.id)
+             .limit(limite)
+             .all())
+    return construir_columnas(filas)
+
+
+def _evaluar_fila(valor, referencias, codigo):
+    """Evalúa una fila suelta con la misma lógica de ``Indicator.evaluar``"""
+    fila = SimpleNamespace(valor_real=valor, referencias=referencias,
+                           comparison_type=SimpleNamespace(codigo=codigo))
+    return Indicator.evaluar(fila)
+
+
+def _evaluar_con_regla(regla, valor, referencias):
+    """Como ``_evaluar_fila`` pero con una regla dada, sin pasar por la caché de reglas"""
+    try:
+        return regla.evaluar(valor, referencias or {})
+    except Exception as e:
+        return f"ERROR_EVALUACION: {str(e)}"
+
+
+def clasificar(columnas, reglas=None):
+    """Devuelve un arreglo con el estado de cada fila, equivalente a ``evaluar``
+
+    Las filas se agrupan por tipo de comparación y cada grupo se clasifica
+    con la versión vectorizada de la fórmula compilada del tipo. ``reglas``
+    ({codigo: Regla}) sustituye la regla de esos tipos, p. ej. en simulaciones.
+    """
+    reglas = reglas or {}
+    estados = np.full(len(columnas.ids), 'TIPO_NO_VALIDO', dtype=object)
+    for codigo in set(columnas.codigos[~columnas.sin_valor].tolist()):
+        regla = reglas[codigo] if codigo in reglas else cache_reglas.regla(codigo)
+        if regla is None:
+            continue
+        tipo = (columnas.codigos == codigo) & ~columnas.sin_valor
+        estados[tipo] = regla.clasificar(columnas.valores[tipo], columnas.refs[tipo],
+                                         columnas.presentes[tipo])
+
+    estados[columnas.sin_valor] = 'SIN_VALOR'
+    for i, (valor, referencias, codigo) in columnas.irregulares.items():
+        if codigo in reglas:
+            estados[i] = _evaluar_con_regla(reglas[codigo], valor, referencias)
+        else:
+            estados[i] = _evaluar_fila(valor, referencias, codigo)
+    return estados
+
+
+def evaluar_lote(*criterios):
+    """Evalúa todos los indicadores que cumplen los criterios y devuelve {id: estado}"""
+    columnas = cargar_columnas(*criterios)
+    return dict(zip(columnas.ids.tolist(), clasificar(columnas).tolist()))
+
+
+def guardar_estados(estados_por_id, fecha=None):
+    """Guarda ``ultima_evaluacion`` de varios indicadores con un solo UPDATE"""
+    if not estados_por_id:
+        return
+    fecha = fecha or datetime.utcnow()
+    registrar_transiciones(estados_por_id)
+    db.session.execute(
+        update(Indicator)
+        .where(Indicator.id.in_(list(estados_por_id)))
+        .values(ultima_evaluacion=case(estados_por_id, value=Indicator.id),
+                fecha_ultima_evaluacion=fecha)
+        .execution_options(synchronize_session=False)
+    )
+    marcar_modificadas(db.session, Indicator.__tablename__)
+    marcar_indicadores(db.session, estados_por_id)
+
+
+def reevaluar_ids(ids, tamano_bloque=900):
+    """Re-evalúa los indicadores indicados que tienen evaluación automática. No hace commit."""
+    ids = list(ids)
+    for inicio in range(0, len(ids), tamano_bloque):
+        columnas = cargar_columnas(Indicator.id.in_(ids[inicio:inicio + tamano_bloque]),
+                                   Indicator.evaluacion_automatica.is_(True))
+        guardar_estados(dict(zip(columnas.ids.tolist(), clasificar(columnas).tolist())))
+
+
+def reevaluar(tamano_lote=900, perspective_id=None, estructura_id=None, periodicity_id=None):
+    """Re-evalúa en bloques los indicadores con evaluación automática
+
+    Cada bloque se clasifica con ``clasificar`` y se guarda con un único UPDATE
+    y un único commit. Devuelve un resumen con las filas procesadas, el tiempo
+    empleado y las filas por segundo.
+    """
+    criterios = [Indicator.evaluacion_automatica.is_(True)]
+    if perspective_id is not None:
+        criterios.append(Indicator.perspective_id == perspective_id)
+    if estructura_id is not None:
+        criterios.append(Indicator.estructura_jerarquica_id == estructura_id)
+    if periodicity_id is not None:
+        criterios.append(Indicator.periodicity_id == periodicity_id)
+
+    inicio = time.perf_counter()
+    procesados = 0
+    ultimo_id = None
+    while True:
+        pagina = list(criterios)
+        if ultimo_id is not None:
+            pagina.append(Indicator.id > ultimo_id)
+        columnas = cargar_columnas(*pagina, limite=tamano_lote)
+        if not len(columnas.ids):
+            break
+        guardar_estados(dict(zip(columnas.ids.tolist(), clasificar(columnas).tolist())))
+        db.session.commit()
+        procesados += len(columnas.ids)
+        ultimo_id = int(columnas.ids[-1])
+
+    segundos = time.perf_counter() - inicio
+    return {
+        'procesados': procesados,
+        'segundos': segundos,
+        'filas_por_segundo': procesados / segundos if segundos else 0.0,
+    }
@@ -0,0 +1,518 @@
+"""Flujo SSE de cambios de estado de evaluación de los indicadores.
+
+Cada vez que ``ultima_evaluacion`` cambia se inserta una fila en
+``indicator_events`` dentro de la misma transacción: desde el flush del ORM
+(``actualizar_evaluacion``, formularios) y desde ``guardar_estados`` para las
+re-evaluaciones en bloque. El id de la fila es el ``id`` del evento SSE, así
+que un cliente que reconecta con ``Last-Event-ID`` recibe exactamente lo que
+se perdió (filtrado igual que antes) mientras siga dentro de la retención;
+si no, recibe ``reinicio`` y debe recargar la tabla.
+
+El id se asigna al insertar, pero las transacciones confirman en cualquier
+orden: en PostgreSQL el evento 8 puede ser visible mientras la transacción
+del 7 sigue abierta. Los lectores avanzan con un ``Cursor`` que solo pasa
+por ids consecutivos: los eventos detrás de un hueco se retienen y se
+vuelven a leer hasta que el hueco se llena o pasan ``HORIZONTE`` segundos
+(la transacción se deshizo). Así ningún suscriptor salta un evento que
+confirma tarde, y ``Last-Event-ID`` sigue significando "todo hasta aquí".
+Un suscriptor nuevo tampoco empieza en el id máximo, sino antes del primer
+evento de los últimos ``HORIZONTE`` segundos: recibe de nuevo los ya
+confirmados de esa ventana (son estados, repetirlos no cambia nada) y
+espera a los que aún están en una transacción abierta.
+
+Los suscriptores se despiertan tras cada commit del proceso y, en
+PostgreSQL, con ``LISTEN/NOTIFY`` desde cualquier proceso; en el resto de
+motores, además, consultando la tabla cada ``intervalo`` segundos.
+
+Hay dos servidores: ``GET /api/eventos`` en la aplicación Flask (un hilo por
+cliente, para pocos paneles) y ``flask kpi events``, un servidor asyncio en
+el que cientos de suscriptores inactivos no cuestan ni un hilo: una sola
+consulta por aviso reparte los eventos nuevos a todos.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from sqlalchemy import delete, event, func, insert, inspect, select, text
+from sqlalchemy.orm import Session
+
+from extensions import db
+from jerarquia import subarbol
+from models import Indicator, IndicatorEvent
+
+logger = logging.getLogger(__name__)
+
+CANAL = 'kpi_eventos'
+RUTA = '/api/eventos'
+RETENCION = timedelta(days=1)
+MAX_REPETICION = 10000
+LATIDO = 15.0  # Segundos sin eventos antes de enviar un comentario que mantiene viva la conexión
+INTERVALO = 2.0  # Segundos entre consultas cuando no hay avisos de otros procesos
+REINTENTO_MS = 3000
+HORIZONTE = 30.0  # Segundos que se espera a un id intermedio antes de darlo por deshecho
+MAX_RECIENTES = 50000
+_TAMANO_LOTE = 900
+
+Filtro = namedtuple('Filtro', ['perspective_id', 'estructura_id', 'estructuras'])
+SIN_FILTRO = Filtro(None, None, None)
+
+
+def crear_filtro(perspective_id=None, estructura_id=None):
+    """Filtro de suscripción; el subárbol de la estructura se resuelve una vez al suscribirse"""
+    estructuras = None
+    if estructura_id is not None:
+        estructuras = frozenset(db.session.scalars(subarbol(estructura_id)))
+    return Filtro(perspective_id, estructura_id, estructuras)
+
+
+def acepta(filtro, evento):
+    if filtro.perspective_id is not None and evento['perspective_id'] != filtro.perspective_id:
+        return False
+    if filtro.estructuras is not None and evento['estructura_id'] not in filtro.estructuras:
+        return False
+    return True
+
+
+# --- Registro de eventos -----------------------------------------------------
+
+def _insertar(session, filas):
+    if not filas:
+        return
+    conexion = session.connection()
+    conexion.execute(insert(IndicatorEvent.__table__), filas)
+    if conexion.dialect.name == 'postgresql':
+        # NOTIFY se entrega al confirmar; los repetidos en una transacción se funden en uno
+        conexion.execute(text('SELECT pg_notify(:canal, \'\')'), {'canal': CANAL})
+    session.info['eventos_pendientes'] = True
+
+
+def registrar_transiciones(estados_por_id):
+    """Inserta un evento por cada indicador cuyo estado cambia. Llamar antes de guardar los estados."""
+    fecha = datetime.utcnow()
+    anteriores = db.session.execute(
+        select(Indicator.id, Indicator.ultima_evaluacion, Indicator.valor_real, Indicator.perspective_id,
+               Indicator.estructura_jerarquica_id)
+        .where(Indicator.id.in_(list(estados_por_id)))
+    ).all()
+    _insertar(db.session, [{'indicator_id': id_, 'estado_anterior': anterior, 'estado_nuevo': estados_por_id[id_],
+                            'valor_real': valor, 'perspective_id': perspectiva, 'estructura_id': estructura,
+                            'fecha': fecha}
+                           for id_, anterior, valor, perspectiva, estructura in anteriores
+                           if anterior != estados_por_id[id_]])
+
+
+def _sin_efecto(objetivo, valor, anterior, iniciador):
+    return valor
+
+
+# Como en historial: sin active_history no se conocería el estado anterior de un atributo expirado
+event.listen(Indicator.ultima_evaluacion, 'set', _sin_efecto, active_history=True, retval=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _capturar(session, flush_context):
+    filas = []
+    fecha = datetime.utcnow()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Indicator):
+            continue
+        historial = inspect(obj).attrs.ultima_evaluacion.history
+        if not historial.added:
+            continue
+        anterior = historial.deleted[0] if historial.deleted else None
+        if anterior != historial.added[0]:
+            filas.append({'indicator_id': obj.id, 'estado_anterior': anterior, 'estado_nuevo': historial.added[0],
+                          'valor_real': obj.valor_real, 'perspective_id': obj.perspective_id,
+                          'estructura_id': obj.estructura_jerarquica_id, 'fecha': fecha})
+    _insertar(session, filas)
+
+
+_condicion = threading.Condition()
+_oyentes = []
+
+
+def avisar():
+    """Despierta a los suscriptores del proceso"""
+    with _condicion:
+        _condicion.notify_all()
+    for oyente in list(_oyentes):
+        oyente()
+
+
+@event.listens_for(Session, 'after_commit')
+def _avisar_al_confirmar(session):
+    if session.info.pop('eventos_pendientes', None):
+        avisar()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar(session):
+    session.info.pop('eventos_pendientes', None)
+
+
+# --- Lectura -----------------------------------------------------------------
+
+def _como_dict(fila):
+    return {'id': fila.id, 'indicator_id': fila.indicator_id, 'anterior': fila.estado_anterior,
+            'nuevo': fila.estado_nuevo, 'valor_real': fila.valor_real, 'perspective_id': fila.perspective_id,
+            'estructura_id': fila.estructura_id, 'fecha': fila.fecha.isoformat() if fila.fecha else None}
+
+
+def leer(desde_id, filtro=SIN_FILTRO, limite=_TAMANO_LOTE, hasta_id=None):
+    """Eventos con id mayor que ``desde_id`` (y hasta ``hasta_id``) que cumplen el filtro, en orden"""
+    consulta = (select(IndicatorEvent).where(IndicatorEvent.id > desde_id)
+                .order_by(IndicatorEvent.id).limit(limite))
+    if hasta_id is not None:
+        consulta = consulta.where(IndicatorEvent.id <= hasta_id)
+    if filtro.perspective_id is not None:
+        consulta = consulta.where(IndicatorEvent.perspective_id == filtro.perspective_id)
+    if filtro.estructura_id is not None:
+        consulta = consulta.where(IndicatorEvent.estructura_id.in_(subarbol(filtro.estructura_id)))
+    return [_como_dict(fila) for fila in db.session.scalars(consulta)]
+
+
+def punto_de_partida(horizonte=HORIZONTE):
+    """Id desde el que sigue un suscriptor nuevo: el último evento anterior a los últimos ``horizonte`` segundos
+
+    Los ids posteriores pueden pertenecer a transacciones todavía abiertas;
+    empezar en el máximo los saltaría para siempre.
+    """
+    desde = datetime.utcnow() - timedelta(seconds=horizonte)
+    anterior = db.session.scalar(select(IndicatorEvent.id).where(IndicatorEvent.fecha < desde)
+                                 .order_by(IndicatorEvent.fecha.desc()).limit(1))
+    if anterior is not None:
+        return anterior
+    primero = db.session.scalar(select(func.min(IndicatorEvent.id)))
+    return primero - 1 if primero is not None else 0
+
+
+class Cursor:
+    """Último id entregado, sin huecos por detrás
+
+    Solo avanza por ids consecutivos. Ante un hueco se detiene y los
+    eventos posteriores se releen en la siguiente consulta; el hueco se
+    salta cuando lleva ``horizonte`` segundos sin llenarse.
+    """
+
+    def __init__(self, ultimo=0, horizonte=HORIZONTE):
+        self.ultimo = ultimo
+        self.horizonte = horizonte
+        self._hueco = None  # (primer id que falta, momento en que se vio)
+
+    def avanzar(self, eventos):
+        """Entregables de ``eventos`` (ids mayores que ``ultimo``, en orden); avanza el cursor"""
+        ahora = time.monotonic()
+        entregables = []
+        esperado = self.ultimo + 1
+        for evento in eventos:
+            if evento['id'] != esperado:
+                if self._hueco is None or self._hueco[0] != esperado:
+                    self._hueco = (esperado, ahora)
+                if ahora - self._hueco[1] < self.horizonte:
+                    break
+                logger.info('Eventos %d-%d sin confirmar tras %.0f s; se dan por deshechos',
+                            esperado, evento['id'] - 1, self.horizonte)
+            entregables.append(evento)
+            esperado = evento['id'] + 1
+        if entregables:
+            self.ultimo = entregables[-1]['id']
+        return entregables
+
+    def leer(self, limite=None):
+        """Eventos entregables de la tabla, sin filtrar: un filtro haría pasar por hueco lo que no cumple"""
+        eventos = []
+        while True:
+            lote = leer(self.ultimo)
+            entregables = self.avanzar(lote)
+            eventos.extend(entregables)
+            if len(lote) < _TAMANO_LOTE or len(entregables) < len(lote) or \
+                    (limite is not None and len(eventos) >= limite):
+                return eventos
+
+
+def repeticion(cursor, filtro=SIN_FILTRO):
+    """Eventos perdidos desde ``cursor.ultimo`` que cumplen el filtro; ``None`` si ya no se pueden reconstruir"""
+    primero = db.session.scalar(select(func.min(IndicatorEvent.id)))
+    if primero is not None and cursor.ultimo < primero - 1:
+        return None
+    eventos = cursor.leer(MAX_REPETICION + 1)
+    if len(eventos) > MAX_REPETICION:
+        return None
+    return [e for e in eventos if acepta(filtro, e)]
+
+
+def purgar(retencion=RETENCION):
+    """Borra los eventos más antiguos que la retención y hace commit"""
+    borrados = db.session.execute(
+        delete(IndicatorEvent).where(IndicatorEvent.fecha < datetime.utcnow() - retencion)).rowcount
+    db.session.commit()
+    return borrados
+
+
+def formatear(evento):
+    return f"id: {evento['id']}\nevent: estado\ndata: {json.dumps(evento)}\n\n"
+
+
+REINICIO = 'event: reinicio\ndata: {}\n\n'
+LATIDO_SSE = ': latido\n\n'
+
+
+def leer_ultimo(valor):
+    """Interpreta ``Last-Event-ID``; ``None`` si falta o no es un id"""
+    try:
+        return int(valor) if valor not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def inicio(filtro, desde_id, horizonte=HORIZONTE):
+    """Primeros mensajes de una suscripción y el ``Cursor`` desde el que seguir"""
+    mensajes = [f'retry: {REINTENTO_MS}\n\n']
+    if desde_id is None:
+        return mensajes, Cursor(punto_de_partida(horizonte), horizonte)
+    cursor = Cursor(desde_id, horizonte)
+    eventos = repeticion(cursor, filtro)
+    if eventos is None:
+        mensajes.append(REINICIO)
+        return mensajes, Cursor(punto_de_partida(horizonte), horizonte)
+    mensajes.extend(formatear(e) for e in eventos)
+    return mensajes, cursor
+
+
+def flujo(filtro, desde_id=None, intervalo=INTERVALO, horizonte=HORIZONTE):
+    """Generador SSE para la aplicación Flask: ocupa un hilo mientras el cliente siga conectado"""
+    mensajes, cursor = inicio(filtro, desde_id, horizonte)
+    db.session.close()
+    yield from mensajes
+    silencio = time.monotonic()
+    while True:
+        with _condicion:
+            _condicion.wait(intervalo)
+        # Se relee la tabla aunque no haya aviso: recoge los commits de otros procesos
+        eventos = [e for e in cursor.leer() if acepta(filtro, e)]
+        for evento in eventos:
+            yield formatear(evento)
+        # Sin conexión retenida mientras se espera
+        db.session.close()
+        if eventos:
+            silencio = time.monotonic()
+        elif time.monotonic() - silencio >= LATIDO:
+            yield LATIDO_SSE
+            silencio = time.monotonic()
+
+
+# --- Servidor asyncio --------------------------------------------------------
+
+class Difusor:
+    """Lee los eventos nuevos una vez por aviso y los deja en memoria para todos los suscriptores
+
+    Cada suscriptor lleva su propio cursor (el último id revisado) sobre una
+    ventana compartida de eventos recientes; solo si se queda atrás de la
+    ventana vuelve a leer de la tabla, con su filtro, hasta ``ultimo``. La
+    ventana avanza con un ``Cursor``: nunca guarda eventos detrás de un hueco.
+    Un suscriptor inactivo es una corrutina esperando un ``asyncio.Event``.
+    """
+
+    def __init__(self, app, intervalo=INTERVALO, max_recientes=MAX_RECIENTES, purga=3600, horizonte=HORIZONTE):
+        self.app = app
+        self.intervalo = intervalo
+        self.horizonte = horizonte
+        self.max_recientes = max_recientes
+        self.purga = purga
+        self.suscriptores = 0
+        self.ultimo = 0
+        self._base = 0  # Ids hasta aquí ya no están en memoria
+        self._ids = []
+        self._eventos = []
+        self._cursor = None
+        self._bucle = None
+        self._despertar = None
+        self._cambio = None
+
+    def despertar(self):
+        """Seguro desde cualquier hilo"""
+        if self._bucle is not None:
+            self._bucle.call_soon_threadsafe(self._despertar.set)
+
+    def _en_contexto(self, funcion, *args):
+        with self.app.app_context():
+            try:
+                return funcion(*args)
+            finally:
+                db.session.remove()
+
+    async def ejecutar_en_contexto(self, funcion, *args):
+        return await self._bucle.run_in_executor(None, self._en_contexto, funcion, *args)
+
+    def _nuevos(self):
+        return self._cursor.leer()
+
+    def _guardar(self, eventos):
+        self._ids.extend(e['id'] for e in eventos)
+        self._eventos.extend(eventos)
+        self.ultimo = self._ids[-1]
+        if len(self._ids) > 2 * self.max_recientes:
+            sobran = len(self._ids) - self.max_recientes
+            self._base = self._ids[sobran - 1]
+            del self._ids[:sobran], self._eventos[:sobran]
+        anterior, self._cambio = self._cambio, asyncio.Event()
+        anterior.set()
+
+    async def siguientes(self, visto, filtro):
+        """``(eventos, visto)``: los eventos posteriores a ``visto`` que cumplen el filtro"""
+        if visto >= self.ultimo:
+            return [], visto
+        if visto >= self._base:
+            eventos = self._eventos[bisect_right(self._ids, visto):]
+            return [e for e in eventos if acepta(filtro, e)], self.ultimo
+        # Demasiado atrás: se lee de la tabla hasta lo ya conocido
+        hasta = self.ultimo
+        eventos = await self.ejecutar_en_contexto(leer, visto, filtro, _TAMANO_LOTE, hasta)
+        return eventos, eventos[-1]['id'] if len(eventos) == _TAMANO_LOTE else hasta
+
+    async def esperar(self, tiempo):
+        """Espera eventos nuevos durante ``tiempo`` segundos; devuelve si llegaron"""
+        try:
+            await asyncio.wait_for(self._cambio.wait(), tiempo)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def preparar(self):
+        self._bucle = asyncio.get_running_loop()
+        self._despertar = asyncio.Event()
+        self._cambio = asyncio.Event()
+        self.ultimo = self._base = await self.ejecutar_en_contexto(punto_de_partida, self.horizonte)
+        self._cursor = Cursor(self.ultimo, self.horizonte)
+
+    async def ejecutar(self):
+        _oyentes.append(self.despertar)
+        proxima_purga = time.monotonic()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+                except asyncio.TimeoutError:
+                    pass
+                self._despertar.clear()
+                try:
+                    eventos = await self.ejecutar_en_contexto(self._nuevos)
+                    if time.monotonic() >= proxima_purga:
+                        proxima_purga = time.monotonic() + self.purga
+                        await self.ejecutar_en_contexto(purgar)
+                except Exception:
+                    logger.exception('Error leyendo eventos')
+                    continue
+                if eventos:
+                    self._guardar(eventos)
+        finally:
+            _oyentes.remove(self.despertar)
+
+
+def _escuchar(app, difusor, bucle):
+    """En PostgreSQL, despierta al difusor con cada NOTIFY sin hilos: el socket entra en el bucle"""
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            return None
+        conexion = db.engine.raw_connection()
+    conexion.driver_connection.autocommit = True
+    cursor = conexion.driver_connection.cursor()
+    cursor.execute(f'LISTEN {CANAL}')
+    cursor.close()
+    driver = conexion.driver_connection
+
+    def leer_avisos():
+        if hasattr(driver, 'poll'):  # psycopg2
+            driver.poll()
+            driver.notifies.clear()
+        else:  # psycopg 3
+            for _ in driver.notifies(timeout=0):
+                pass
+        difusor.despertar()
+
+    bucle.add_reader(driver.fileno(), leer_avisos)
+    return conexion
+
+
+async def _cabeceras(lector):
+    cabeceras = {}
+    while True:
+        linea = await lector.readline()
+        if linea in (b'\r\n', b'\n', b''):
+            return cabeceras
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        cabeceras[nombre.strip().lower()] = valor.strip()
+
+
+async def servir(app, host='0.0.0.0', puerto=9200, intervalo=INTERVALO):
+    """Servidor SSE asyncio en ``GET /api/eventos?perspectiva=&estructura=``"""
+    difusor = Difusor(app, intervalo)
+    bucle = asyncio.get_running_loop()
+
+    async def responder(escritor, estado, cuerpo):
+        escritor.write(f'HTTP/1.1 {estado}\r\nContent-Type: application/json\r\n'
+                       f'Connection: close\r\n\r\n{json.dumps(cuerpo)}'.encode())
+        await escritor.drain()
+        escritor.close()
+
+    async def atender(lector, escritor):
+        try:
+            metodo, objetivo, _ = (await lector.readline()).decode('latin-1').split(' ', 2)
+            cabeceras = await _cabeceras(lector)
+        except (ValueError, ConnectionError):
+            escritor.close()
+            return
+        url = urlsplit(objetivo)
+        if metodo != 'GET' or url.path != RUTA:
+            return await responder(escritor, '404 Not Found', {'error': 'No encontrado'})
+        args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            perspective_id = int(args['perspectiva']) if args.get('perspectiva') else None
+            estructura_id = int(args['estructura']) if args.get('estructura') else None
+        except ValueError:
+            return await responder(escritor, '400 Bad Request', {'error': 'perspectiva y estructura deben ser ids'})
+
+        filtro = await difusor.ejecutar_en_contexto(crear_filtro, perspective_id, estructura_id)
+        desde_id = leer_ultimo(cabeceras.get('last-event-id') or args.get('ultimo'))
+        mensajes, cursor = await difusor.ejecutar_en_contexto(inicio, filtro, desde_id, difusor.horizonte)
+        visto = cursor.ultimo
+        difusor.suscriptores += 1
+        try:
+            escritor.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                           b'Connection: close\r\nX-Accel-Buffering: no\r\n\r\n')
+            escritor.write(''.join(mensajes).encode())
+            await escritor.drain()
+            while True:
+                eventos, visto = await difusor.siguientes(visto, filtro)
+                if eventos:
+                    escritor.write(''.join(formatear(e) for e in eventos).encode())
+                elif visto >= difusor.ultimo and not await difusor.esperar(LATIDO):
+                    escritor.write(LATIDO_SSE.encode())
+                else:
+                    continue
+                await escritor.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            difusor.suscriptores -= 1
+            escritor.close()
+
+    await difusor.preparar()
+    conexion = _escuchar(app, difusor, bucle)
+    servidor = await asyncio.start_server(atender, host, puerto)
+    tarea = asyncio.create_task(difusor.ejecutar())
+    logger.info('Eventos SSE en %s:%s%s', host, puerto, RUTA)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        tarea.cancel()
+        if conexion is not None:
+            bucle.remove_reader(conexion.driver_connection.fileno())
+            conexion.close()
@@ -0,0 +1,108 @@
+"""Exportación en streaming del catálogo de indicadores y su evaluación.
+
+Las filas se leen con ``yield_per`` (cursor de servidor en PostgreSQL) y se
+escriben en CSV o JSONL a medida que llegan, en bloques de texto, así que la
+memoria no crece con el número de indicadores. Usa los mismos filtros que el
+listado y las columnas de ``importacion.CAMPOS``, de modo que el archivo
+exportado puede volver a importarse.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from importacion import CAMPOS
+from models import (Indicator, Perspective, ComparisonType, Periodicity, AggregationMethod,
+                    OrganizationalStructure)
+
+TAMANO_BLOQUE = 1000
+
+FORMATOS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+CAMPOS_EXPORTACION = CAMPOS + ['perspectiva_nombre', 'periodicidad_nombre', 'estructura_nombre',
+                               'ultima_evaluacion', 'fecha_ultima_evaluacion']
+
+
+def consulta(*criterios):
+    """Sentencia con las columnas exportadas y los catálogos resueltos, ordenada por id"""
+    padre = aliased(Indicator)
+    return (select(Indicator.codigo, Indicator.nombre, Indicator.unidad_medida,
+                   Perspective.codigo.label('perspectiva'),
+                   ComparisonType.codigo.label('tipo_comparacion'),
+                   Periodicity.codigo.label('periodicidad'),
+                   AggregationMethod.codigo.label('metodo_agregacion'),
+                   OrganizationalStructure.codigo.label('estructura'),
+                   padre.codigo.label('padre'),
+                   Indicator.valor_real, Indicator.valor_planificado, Indicator.referencias,
+                   Indicator.centro_costo, Indicator.tiempo_dimension,
+                   Indicator.ubicacion_geografica, Indicator.evaluacion_automatica,
+                   Perspective.nombre.label('perspectiva_nombre'),
+                   Periodicity.nombre.label('periodicidad_nombre'),
+                   OrganizationalStructure.nombre.label('estructura_nombre'),
+                   Indicator.ultima_evaluacion, Indicator.fecha_ultima_evaluacion)
+            .outerjoin(Perspective, Indicator.perspective_id == Perspective.id)
+            .outerjoin(ComparisonType, Indicator.comparison_type_id == ComparisonType.id)
+            .outerjoin(Periodicity, Indicator.periodicity_id == Periodicity.id)
+            .outerjoin(AggregationMethod, Indicator.aggregation_method_id == AggregationMethod.id)
+            .outerjoin(OrganizationalStructure,
+                       Indicator.estructura_jerarquica_id == OrganizationalStructure.id)
+            .outerjoin(padre, Indicator.parent_id == padre.id)
+            .where(*criterios)
+            .order_by(Indicator.id))
+
+
+def registros(criterios=(), tamano_bloque=TAMANO_BLOQUE):
+    """Genera un dict por indicador leyendo la base de datos por bloques"""
+    resultado = db.session.execute(consulta(*criterios).execution_options(yield_per=tamano_bloque))
+    try:
+        for fila in resultado:
+            registro = fila._asdict()
+            if registro['fecha_ultima_evaluacion'] is not None:
+                registro['fecha_ultima_evaluacion'] = registro['fecha_ultima_evaluacion'].isoformat()
+            yield registro
+    finally:
+        resultado.close()
+
+
+def _celda(valor):
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    return valor
+
+
+def a_csv(registros_, tamano_bloque=TAMANO_BLOQUE):
+    """Genera el CSV en trozos de ``tamano_bloque`` filas; las referencias van en ref1..ref4"""
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=CAMPOS_EXPORTACION, extrasaction='ignore')
+    escritor.writeheader()
+    for n, registro in enumerate(registros_, start=1):
+        registro.update(registro.pop('referencias') or {})
+        escritor.writerow({k: _celda(v) for k, v in registro.items()})
+        if n % tamano_bloque == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def a_jsonl(registros_, tamano_bloque=TAMANO_BLOQUE):
+    """Genera JSONL en trozos de ``tamano_bloque`` líneas"""
+    lineas = []
+    for registro in registros_:
+        lineas.append(json.dumps(registro, ensure_ascii=False) + '\n')
+        if len(lineas) == tamano_bloque:
+            yield ''.join(lineas)
+            lineas = []
+    if lineas:
+        yield ''.join(lineas)
+
+
+def exportar(formato, criterios=(), tamano_bloque=TAMANO_BLOQUE):
+    """Genera el contenido del archivo en el formato pedido"""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+    serializar = a_csv if formato == 'csv' else a_jsonl
+    return serializar(registros(criterios, tamano_bloque), tamano_bloque)
@@ -1,10 +1,47 @@
 from flask_wtf import FlaskForm
 from wtforms import validators
 from wtforms import StringField, FloatField, SelectField, TextAreaField, IntegerField
-from wtforms.validators import DataRequired, Optional
-from models import ComparisonType, AggregationMethod, Periodicity, Perspective, OrganizationalStructure
+from wtforms.validators import DataRequired, Optional, Length, ValidationError
+from catalogos import opciones
+from extensions import db
+from models import Indicator, OrganizationalStructure
+
+
+class ExisteRegistro:
+    """Valida que el id enviado exista, sin cargar la lista completa de opciones"""
+
+    def __init__(self, modelo, message=None):
+        self.modelo = modelo
+        self.message = message or 'El registro seleccionado no existe'
+
+    def __call__(self, form, field):
+        if field.data is not None and db.session.get(self.modelo, field.data) is None:
+            raise ValidationError(self.message)
+
+
+class SinCiclo:
+    """Valida que el padre elegido no sea el propio indicador ni uno de sus descendientes
+
+    Sube desde el padre elegido por sus ancestros; si se llega al indicador
+    que se está editando (``form.indicador_id``), el cambio cerraría un ciclo.
+    """
+
+    def __init__(self, message=None):
+        self.message = message or 'El indicador padre no puede ser el propio indicador ni uno de sus descendientes'
+
+    def __call__(self, form, field):
+        propio = getattr(form, 'indicador_id', None)
+        if field.data is None or propio is None:
+            return
+        nodo, visitados = field.data, set()
+        while nodo is not None and nodo not in visitados:
+            if nodo == propio:
+                raise ValidationError(self.message)
+            visitados.add(nodo)
+            nodo = db.session.query(Indicator.parent_id).filter(Indicator.id == nodo).scalar()
 
 class KPIForm(FlaskForm):
+    codigo = StringField('Código', validators=[DataRequired(), Length(max=30)])
     nombre = StringField('Nombre del KPI', validators=[DataRequired()])
     
     perspective = SelectField('Perspectiva', coerce=lambda x: int(x) if x and x != '' else None,
@@ -26,7 +63,8 @@ class KPIForm(FlaskForm):
     unidad_medida = StringField('Unidad de Medida', validators=[DataRequired()])
     valor_real = FloatField('Valor Actual', validators=[Optional()])
     organizational_structure_id = SelectField('Organizaciones', coerce=lambda x: int(x) if x and x != '' else None,
-                                             validators=[validators.InputRequired()],  
+                                             validators=[validators.InputRequired(), ExisteRegistro(OrganizationalStructure)],
+                                             validate_choice=False,
                                              
                             )
 
@@ -37,21 +75,31 @@ class KPIForm(FlaskForm):
     referencia4 = FloatField('Referencia 4', validators=[validators.Optional()])
     
     # Campos de dimensiones
-    estructura_jerarquica_id = SelectField('Estructura Jerárquica', coerce=lambda x: int(x) if x and x != 'None' else None,
-        validators=[validators.Optional()])
     centro_costo = StringField('Centro de Costo', validators=[Optional()])
     parent_id = SelectField('Indicador Padre', coerce=lambda x: int(x) if x and x != 'None' else None,
-        validators=[validators.Optional()])
+        validators=[validators.Optional(), ExisteRegistro(Indicator), SinCiclo()], validate_choice=False)
     
     # Para campos JSON (simplificado)
     tiempo_dimension = TextAreaField('Dimensión Tiempo (JSON)', validators=[Optional()])
     ubicacion_geografica = TextAreaField('Ubicación Geográfica (JSON)', validators=[Optional()])
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, indicador_id=None, **kwargs):
         super(KPIForm, self).__init__(*args, **kwargs)
-        # Cargar opciones desde la base de datos
-        self.perspective.choices = [(p.id, p.nombre) for p in Perspective.query.order_by(Perspective.nombre).all()]
-        self.comparison_type.choices = [(c.id, c.nombre) for c in ComparisonType.query.order_by(ComparisonType.nombre).all()]
-        self.periodicity.choices = [(p.id, p.nombre) for p in Periodicity.query.order_by(Periodicity.nombre).all()]
-        self.aggregation_method.choices = [(a.id, a.nombre) for a in AggregationMethod.query.order_by(AggregationMethod.nombre).all()]
-        self.organizational_structure_id.choices = [(org.id, org.nombre) for org in OrganizationalStructure.query.order_by(OrganizationalStructure.nombre).all()]
\ No newline at end of file
+        # Indicador que se edita (None al crear): su subárbol no puede ser su padre
+        self.indicador_id = indicador_id
+        # Cargar opciones desde la caché de catálogos
+        self.perspective.choices = opciones('perspectives')
+        self.comparison_type.choices = opciones('comparison_types')
+        self.periodicity.choices = opciones('periodicities')
+        self.aggregation_method.choices = opciones('aggregation_methods')
+        # Estructura e indicador padre se buscan con los endpoints de búsqueda;
+        # aquí solo se carga la opción seleccionada
+        self.organizational_structure_id.choices = self._opcion_actual(self.organizational_structure_id, OrganizationalStructure)
+        self.parent_id.choices = self._opcion_actual(self.parent_id, Indicator)
+
+    @staticmethod
+    def _opcion_actual(campo, modelo):
+        if not isinstance(campo.data, int):
+            return []
+        fila = db.session.query(modelo.id, modelo.nombre).filter(modelo.id == campo.data).first()
+        return [tuple(fila)] if fila else []
\ No newline at end of file
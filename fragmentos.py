@@ -0,0 +1,218 @@
+"""Caché de fragmentos HTML invalidada por versión de tabla.
+
+Cada fragmento (las filas del listado, los desplegables de catálogos) se
+guarda con una clave que incluye sus parámetros y la versión actual de las
+tablas de las que depende. La versión de una tabla avanza tras cada commit
+que la modifica (vía ``cambios``), así que un fragmento desfasado nunca se
+vuelve a leer: simplemente deja de pedirse y el backend lo expulsa.
+
+Backends (``FRAGMENT_CACHE``):
+
+- ``lru``: en memoria del proceso, acotado por entradas y bytes. Las
+  versiones solo avanzan con los commits del propio proceso.
+- ``archivo``: ficheros en ``FRAGMENT_CACHE_DIR``, compartidos por todos los
+  workers de la máquina; las versiones también viven en disco, de modo que
+  un commit en un worker invalida los fragmentos de los demás.
+- ``none``: desactivada.
+
+Los commits de procesos que no comparten las versiones (otros workers con
+``lru``, el planificador, la telemetría, otras máquinas) no avisan a la
+caché. Por eso la clave incluye además la ventana de ``FRAGMENT_CACHE_TTL``
+segundos en curso: ningún fragmento se sirve más allá de ese plazo.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from cambios import suscribir
+from catalogos import CATALOGOS
+
+MAX_ENTRADAS = 1000
+MAX_BYTES = 32 * 1024 * 1024
+TTL_POR_DEFECTO = 30  # Segundos; 0 = sin caducidad
+
+# Tablas cuyos cambios invalidan fragmentos
+TABLAS = ('indicators', *CATALOGOS)
+
+
+class CacheLRU:
+    """Fragmentos en memoria con expulsión LRU por número de entradas y tamaño total"""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS, max_bytes=MAX_BYTES):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._versiones = {}
+
+    def obtener(self, clave):
+        with self._lock:
+            valor = self._entradas.get(clave)
+            if valor is not None:
+                self._entradas.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            self._entradas[clave] = valor
+            self._bytes += len(valor)
+            while self._entradas and (len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes):
+                _, expulsado = self._entradas.popitem(last=False)
+                self._bytes -= len(expulsado)
+
+    def version(self, tabla):
+        return self._versiones.get(tabla, 0)
+
+    def incrementar(self, tabla):
+        with self._lock:
+            self._versiones[tabla] = self._versiones.get(tabla, 0) + 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+
+class CacheArchivos:
+    """Fragmentos en ficheros locales, compartidos entre procesos
+
+    Escribir es atómico (fichero temporal + ``os.replace``). La versión de una
+    tabla es el tamaño de su fichero de versión, al que cada commit añade un
+    byte con ``O_APPEND``: un incremento atómico entre procesos sin bloqueos.
+    """
+
+    def __init__(self, directorio, max_entradas=MAX_ENTRADAS):
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        self._versiones_dir = os.path.join(directorio, 'versiones')
+        os.makedirs(self._versiones_dir, exist_ok=True)
+        self._escrituras = 0
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], clave)
+
+    def obtener(self, clave):
+        try:
+            with open(self._ruta(clave), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def guardar(self, clave, valor):
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta))
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            f.write(valor)
+        os.replace(temporal, ruta)
+        self._escrituras += 1
+        if self._escrituras % 100 == 0:
+            self._recortar()
+
+    def _recortar(self):
+        """Borra los fragmentos más antiguos si se supera ``max_entradas``"""
+        archivos = []
+        for subdirectorio in os.scandir(self.directorio):
+            if subdirectorio.is_dir() and subdirectorio.path != self._versiones_dir:
+                archivos.extend(os.scandir(subdirectorio.path))
+        if len(archivos) <= self.max_entradas:
+            return
+        archivos.sort(key=lambda a: a.stat().st_mtime)
+        for archivo in archivos[:len(archivos) - self.max_entradas * 9 // 10]:
+            try:
+                os.unlink(archivo.path)
+            except FileNotFoundError:
+                pass
+
+    def version(self, tabla):
+        try:
+            return os.stat(os.path.join(self._versiones_dir, tabla)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def incrementar(self, tabla):
+        descriptor = os.open(os.path.join(self._versiones_dir, tabla), os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        try:
+            os.write(descriptor, b'.')
+        finally:
+            os.close(descriptor)
+
+    def limpiar(self):
+        for subdirectorio in os.scandir(self.directorio):
+            if subdirectorio.is_dir() and subdirectorio.path != self._versiones_dir:
+                for archivo in os.scandir(subdirectorio.path):
+                    os.unlink(archivo.path)
+
+
+backend = None
+ttl = TTL_POR_DEFECTO
+aciertos = 0
+fallos = 0
+
+
+def _incrementar(tabla):
+    if backend is not None:
+        backend.incrementar(tabla)
+
+
+for _tabla in TABLAS:
+    suscribir(_tabla, _incrementar)
+
+
+def clave(nombre, tablas, *partes):
+    """Clave del fragmento para las versiones actuales de ``tablas``"""
+    versiones = [backend.version(t) for t in tablas] if backend is not None else []
+    # Ventana de caducidad común a todos los procesos: al cambiar, las claves anteriores dejan de pedirse
+    ventana = int(time.time() // ttl) if ttl else 0
+    texto = json.dumps([nombre, versiones, ventana, partes], sort_keys=True, default=str)
+    return hashlib.sha1(texto.encode()).hexdigest()
+
+
+def cacheado(nombre, tablas, partes, generar):
+    """HTML del fragmento: de la caché si existe y, si no, ``generar()`` y se guarda"""
+    global aciertos, fallos
+    if backend is None:
+        return Markup(generar())
+    k = clave(nombre, tablas, *partes)
+    html = backend.obtener(k)
+    if html is not None:
+        aciertos += 1
+        return Markup(html)
+    fallos += 1
+    html = str(generar())
+    backend.guardar(k, html)
+    return Markup(html)
+
+
+def fragmento(nombre, tablas, *partes, caller):
+    """Para plantillas: ``{% call fragmento('nombre', ['tabla'], parametro) %}...{% endcall %}``"""
+    return cacheado(nombre, tablas, partes, caller)
+
+
+def configurar(app):
+    """Crea el backend indicado en la configuración y expone ``fragmento`` a las plantillas"""
+    global backend, ttl
+    tipo = app.config.get('FRAGMENT_CACHE', 'lru')
+    ttl = app.config.get('FRAGMENT_CACHE_TTL', TTL_POR_DEFECTO)
+    tamano = app.config.get('FRAGMENT_CACHE_SIZE', MAX_ENTRADAS)
+    if tipo == 'lru':
+        backend = CacheLRU(max_entradas=tamano)
+    elif tipo == 'archivo':
+        backend = CacheArchivos(app.config.get('FRAGMENT_CACHE_DIR') or
+                                os.path.join(app.instance_path, 'fragmentos'), max_entradas=tamano)
+    elif tipo == 'none':
+        backend = None
+    else:
+        raise ValueError(f'FRAGMENT_CACHE no válido: {tipo}')
+    app.jinja_env.globals['fragmento'] = fragmento
+    return app
@@ -0,0 +1,282 @@
+"""Índice espacial de equipos e indicadores.
+
+``EquipoFisico.coordenadas`` (texto) y las coordenadas que traiga
+``Indicator.ubicacion_geografica`` (JSON) se convierten al escribir en
+columnas numéricas ``latitud``/``longitud`` y en una celda geohash
+(``celda_geo``, indexada). Una consulta por rectángulo se traduce en unos
+pocos rangos de prefijos geohash, que cualquier motor resuelve con el
+índice B-tree, y después en el filtro exacto por latitud/longitud. En
+PostgreSQL se usa en su lugar el índice GiST sobre ``point(longitud, latitud)``
+definido en ``modelo.sql``.
+
+Las filas escritas con sentencias Core en bloque no pasan por los eventos
+del mapper: quien las emite usa ``columnas_coordenadas``/``columnas_ubicacion``,
+y ``reconstruir`` recalcula todo.
+"""
+import math
+import re
+
+from sqlalchemy import and_, bindparam, event, func, or_, select, update
+
+from extensions import db
+from models import EquipoFisico, Indicator, IndicatorDimension, indicator_equipment
+
+PRECISION = 9  # Caracteres de geohash guardados (~5 m)
+MAX_CELDAS = 32  # Rangos de prefijos por consulta
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = 111.32
+LIMITE_POR_DEFECTO = 500
+LIMITE_MAXIMO = 5000
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_TAMANO_BLOQUE = 900
+
+_PUNTO_WKT = re.compile(r'^\s*POINT\s*\(\s*(\S+)\s+(\S+)\s*\)\s*$', re.IGNORECASE)
+_SEPARADOR = re.compile(r'[\s,;]+')
+
+
+def geohash(latitud, longitud, precision=PRECISION):
+    """Geohash en base 32 del punto"""
+    rango_lat, rango_lon = [-90.0, 90.0], [-180.0, 180.0]
+    caracteres, bits, n, es_longitud = [], 0, 0, True
+    while len(caracteres) < precision:
+        rango, valor = (rango_lon, longitud) if es_longitud else (rango_lat, latitud)
+        medio = (rango[0] + rango[1]) / 2
+        bits <<= 1
+        if valor >= medio:
+            bits |= 1
+            rango[0] = medio
+        else:
+            rango[1] = medio
+        es_longitud = not es_longitud
+        n += 1
+        if n == 5:
+            caracteres.append(_BASE32[bits])
+            bits, n = 0, 0
+    return ''.join(caracteres)
+
+
+def _valido(latitud, longitud):
+    return -90 <= latitud <= 90 and -180 <= longitud <= 180
+
+
+def leer_coordenadas(texto):
+    """``(latitud, longitud)`` de un texto "lat,lon", "lat lon" o WKT "POINT(lon lat)"; None si no es válido"""
+    if not texto or not isinstance(texto, str):
+        return None
+    try:
+        wkt = _PUNTO_WKT.match(texto)
+        if wkt:
+            longitud, latitud = float(wkt.group(1)), float(wkt.group(2))
+        else:
+            partes = [p for p in _SEPARADOR.split(texto.strip()) if p]
+            if len(partes) != 2:
+                return None
+            latitud, longitud = float(partes[0]), float(partes[1])
+    except ValueError:
+        return None
+    return (latitud, longitud) if _valido(latitud, longitud) else None
+
+
+def _columnas(punto):
+    if punto is None:
+        return {'latitud': None, 'longitud': None, 'celda_geo': None}
+    latitud, longitud = punto
+    return {'latitud': latitud, 'longitud': longitud, 'celda_geo': geohash(latitud, longitud)}
+
+
+def columnas_coordenadas(texto):
+    """Valores de latitud, longitud y celda_geo para un texto de coordenadas"""
+    return _columnas(leer_coordenadas(texto))
+
+
+def columnas_ubicacion(ubicacion):
+    """Valores de latitud, longitud y celda_geo para ``ubicacion_geografica``
+
+    Admite las claves lat/latitud y lon/lng/longitud, o una clave
+    ``coordenadas`` con el mismo texto que los equipos.
+    """
+    if not isinstance(ubicacion, dict):
+        return _columnas(None)
+    latitud = next((ubicacion[k] for k in ('lat', 'latitud') if ubicacion.get(k) is not None), None)
+    longitud = next((ubicacion[k] for k in ('lon', 'lng', 'longitud') if ubicacion.get(k) is not None), None)
+    if latitud is None or longitud is None:
+        return columnas_coordenadas(ubicacion.get('coordenadas'))
+    try:
+        punto = float(latitud), float(longitud)
+    except (TypeError, ValueError):
+        return _columnas(None)
+    return _columnas(punto if _valido(*punto) else None)
+
+
+@event.listens_for(EquipoFisico, 'before_insert')
+@event.listens_for(EquipoFisico, 'before_update')
+def _sincronizar_equipo(mapper, conexion, equipo):
+    for clave, valor in columnas_coordenadas(equipo.coordenadas).items():
+        setattr(equipo, clave, valor)
+
+
+@event.listens_for(Indicator, 'before_insert')
+@event.listens_for(Indicator, 'before_update')
+def _sincronizar_indicador(mapper, conexion, indicador):
+    for clave, valor in columnas_ubicacion(indicador.ubicacion_geografica).items():
+        setattr(indicador, clave, valor)
+
+
+def celdas(min_lon, min_lat, max_lon, max_lat, max_celdas=MAX_CELDAS):
+    """Prefijos geohash que cubren el rectángulo, a la mayor precisión con ``max_celdas`` o menos"""
+    for precision in range(PRECISION, 0, -1):
+        bits_lon = (5 * precision + 1) // 2
+        bits_lat = 5 * precision // 2
+        alto, ancho = 180 / 2 ** bits_lat, 360 / 2 ** bits_lon
+        filas = range(min(int((min_lat + 90) // alto), 2 ** bits_lat - 1),
+                      min(int((max_lat + 90) // alto), 2 ** bits_lat - 1) + 1)
+        columnas = range(min(int((min_lon + 180) // ancho), 2 ** bits_lon - 1),
+                         min(int((max_lon + 180) // ancho), 2 ** bits_lon - 1) + 1)
+        if len(filas) * len(columnas) <= max_celdas:
+            break
+    return sorted({geohash(-90 + (i + 0.5) * alto, -180 + (j + 0.5) * ancho, precision)
+                   for i in filas for j in columnas})
+
+
+def en_rectangulo(modelo, min_lon, min_lat, max_lon, max_lat):
+    """Criterio de filas de ``modelo`` (EquipoFisico o Indicator) dentro del rectángulo"""
+    if db.engine.dialect.name == 'postgresql':
+        # Usa el índice GiST sobre point(longitud, latitud)
+        return func.point(modelo.longitud, modelo.latitud).op('<@')(
+            func.box(func.point(min_lon, min_lat), func.point(max_lon, max_lat)))
+    rangos = [and_(modelo.celda_geo >= prefijo, modelo.celda_geo < prefijo + '~')
+              for prefijo in celdas(min_lon, min_lat, max_lon, max_lat)]
+    return and_(or_(*rangos), modelo.latitud.between(min_lat, max_lat),
+                modelo.longitud.between(min_lon, max_lon))
+
+
+def rectangulo_de_radio(latitud, longitud, radio_km):
+    """Rectángulo ``(min_lon, min_lat, max_lon, max_lat)`` que contiene el círculo"""
+    delta_lat = radio_km / KM_POR_GRADO
+    delta_lon = radio_km / (KM_POR_GRADO * max(math.cos(math.radians(latitud)), 1e-6))
+    return (max(longitud - delta_lon, -180.0), max(latitud - delta_lat, -90.0),
+            min(longitud + delta_lon, 180.0), min(latitud + delta_lat, 90.0))
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """Distancia de haversine en kilómetros"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
+
+
+def _evaluacion(fila):
+    return {'id': fila.id, 'codigo': fila.codigo, 'nombre': fila.nombre,
+            'ultima_evaluacion': fila.ultima_evaluacion,
+            'fecha_ultima_evaluacion': fila.fecha_ultima_evaluacion.isoformat()
+            if fila.fecha_ultima_evaluacion else None}
+
+
+def _indicadores_de_equipos(ids):
+    """equipo_id -> indicadores vinculados con su última evaluación, con una consulta por bloque"""
+    vinculados = {}
+    ids = list(ids)
+    for inicio in range(0, len(ids), _TAMANO_BLOQUE):
+        consulta = (select(indicator_equipment.c.equipo_id, Indicator.id, Indicator.codigo, Indicator.nombre,
+                           Indicator.ultima_evaluacion, Indicator.fecha_ultima_evaluacion)
+                    .join(Indicator, Indicator.id == indicator_equipment.c.indicator_id)
+                    .where(indicator_equipment.c.equipo_id.in_(ids[inicio:inicio + _TAMANO_BLOQUE]))
+                    .order_by(indicator_equipment.c.equipo_id, Indicator.id))
+        for fila in db.session.execute(consulta):
+            vinculados.setdefault(fila.equipo_id, []).append(_evaluacion(fila))
+    return vinculados
+
+
+def _filtrar(filas, centro, radio_km, limite):
+    """Aplica el radio (si hay) y el límite; devuelve ``(filas, truncado)``"""
+    if centro is not None:
+        filas = [(distancia_km(centro[0], centro[1], f.latitud, f.longitud), f) for f in filas]
+        filas = sorted((d, f) for d, f in filas if d <= radio_km)
+    else:
+        filas = sorted(((None, f) for f in filas), key=lambda x: x[1].id)
+    return filas[:limite], len(filas) > limite
+
+
+def buscar(rectangulo=None, centro=None, radio_km=None, provincia=None, limite=LIMITE_POR_DEFECTO):
+    """Equipos (con sus indicadores) e indicadores localizados en un área
+
+    El área es un ``rectangulo`` (min_lon, min_lat, max_lon, max_lat), un
+    círculo ``centro`` (lat, lon) + ``radio_km`` o una ``provincia`` de
+    ``ubicacion_geografica``; la provincia solo devuelve indicadores. Con
+    radio, los resultados van ordenados por distancia. Lanza ValueError si
+    el área no es válida.
+    """
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    if provincia is not None:
+        consulta = (select(Indicator.id, Indicator.codigo, Indicator.nombre, Indicator.ultima_evaluacion,
+                           Indicator.fecha_ultima_evaluacion)
+                    .join(IndicatorDimension, IndicatorDimension.indicator_id == Indicator.id)
+                    .where(IndicatorDimension.provincia == provincia)
+                    .order_by(Indicator.id).limit(limite + 1))
+        filas = db.session.execute(consulta).all()
+        return {'equipos': [], 'indicadores': [_evaluacion(f) for f in filas[:limite]],
+                'truncado': len(filas) > limite}
+
+    if centro is not None:
+        if radio_km is None or radio_km <= 0 or not _valido(*centro):
+            raise ValueError('Se requiere un centro válido y un radio positivo')
+        rectangulo = rectangulo_de_radio(centro[0], centro[1], radio_km)
+    if rectangulo is None:
+        raise ValueError('Indique bbox, lat/lon/radio_km o provincia')
+    min_lon, min_lat, max_lon, max_lat = rectangulo
+    if not (_valido(min_lat, min_lon) and _valido(max_lat, max_lon)) or min_lon > max_lon or min_lat > max_lat:
+        raise ValueError('Rectángulo no válido (min_lon,min_lat,max_lon,max_lat)')
+
+    # Con radio se leen todos los candidatos del rectángulo para ordenar por distancia. Sin
+    # ORDER BY: ordenar por id haría que SQLite recorriera la clave primaria en vez del índice
+    tope = None if centro is not None else limite + 1
+    equipos = db.session.execute(
+        select(EquipoFisico.id, EquipoFisico.codigo_activo, EquipoFisico.nombre, EquipoFisico.estado,
+               EquipoFisico.latitud, EquipoFisico.longitud)
+        .where(en_rectangulo(EquipoFisico, *rectangulo)).limit(tope)).all()
+    indicadores = db.session.execute(
+        select(Indicator.id, Indicator.codigo, Indicator.nombre, Indicator.ultima_evaluacion,
+               Indicator.fecha_ultima_evaluacion, Indicator.latitud, Indicator.longitud)
+        .where(en_rectangulo(Indicator, *rectangulo)).limit(tope)).all()
+
+    equipos, equipos_truncados = _filtrar(equipos, centro, radio_km, limite)
+    indicadores, indicadores_truncados = _filtrar(indicadores, centro, radio_km, limite)
+    vinculados = _indicadores_de_equipos(f.id for _, f in equipos)
+    return {
+        'equipos': [{'id': f.id, 'codigo_activo': f.codigo_activo, 'nombre': f.nombre, 'estado': f.estado,
+                     'latitud': f.latitud, 'longitud': f.longitud, 'distancia_km': d,
+                     'indicadores': vinculados.get(f.id, [])} for d, f in equipos],
+        'indicadores': [dict(_evaluacion(f), latitud=f.latitud, longitud=f.longitud, distancia_km=d)
+                        for d, f in indicadores],
+        'truncado': equipos_truncados or indicadores_truncados,
+    }
+
+
+def reconstruir(tamano_bloque=5000, conexion=None):
+    """Recalcula latitud, longitud y celda_geo de equipos e indicadores. No hace commit.
+
+    ``conexion`` permite usarla sin aplicación (la migración que crea las columnas).
+    """
+    conexion = conexion if conexion is not None else db.session
+    total = 0
+    for modelo, origen, convertir in ((EquipoFisico, EquipoFisico.coordenadas, columnas_coordenadas),
+                                      (Indicator, Indicator.ubicacion_geografica, columnas_ubicacion)):
+        tabla = modelo.__table__
+        valores = {c: bindparam(f'n_{c}') for c in ('latitud', 'longitud', 'celda_geo')}
+        if 'updated_at' in tabla.c:
+            # Recalcular columnas derivadas no es modificar el indicador
+            valores['updated_at'] = tabla.c.updated_at
+        sentencia = update(tabla).where(tabla.c.id == bindparam('n_id')).values(**valores)
+        filas = []
+        for id_, dato in conexion.execute(select(modelo.id, origen).order_by(modelo.id)
+                                          .execution_options(yield_per=tamano_bloque)):
+            filas.append(dict({f'n_{c}': v for c, v in convertir(dato).items()}, n_id=id_))
+            if len(filas) == tamano_bloque:
+                conexion.execute(sentencia, filas)
+                total += len(filas)
+                filas = []
+        if filas:
+            conexion.execute(sentencia, filas)
+            total += len(filas)
+    return total
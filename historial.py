@@ -0,0 +1,248 @@
+"""Historial de cambios de indicadores (``indicator_history``).
+
+Los cambios de cada campo de ``Indicator`` se detectan en el flush con el
+historial de atributos del ORM y, solo si la transacción se confirma, se
+encolan para un hilo escritor que los inserta por lotes en su propia
+conexión. Así la auditoría no añade escrituras a la petición que hizo el
+cambio. Las actualizaciones en bloque con sentencias Core no pasan por el
+flush: quien las emite registra los valores anterior y nuevo con
+``registrar_cambios`` y siguen el mismo camino (mediciones, agregación,
+actualización en bloque, importación y telemetría lo hacen).
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import date, datetime
+
+from flask import has_request_context, request
+from sqlalchemy import Engine, event, insert, inspect, tuple_
+from sqlalchemy.orm import Session
+
+from busqueda import codificar_cursor, decodificar_cursor
+from models import Indicator, IndicatorHistory
+
+# Campos calculados o de metadatos que no se auditan
+CAMPOS_EXCLUIDOS = {'id', 'ultima_evaluacion', 'fecha_ultima_evaluacion', 'evaluacion_reservada_hasta',
+                    'evaluacion_reservada_por', 'latitud', 'longitud', 'celda_geo', 'created_at', 'updated_at',
+                    'creado_por', 'actualizado_por'}
+
+logger = logging.getLogger(__name__)
+
+USUARIO_POR_DEFECTO = 'sistema'
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+
+def _texto(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False, sort_keys=True)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _usuario_peticion():
+    if has_request_context() and request.remote_user:
+        return request.remote_user
+    return USUARIO_POR_DEFECTO
+
+
+def _usuario(indicador):
+    return indicador.actualizado_por or _usuario_peticion()
+
+
+def cambios(indicador, fecha=None):
+    """Filas de historial con los campos modificados y aún no volcados del indicador"""
+    estado = inspect(indicador)
+    fecha = fecha or datetime.utcnow()
+    filas = []
+    for atributo in estado.mapper.column_attrs:
+        if atributo.key in CAMPOS_EXCLUIDOS:
+            continue
+        historial = estado.attrs[atributo.key].history
+        if not historial.has_changes():
+            continue
+        anterior = historial.deleted[0] if historial.deleted else None
+        nuevo = historial.added[0] if historial.added else None
+        if anterior == nuevo:
+            continue
+        filas.append({'indicator_id': indicador.id, 'campo_modificado': atributo.key,
+                      'valor_anterior': _texto(anterior), 'valor_nuevo': _texto(nuevo),
+                      'fecha_cambio': fecha, 'usuario': _usuario(indicador)})
+    return filas
+
+
+def registrar_cambios(session, cambios_, usuario=None, fecha=None):
+    """Registra cambios hechos con sentencias Core para escribirlos tras el commit
+
+    ``cambios_`` es un iterable de ``(indicator_id, campo, anterior, nuevo)``;
+    se ignoran los campos no auditados y los que no cambian de valor.
+    """
+    fecha = fecha or datetime.utcnow()
+    usuario = usuario or _usuario_peticion()
+    filas = [{'indicator_id': id_, 'campo_modificado': campo, 'valor_anterior': _texto(anterior),
+              'valor_nuevo': _texto(nuevo), 'fecha_cambio': fecha, 'usuario': usuario}
+             for id_, campo, anterior, nuevo in cambios_
+             if campo not in CAMPOS_EXCLUIDOS and anterior != nuevo]
+    if filas:
+        session.info.setdefault('historial_pendiente', []).extend(filas)
+
+
+class EscritorHistorial:
+    """Hilo que inserta las filas de historial en lotes
+
+    Escribe cuando junta ``tamano_lote`` filas o pasan ``intervalo`` segundos
+    desde la última escritura. Si la cola se llena, ``encolar`` bloquea en
+    lugar de perder filas. Un lote que falla se reintenta con espera
+    creciente; si sigue fallando se escribe fila a fila, y las filas que
+    aun así fallan (p. ej. el indicador ya se borró) quedan en el log con su
+    contenido y en ``errores``.
+    """
+
+    def __init__(self, tamano_lote=500, intervalo=1.0, capacidad=100000, reintentos=5, espera=0.5,
+                 espera_maxima=30.0):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.reintentos = reintentos
+        self.espera = espera
+        self.espera_maxima = espera_maxima
+        self._cola = queue.Queue(maxsize=capacidad)
+        self._hilo = None
+        self._lock = threading.Lock()
+        self.escritas = 0
+        self.errores = 0
+
+    def encolar(self, engine, filas):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='escritor-historial',
+                                              daemon=True)
+                self._hilo.start()
+        for fila in filas:
+            self._cola.put((engine, fila))
+
+    @staticmethod
+    def _insertar(engine, filas):
+        with engine.begin() as conexion:
+            conexion.execute(insert(IndicatorHistory.__table__), filas)
+
+    def _escribir(self, pendientes):
+        por_engine = {}
+        for engine, fila in pendientes:
+            por_engine.setdefault(engine, []).append(fila)
+        for engine, filas in por_engine.items():
+            for intento in range(self.reintentos + 1):
+                try:
+                    self._insertar(engine, filas)
+                    self.escritas += len(filas)
+                    break
+                except Exception:
+                    if intento == self.reintentos:
+                        logger.exception('No se pudieron escribir %d filas de historial tras %d intentos; '
+                                         'se escriben fila a fila', len(filas), intento + 1)
+                        self._escribir_por_fila(engine, filas)
+                        break
+                    espera = min(self.espera * 2 ** intento, self.espera_maxima)
+                    logger.exception('Error escribiendo %d filas de historial; reintento en %.1f s',
+                                     len(filas), espera)
+                    time.sleep(espera)
+
+    def _escribir_por_fila(self, engine, filas):
+        for fila in filas:
+            try:
+                self._insertar(engine, [fila])
+                self.escritas += 1
+            except Exception:
+                self.errores += 1
+                logger.exception('Fila de historial descartada: %r', fila)
+
+    def _ejecutar(self):
+        while True:
+            pendientes = [self._cola.get()]
+            try:
+                while len(pendientes) < self.tamano_lote:
+                    pendientes.append(self._cola.get(timeout=self.intervalo))
+            except queue.Empty:
+                pass
+            self._escribir(pendientes)
+            for _ in pendientes:
+                self._cola.task_done()
+
+    def vaciar(self):
+        """Espera a que se escriban todas las filas encoladas"""
+        if self._hilo is not None and self._hilo.is_alive():
+            self._cola.join()
+
+
+escritor = EscritorHistorial()
+atexit.register(escritor.vaciar)
+
+
+def _sin_efecto(objetivo, valor, anterior, iniciador):
+    return valor
+
+
+# active_history hace que el ORM cargue el valor anterior al asignar un atributo
+# expirado (p. ej. tras un commit); sin él, el historial no sabría qué había antes
+for _atributo in Indicator.__mapper__.column_attrs:
+    if _atributo.key not in CAMPOS_EXCLUIDOS:
+        event.listen(getattr(Indicator, _atributo.key), 'set', _sin_efecto, active_history=True,
+                     retval=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _capturar(session, flush_context):
+    filas = []
+    fecha = datetime.utcnow()
+    for obj in session.dirty:
+        if isinstance(obj, Indicator) and session.is_modified(obj):
+            filas.extend(cambios(obj, fecha))
+    if filas:
+        session.info.setdefault('historial_pendiente', []).extend(filas)
+
+
+@event.listens_for(Session, 'after_commit')
+def _encolar(session):
+    filas = session.info.pop('historial_pendiente', None)
+    if filas:
+        engine = session.get_bind(Indicator)
+        if not isinstance(engine, Engine):
+            engine = engine.engine
+        escritor.encolar(engine, filas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar(session):
+    session.info.pop('historial_pendiente', None)
+
+
+def consultar(indicator_id, campo=None, desde=None, hasta=None, cursor=None, limite=LIMITE_POR_DEFECTO):
+    """Devuelve ``(filas, siguiente_cursor)`` del historial, del cambio más reciente al más antiguo
+
+    Usa el índice (indicator_id, fecha_cambio) y pagina por keyset sobre
+    (fecha_cambio, id). Lanza ValueError si el cursor no es válido.
+    """
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    q = IndicatorHistory.query.filter(IndicatorHistory.indicator_id == indicator_id)
+    if campo:
+        q = q.filter(IndicatorHistory.campo_modificado == campo)
+    if desde is not None:
+        q = q.filter(IndicatorHistory.fecha_cambio >= desde)
+    if hasta is not None:
+        q = q.filter(IndicatorHistory.fecha_cambio < hasta)
+    if cursor:
+        fecha, id_ = decodificar_cursor(cursor)
+        q = q.filter(tuple_(IndicatorHistory.fecha_cambio, IndicatorHistory.id) <
+                     tuple_(datetime.fromisoformat(fecha), id_))
+
+    filas = q.order_by(IndicatorHistory.fecha_cambio.desc(), IndicatorHistory.id.desc()).limit(limite + 1).all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1].fecha_cambio.isoformat(), filas[-1].id)
+    return filas, siguiente
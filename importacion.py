@@ -0,0 +1,287 @@
+"""Importación en streaming de indicadores desde CSV o JSONL.
+
+El archivo se lee registro a registro y se procesa en lotes: los códigos de
+perspectiva, tipo de comparación, periodicidad, método de agregación,
+estructura e indicador padre se resuelven con diccionarios cargados una sola
+vez, y cada lote se inserta/actualiza con un executemany y un commit. La
+memoria depende del tamaño del lote y del catálogo, no del archivo. Los
+valores anteriores de los indicadores que ya existían se leen antes de
+sobrescribirlos para dejar los cambios en ``indicator_history``.
+"""
+import csv
+import json
+from itertools import chain, islice
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import aliased
+
+from agregacion import marcar_sucios
+from analitica import marcar_series
+from cambios import marcar_modificadas
+from cubo import marcar_indicadores
+from evaluacion_lote import reevaluar_ids
+from extensions import db
+from geografia import columnas_ubicacion
+from historial import CAMPOS_EXCLUIDOS, registrar_cambios
+from models import (Indicator, Perspective, ComparisonType, Periodicity, AggregationMethod,
+                    OrganizationalStructure)
+
+TAMANO_LOTE = 1000
+MAX_ERRORES = 1000  # errores detallados que devuelve la API
+
+# Columnas del formato de intercambio (las mismas que genera la exportación)
+CAMPOS = ['codigo', 'nombre', 'unidad_medida', 'perspectiva', 'tipo_comparacion', 'periodicidad',
+          'metodo_agregacion', 'estructura', 'padre', 'valor_real', 'valor_planificado',
+          'ref1', 'ref2', 'ref3', 'ref4', 'centro_costo', 'tiempo_dimension',
+          'ubicacion_geografica', 'evaluacion_automatica']
+
+_REFERENCIAS = ('ref1', 'ref2', 'ref3', 'ref4')
+
+
+def leer_registros(archivo, formato):
+    """Genera ``(linea, registro)`` desde un archivo de texto abierto
+
+    En CSV cada registro es un dict; en JSONL es el texto de la línea y se
+    decodifica al preparar el registro, para que un JSON mal formado sea un
+    error de esa fila y no de todo el archivo.
+    """
+    if formato == 'csv':
+        yield from enumerate(csv.DictReader(archivo), start=2)
+    elif formato == 'jsonl':
+        for linea, texto in enumerate(archivo, start=1):
+            if texto.strip():
+                yield linea, texto
+    else:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+
+def cargar_mapas():
+    """Diccionarios código -> id de los catálogos y de los indicadores existentes"""
+    def mapa(modelo):
+        return dict(db.session.query(modelo.codigo, modelo.id))
+
+    return {
+        'perspectiva': mapa(Perspective),
+        'tipo_comparacion': mapa(ComparisonType),
+        'periodicidad': mapa(Periodicity),
+        'metodo_agregacion': mapa(AggregationMethod),
+        'estructura': mapa(OrganizationalStructure),
+        'indicadores': mapa(Indicator),
+        'codigo_tipo': {id_: codigo for codigo, id_ in mapa(ComparisonType).items()},
+    }
+
+
+def _vacio(valor):
+    return valor is None or (isinstance(valor, str) and not valor.strip())
+
+
+def _numero(valor):
+    return None if _vacio(valor) else float(valor)
+
+
+def _json(valor):
+    if _vacio(valor):
+        return None
+    return json.loads(valor) if isinstance(valor, str) else valor
+
+
+def _booleano(valor):
+    if _vacio(valor):
+        return True
+    if isinstance(valor, str):
+        return valor.strip().lower() in ('1', 'true', 'si', 'sí', 't', 'yes')
+    return bool(valor)
+
+
+def _resolver(mapas, campo, codigo, requerido=True):
+    if _vacio(codigo):
+        if requerido:
+            raise ValueError(f"Falta {campo}")
+        return None
+    try:
+        return mapas[campo][codigo]
+    except KeyError:
+        raise ValueError(f"{campo} desconocido: {codigo}") from None
+
+
+def preparar(registro, mapas):
+    """Convierte un registro en ``(valores_columna, codigo_padre)``; lanza ValueError si no es válido"""
+    if isinstance(registro, str):
+        registro = json.loads(registro)
+    if not isinstance(registro, dict):
+        raise ValueError("El registro debe ser un objeto")
+
+    for campo in ('codigo', 'nombre', 'unidad_medida'):
+        if _vacio(registro.get(campo)):
+            raise ValueError(f"Falta {campo}")
+
+    referencias = registro.get('referencias')
+    if _vacio(referencias):
+        referencias = {k: registro.get(k) for k in _REFERENCIAS}
+    elif not isinstance(referencias, dict):
+        referencias = _json(referencias)
+    referencias = {k: _numero(v) for k, v in referencias.items() if not _vacio(v)}
+
+    tipo_id = _resolver(mapas, 'tipo_comparacion', registro.get('tipo_comparacion'))
+    Indicator.validar_referencias(mapas['codigo_tipo'][tipo_id], referencias)
+
+    valores = {
+        'codigo': str(registro['codigo']).strip(),
+        'nombre': registro['nombre'],
+        'unidad_medida': registro['unidad_medida'],
+        'perspective_id': _resolver(mapas, 'perspectiva', registro.get('perspectiva')),
+        'comparison_type_id': tipo_id,
+        'periodicity_id': _resolver(mapas, 'periodicidad', registro.get('periodicidad')),
+        'aggregation_method_id': _resolver(mapas, 'metodo_agregacion', registro.get('metodo_agregacion')),
+        'estructura_jerarquica_id': _resolver(mapas, 'estructura', registro.get('estructura'),
+                                              requerido=False),
+        'valor_real': _numero(registro.get('valor_real')),
+        'valor_planificado': _numero(registro.get('valor_planificado')),
+        'referencias': referencias,
+        'centro_costo': None if _vacio(registro.get('centro_costo')) else registro['centro_costo'],
+        'tiempo_dimension': _json(registro.get('tiempo_dimension')),
+        'ubicacion_geografica': _json(registro.get('ubicacion_geografica')),
+        'evaluacion_automatica': _booleano(registro.get('evaluacion_automatica')),
+    }
+    # Las inserciones en bloque no pasan por los eventos del mapper que derivan las coordenadas
+    valores.update(columnas_ubicacion(valores['ubicacion_geografica']))
+    padre = None if _vacio(registro.get('padre')) else str(registro['padre']).strip()
+    if padre == valores['codigo']:
+        raise ValueError("Un indicador no puede ser su propio padre")
+    return valores, padre
+
+
+def _en_ciclo(padres):
+    """Códigos de ``padres`` ({codigo: codigo_padre}) que quedarían en un ciclo
+
+    Los ancestros que no están en el lote se leen de la base de datos por
+    niveles; sus padres pueden volver a apuntar a indicadores del lote.
+    """
+    padre_de = dict(padres)
+    Padre = aliased(Indicator)
+    frontera = {p for p in padre_de.values() if p is not None and p not in padre_de}
+    while frontera:
+        frontera = list(frontera)
+        cargados = {}
+        for inicio in range(0, len(frontera), 900):
+            cargados.update(db.session.execute(
+                select(Indicator.codigo, Padre.codigo)
+                .outerjoin(Padre, Indicator.parent_id == Padre.id)
+                .where(Indicator.codigo.in_(frontera[inicio:inicio + 900]))).all())
+        padre_de.update(cargados)
+        frontera = {p for p in cargados.values() if p is not None and p not in padre_de}
+
+    ciclo, visitados = set(), set()
+    for inicio in padres:
+        ruta, posicion = [], {}
+        nodo = inicio
+        while nodo is not None and nodo not in visitados:
+            visitados.add(nodo)
+            posicion[nodo] = len(ruta)
+            ruta.append(nodo)
+            nodo = padre_de.get(nodo)
+        if nodo in posicion:
+            ciclo.update(ruta[posicion[nodo]:])
+    return ciclo & set(padres)
+
+
+def _importar_lote(lote, mapas, resumen, al_error):
+    """Valida, inserta/actualiza y re-evalúa un lote en una transacción"""
+    def error(linea, codigo, mensaje):
+        resumen['errores'] += 1
+        if al_error is not None:
+            al_error({'linea': linea, 'codigo': codigo, 'error': str(mensaje)})
+
+    preparados = {}
+    for linea, registro in lote:
+        resumen['leidos'] += 1
+        try:
+            valores, padre = preparar(registro, mapas)
+        except (ValueError, TypeError, KeyError) as e:
+            codigo = registro.get('codigo') if isinstance(registro, dict) else None
+            error(linea, codigo, e)
+            continue
+        # Si un código se repite en el lote, gana la última fila
+        preparados[valores['codigo']] = (linea, valores, padre)
+
+    for codigo in _en_ciclo({codigo: padre for codigo, (_, _, padre) in preparados.items()}):
+        error(preparados.pop(codigo)[0], codigo, "ciclo en la jerarquía de indicadores")
+
+    for codigo, (linea, _, padre) in list(preparados.items()):
+        if padre is not None and padre not in mapas['indicadores'] and padre not in preparados:
+            error(linea, codigo, f"padre desconocido: {padre}")
+            del preparados[codigo]
+    if not preparados:
+        return
+
+    nuevos = [v for _, v, _ in preparados.values() if v['codigo'] not in mapas['indicadores']]
+    existentes = [dict(v, id=mapas['indicadores'][v['codigo']])
+                  for _, v, _ in preparados.values() if v['codigo'] in mapas['indicadores']]
+    try:
+        if nuevos:
+            db.session.execute(insert(Indicator), nuevos)
+            codigos = [v['codigo'] for v in nuevos]
+            ids_nuevos = dict(db.session.query(Indicator.codigo, Indicator.id)
+                              .filter(Indicator.codigo.in_(codigos)))
+        else:
+            ids_nuevos = {}
+        anteriores = {}
+        if existentes:
+            # Valores anteriores de los que ya existían, para el historial; si cambia el padre, pierde un hijo
+            campos = ['parent_id', *(c for c in existentes[0] if c != 'id' and c not in CAMPOS_EXCLUIDOS)]
+            ids_existentes = [v['id'] for v in existentes]
+            for inicio in range(0, len(ids_existentes), 900):
+                anteriores.update((fila[0], dict(zip(campos, fila[1:]))) for fila in db.session.execute(
+                    select(Indicator.id, *(getattr(Indicator, c) for c in campos))
+                    .where(Indicator.id.in_(ids_existentes[inicio:inicio + 900]))))
+            db.session.execute(update(Indicator), existentes)
+
+        ids = dict(ids_nuevos)
+        ids.update((v['codigo'], v['id']) for v in existentes)
+        todos = dict(mapas['indicadores'], **ids_nuevos)
+        enlaces = [{'id': ids[codigo], 'parent_id': todos.get(padre)}
+                   for codigo, (_, _, padre) in preparados.items()]
+        db.session.execute(update(Indicator), enlaces)
+
+        vaciados = {anteriores[e['id']]['parent_id'] for e in enlaces
+                    if e['id'] in anteriores and anteriores[e['id']]['parent_id'] != e['parent_id']}
+        registrar_cambios(db.session, chain(
+            ((v['id'], c, anteriores[v['id']][c], v[c]) for v in existentes for c in campos if c != 'parent_id'),
+            ((e['id'], 'parent_id', anteriores[e['id']]['parent_id'], e['parent_id'])
+             for e in enlaces if e['id'] in anteriores)))
+
+        reevaluar_ids(ids.values())
+        marcar_sucios(db.session, [e['parent_id'] for e in enlaces], vaciados)
+        marcar_modificadas(db.session, Indicator.__tablename__)
+        marcar_indicadores(db.session, ids.values())
+        marcar_series(db.session, [*ids.values(), *(e['parent_id'] for e in enlaces), *vaciados])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for codigo, (linea, _, _) in preparados.items():
+            error(linea, codigo, e)
+        return
+
+    mapas['indicadores'].update(ids_nuevos)
+    resumen['insertados'] += len(nuevos)
+    resumen['actualizados'] += len(existentes)
+
+
+def importar(registros, tamano_lote=TAMANO_LOTE, al_error=None, progreso=None):
+    """Importa ``(linea, registro)`` en lotes y devuelve un resumen
+
+    ``al_error(detalle)`` recibe cada fila rechazada y ``progreso(resumen)``
+    se llama tras cada lote. Los padres deben aparecer antes que sus hijos o
+    en el mismo lote.
+    """
+    mapas = cargar_mapas()
+    resumen = {'leidos': 0, 'insertados': 0, 'actualizados': 0, 'errores': 0}
+    registros = iter(registros)
+    while True:
+        lote = list(islice(registros, tamano_lote))
+        if not lote:
+            break
+        _importar_lote(lote, mapas, resumen, al_error)
+        if progreso is not None:
+            progreso(resumen)
+    return resumen
@@ -0,0 +1,167 @@
+"""Tabla de cierre para la jerarquía de ``OrganizationalStructure``.
+
+``organizational_structure_paths`` guarda una fila por cada par
+ancestro-descendiente, de modo que "todo lo que cuelga de esta OSDE" se
+resuelve con una sola consulta indexada en lugar de recorrer la lista de
+adyacencia nivel a nivel. La tabla se mantiene con eventos del mapper al
+insertar, mover (cambio de ``parent_id``), activar/desactivar o borrar
+estructuras; ``reconstruir_cierre`` la regenera desde cero.
+"""
+from sqlalchemy import event, delete, insert, inspect, literal, not_, select, true, update
+
+from extensions import db
+from models import OrganizationalStructure, OrganizationalStructurePath, Indicator, EquipoFisico
+
+Ruta = OrganizationalStructurePath.__table__
+Estructura = OrganizationalStructure.__table__
+
+_COLUMNAS = ['ancestro_id', 'descendiente_id', 'profundidad', 'activo']
+
+
+def _subarbol_ids(conexion, nodo_id):
+    return [fila[0] for fila in conexion.execute(
+        select(Ruta.c.descendiente_id).where(Ruta.c.ancestro_id == nodo_id))]
+
+
+def _ancestros_ids(conexion, nodo_id):
+    return [fila[0] for fila in conexion.execute(
+        select(Ruta.c.ancestro_id).where(Ruta.c.descendiente_id == nodo_id))]
+
+
+def _insertar_nodo(conexion, nodo_id, parent_id, activo):
+    """Agrega las rutas de un nodo nuevo a partir de las de su padre"""
+    activo = activo is not False
+    conexion.execute(insert(Ruta).values(ancestro_id=nodo_id, descendiente_id=nodo_id,
+                                         profundidad=0, activo=activo))
+    if parent_id is not None:
+        conexion.execute(insert(Ruta).from_select(
+            _COLUMNAS,
+            select(Ruta.c.ancestro_id, literal(nodo_id), Ruta.c.profundidad + 1,
+                   Ruta.c.activo if activo else literal(False))
+            .where(Ruta.c.descendiente_id == parent_id)))
+
+
+def _mover(conexion, nodo_id, nuevo_padre):
+    """Desengancha el subárbol de sus ancestros y lo cuelga del nuevo padre"""
+    subarbol = _subarbol_ids(conexion, nodo_id)
+    ancestros = [a for a in _ancestros_ids(conexion, nodo_id) if a != nodo_id]
+    if ancestros:
+        conexion.execute(delete(Ruta).where(Ruta.c.ancestro_id.in_(ancestros),
+                                            Ruta.c.descendiente_id.in_(subarbol)))
+    if nuevo_padre is not None:
+        superior = Ruta.alias('superior')
+        inferior = Ruta.alias('inferior')
+        conexion.execute(insert(Ruta).from_select(
+            _COLUMNAS,
+            select(superior.c.ancestro_id, inferior.c.descendiente_id,
+                   superior.c.profundidad + inferior.c.profundidad + 1, literal(True))
+            .select_from(superior.join(inferior, true()))  # Producto cartesiano intencional
+            .where(superior.c.descendiente_id == nuevo_padre,
+                   inferior.c.ancestro_id == nodo_id)))
+
+
+def _recalcular_activo(conexion, nodo_id):
+    """Recalcula ``activo`` de todas las rutas que pasan por el nodo"""
+    inicio = Ruta.alias('inicio')
+    fin = Ruta.alias('fin')
+    hay_inactivo = (select(literal(1))
+                    .select_from(inicio.join(fin, fin.c.ancestro_id == inicio.c.descendiente_id)
+                                 .join(Estructura, Estructura.c.id == inicio.c.descendiente_id))
+                    .where(inicio.c.ancestro_id == Ruta.c.ancestro_id,
+                           fin.c.descendiente_id == Ruta.c.descendiente_id,
+                           Estructura.c.activo.is_(False))
+                    .correlate(Ruta)
+                    .exists())
+    conexion.execute(update(Ruta)
+                     .where(Ruta.c.ancestro_id.in_(_ancestros_ids(conexion, nodo_id)),
+                            Ruta.c.descendiente_id.in_(_subarbol_ids(conexion, nodo_id)))
+                     .values(activo=not_(hay_inactivo)))
+
+
+@event.listens_for(OrganizationalStructure, 'after_insert')
+def _al_insertar(mapper, conexion, estructura):
+    _insertar_nodo(conexion, estructura.id, estructura.parent_id, estructura.activo)
+
+
+@event.listens_for(OrganizationalStructure, 'before_update')
+def _validar_movimiento(mapper, conexion, estructura):
+    historial = inspect(estructura).attrs.parent_id.history
+    if historial.has_changes() and estructura.parent_id is not None:
+        if estructura.parent_id in _subarbol_ids(conexion, estructura.id):
+            raise ValueError("No se puede mover una estructura debajo de sí misma")
+
+
+@event.listens_for(OrganizationalStructure, 'after_update')
+def _al_actualizar(mapper, conexion, estructura):
+    estado = inspect(estructura)
+    movida = estado.attrs.parent_id.history.has_changes()
+    if movida:
+        _mover(conexion, estructura.id, estructura.parent_id)
+    if movida or estado.attrs.activo.history.has_changes():
+        _recalcular_activo(conexion, estructura.id)
+
+
+@event.listens_for(OrganizationalStructure, 'before_delete')
+def _al_borrar(mapper, conexion, estructura):
+    conexion.execute(delete(Ruta).where((Ruta.c.ancestro_id == estructura.id) |
+                                        (Ruta.c.descendiente_id == estructura.id)))
+
+
+def reconstruir_cierre(conexion=None):
+    """Regenera la tabla de cierre a partir de ``parent_id``. No hace commit.
+
+    ``conexion`` permite usarla sin aplicación (la migración que crea la tabla).
+    """
+    conexion = conexion if conexion is not None else db.session
+    nodos = {id_: (parent_id, activo is not False) for id_, parent_id, activo in
+             conexion.execute(select(Estructura.c.id, Estructura.c.parent_id, Estructura.c.activo))}
+    rutas = {}
+
+    def ancestros(id_):
+        # Lista de (ancestro, profundidad, ruta_activa) desde el propio nodo hacia la raíz
+        if id_ not in rutas:
+            parent_id, activo = nodos[id_]
+            rutas[id_] = None  # Marca de visita para detectar ciclos
+            propias = [(id_, 0, activo)]
+            if parent_id in nodos:
+                if rutas.get(parent_id, ()) is None:
+                    raise ValueError(f"Ciclo en la jerarquía organizacional en {id_}")
+                propias += [(a, d + 1, act and activo) for a, d, act in ancestros(parent_id)]
+            rutas[id_] = propias
+        return rutas[id_]
+
+    conexion.execute(delete(Ruta))
+    filas = [{'ancestro_id': a, 'descendiente_id': id_, 'profundidad': d, 'activo': act}
+             for id_ in nodos for a, d, act in ancestros(id_)]
+    if filas:
+        conexion.execute(insert(Ruta), filas)
+    return len(filas)
+
+
+def subarbol(estructura_id, solo_activos=True):
+    """Subconsulta con los ids de la estructura y todos sus descendientes"""
+    consulta = select(Ruta.c.descendiente_id).where(Ruta.c.ancestro_id == estructura_id)
+    if solo_activos:
+        consulta = consulta.where(Ruta.c.activo.is_(True))
+    return consulta
+
+
+def _en_subarbol(consulta, columna, estructura_id, solo_activos):
+    consulta = consulta.join(OrganizationalStructurePath,
+                             OrganizationalStructurePath.descendiente_id == columna)
+    consulta = consulta.filter(OrganizationalStructurePath.ancestro_id == estructura_id)
+    if solo_activos:
+        consulta = consulta.filter(OrganizationalStructurePath.activo.is_(True))
+    return consulta
+
+
+def indicadores_en_subarbol(estructura_id, solo_activos=True):
+    """Consulta de todos los indicadores asignados al subárbol de una estructura"""
+    return _en_subarbol(Indicator.query, Indicator.estructura_jerarquica_id,
+                        estructura_id, solo_activos)
+
+
+def equipos_en_subarbol(estructura_id, solo_activos=True):
+    """Consulta de todos los equipos físicos ubicados en el subárbol de una estructura"""
+    return _en_subarbol(EquipoFisico.query, EquipoFisico.estructura_id,
+                        estructura_id, solo_activos)
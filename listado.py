@@ -0,0 +1,129 @@
+"""Consulta paginada y filtrable del listado de KPIs.
+
+Proyecta solo las columnas que muestra la tabla, con perspectiva,
+periodicidad y estructura resueltas en la misma consulta, y pagina por
+keyset sobre ``id`` o ``(nombre, id)``.
+"""
+from sqlalchemy import func, or_, select, text, tuple_
+
+from busqueda import codificar_cursor, decodificar_cursor, patron_like
+from extensions import db
+from jerarquia import subarbol
+from models import Indicator, Perspective, Periodicity, OrganizationalStructure
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+ESTADOS = ('BIEN', 'REGULAR', 'MAL', 'SIN_VALOR', 'REFERENCIAS_INCOMPLETAS',
+           'FUERA_DE_RANGO', 'TIPO_NO_VALIDO')
+
+ORDENES = ('nombre', 'id')
+
+
+def filtros_desde_args(args):
+    """Extrae los filtros del listado de los parámetros de la petición"""
+    return {
+        'perspective_id': args.get('perspective', type=int),
+        'periodicity_id': args.get('periodicity', type=int),
+        'estructura_id': args.get('estructura', type=int),
+        'estado': args.get('estado') or None,
+        'texto': (args.get('q') or '').strip() or None,
+    }
+
+
+def criterios(perspective_id=None, periodicity_id=None, estructura_id=None, estado=None, texto=None):
+    """Convierte los filtros del listado en criterios de SQLAlchemy"""
+    resultado = []
+    if perspective_id is not None:
+        resultado.append(Indicator.perspective_id == perspective_id)
+    if periodicity_id is not None:
+        resultado.append(Indicator.periodicity_id == periodicity_id)
+    if estructura_id is not None:
+        resultado.append(Indicator.estructura_jerarquica_id.in_(subarbol(estructura_id)))
+    if estado is not None:
+        resultado.append(Indicator.ultima_evaluacion == estado)
+    if texto is not None:
+        patron = patron_like(texto, contiene=True)
+        resultado.append(or_(Indicator.nombre.ilike(patron, escape='\\'),
+                             Indicator.codigo.ilike(patron, escape='\\')))
+    return resultado
+
+
+def consulta(*criterios_):
+    """Consulta con las columnas del listado y los catálogos ya resueltos"""
+    return (db.session.query(Indicator.id, Indicator.codigo, Indicator.nombre, Indicator.valor_real,
+                             Indicator.unidad_medida, Indicator.ultima_evaluacion,
+                             Perspective.nombre.label('perspectiva'),
+                             Periodicity.nombre.label('periodicidad'),
+                             OrganizationalStructure.nombre.label('estructura'))
+            .outerjoin(Perspective, Indicator.perspective_id == Perspective.id)
+            .outerjoin(Periodicity, Indicator.periodicity_id == Periodicity.id)
+            .outerjoin(OrganizationalStructure,
+                       Indicator.estructura_jerarquica_id == OrganizationalStructure.id)
+            .filter(*criterios_))
+
+
+def pagina(criterios_, orden='nombre', cursor=None, limite=LIMITE_POR_DEFECTO):
+    """Devuelve ``(filas, siguiente_cursor)`` de una página del listado
+
+    Lanza ValueError si el orden o el cursor no son válidos.
+    """
+    if orden not in ORDENES:
+        raise ValueError(f"Orden no válido: {orden}")
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    q = consulta(*criterios_)
+
+    if orden == 'nombre':
+        if cursor:
+            nombre, id_ = decodificar_cursor(cursor)
+            q = q.filter(tuple_(Indicator.nombre, Indicator.id) > tuple_(nombre, id_))
+        q = q.order_by(Indicator.nombre, Indicator.id)
+    else:
+        if cursor:
+            (id_,) = decodificar_cursor(cursor)
+            q = q.filter(Indicator.id > id_)
+        q = q.order_by(Indicator.id)
+
+    filas = q.limit(limite + 1).all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        siguiente = (codificar_cursor(ultima.nombre, ultima.id) if orden == 'nombre'
+                     else codificar_cursor(ultima.id))
+    return filas, siguiente
+
+
+def sql_explain(sentencia, dialecto):
+    """``(sql, parametros)`` del EXPLAIN de ``sentencia`` para ejecutar con ``exec_driver_sql``
+
+    Los valores de los filtros viajan como parámetros del driver: nunca se
+    incrustan en el SQL, donde un texto como ``foo :bar`` se tomaría por
+    un parámetro más.
+    """
+    compilada = sentencia.compile(dialect=dialecto, compile_kwargs={'render_postcompile': True})
+    parametros = compilada.construct_params()
+    if compilada.positional:
+        parametros = tuple(parametros[nombre] for nombre in compilada.positiontup)
+    return f"EXPLAIN (FORMAT JSON) {compilada}", parametros
+
+
+def total(criterios_, estimado=False):
+    """Cuenta las filas del listado; devuelve ``(total, es_estimado)``
+
+    En PostgreSQL, con ``estimado=True`` se usa la estadística del planificador
+    (``pg_class.reltuples`` sin filtros o el ``Plan Rows`` de EXPLAIN con
+    filtros) en lugar de un COUNT(*) que recorre la tabla.
+    """
+    if estimado and db.engine.dialect.name == 'postgresql':
+        if not criterios_:
+            filas = db.session.execute(text(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = 'indicators'")).scalar()
+            if filas is not None and filas >= 0:
+                return int(filas), True
+        else:
+            sql, parametros = sql_explain(select(Indicator.id).where(*criterios_), db.engine.dialect)
+            plan = db.session.connection().exec_driver_sql(sql, parametros).scalar()
+            return int(plan[0]['Plan']['Plan Rows']), True
+
+    return db.session.query(func.count(Indicator.id)).filter(*criterios_).scalar(), False
@@ -0,0 +1,206 @@
+"""Ingesta masiva de la serie histórica de indicadores.
+
+Cada punto (indicador, fecha, valor) se asigna al período que le toca según
+``Periodicity.dias`` y se agrega a ``indicator_measurements`` sin modificar
+nunca filas existentes: si el período ya tiene valor, el punto nuevo se
+descarta. En PostgreSQL la carga usa COPY sobre una tabla temporal; en el
+resto de motores, un único ``executemany`` por lote. Tras insertar, el
+``valor_real`` de cada indicador pasa a ser su último punto y se re-evalúan
+todos en la misma transacción.
+"""
+import csv
+import io
+import math
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import and_, case, func, insert, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from agregacion import marcar_sucios
+from analitica import marcar_series
+from cambios import marcar_modificadas
+from cubo import marcar_indicadores
+from evaluacion_lote import reevaluar_ids
+from extensions import db
+from historial import registrar_cambios
+from models import Indicator, IndicatorMeasurement, Periodicity
+
+EPOCA = date(1970, 1, 1)
+TAMANO_LOTE = 50000
+_TAMANO_BLOQUE = 900
+
+
+def _en_bloques(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), _TAMANO_BLOQUE):
+        yield ids[inicio:inicio + _TAMANO_BLOQUE]
+
+
+def inicio_periodo(fecha, dias):
+    """Primer día del período de ``dias`` días (contados desde 1970-01-01) que contiene ``fecha``"""
+    if isinstance(fecha, datetime):
+        fecha = fecha.date()
+    return EPOCA + timedelta(days=(fecha - EPOCA).days // dias * dias)
+
+
+def _dias_por_indicador(ids):
+    dias = {}
+    for bloque in _en_bloques(ids):
+        dias.update(db.session.query(Indicator.id, Periodicity.dias)
+                    .join(Periodicity, Indicator.periodicity_id == Periodicity.id)
+                    .filter(Indicator.id.in_(bloque)))
+    return dias
+
+
+def _copiar_postgresql(filas):
+    """Carga las filas con COPY en una tabla temporal y las agrega sin duplicar"""
+    conexion = db.session.connection()
+    conexion.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS mediciones_carga "
+        "(indicator_id integer, periodo_inicio date, valor double precision) "
+        "ON COMMIT DELETE ROWS"))
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows((id_, periodo.isoformat(), repr(valor))
+                                 for (id_, periodo), valor in filas.items())
+    buffer.seek(0)
+
+    sql = "COPY mediciones_carga (indicator_id, periodo_inicio, valor) FROM STDIN WITH (FORMAT csv)"
+    cursor = conexion.connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copia:
+                copia.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+    resultado = conexion.execute(text(
+        "INSERT INTO indicator_measurements (indicator_id, periodo_inicio, valor, registrado_en) "
+        "SELECT indicator_id, periodo_inicio, valor, timezone('utc', now()) FROM mediciones_carga "
+        "ON CONFLICT DO NOTHING"))
+    conexion.execute(text("TRUNCATE mediciones_carga"))
+    return resultado.rowcount
+
+
+def _insertar_generico(filas):
+    """Inserta las filas con un único executemany, ignorando períodos ya cargados"""
+    tabla = IndicatorMeasurement.__table__
+    if db.engine.dialect.name == 'sqlite':
+        sentencia = sqlite_insert(tabla).on_conflict_do_nothing()
+    else:
+        sentencia = insert(tabla)
+    resultado = db.session.execute(sentencia, [
+        {'indicator_id': id_, 'periodo_inicio': periodo, 'valor': valor}
+        for (id_, periodo), valor in filas.items()
+    ])
+    return resultado.rowcount
+
+
+def _actualizar_ultimo_valor(ids):
+    """Copia a ``valor_real`` el último punto de cada indicador"""
+    padres = set()
+    for bloque in _en_bloques(ids):
+        ultimo = (select(IndicatorMeasurement.indicator_id,
+                         func.max(IndicatorMeasurement.periodo_inicio).label('periodo_inicio'))
+                  .where(IndicatorMeasurement.indicator_id.in_(bloque))
+                  .group_by(IndicatorMeasurement.indicator_id)
+                  .subquery())
+        filas = (db.session.query(IndicatorMeasurement.indicator_id, IndicatorMeasurement.valor,
+                                  Indicator.parent_id, Indicator.valor_real)
+                 .join(ultimo, and_(ultimo.c.indicator_id == IndicatorMeasurement.indicator_id,
+                                    ultimo.c.periodo_inicio == IndicatorMeasurement.periodo_inicio))
+                 .join(Indicator, Indicator.id == IndicatorMeasurement.indicator_id)
+                 .all())
+        if not filas:
+            continue
+        valores = {id_: valor for id_, valor, _, _ in filas}
+        padres.update(padre for _, _, padre, _ in filas)
+        registrar_cambios(db.session, ((id_, 'valor_real', anterior, valor) for id_, valor, _, anterior in filas))
+        marcar_indicadores(db.session, valores)
+        db.session.execute(
+            update(Indicator)
+            .where(Indicator.id.in_(list(valores)))
+            .values(valor_real=case(valores, value=Indicator.id))
+            .execution_options(synchronize_session=False)
+        )
+    marcar_sucios(db.session, padres)
+    marcar_modificadas(db.session, Indicator.__tablename__)
+
+
+def ingerir_lote(puntos):
+    """Ingiere un lote de puntos ``(indicator_id, fecha, valor)`` en una sola transacción
+
+    Devuelve un resumen con los puntos recibidos, insertados y descartados
+    (indicador inexistente, valor vacío o período ya cargado).
+    """
+    puntos = list(puntos)
+    dias = _dias_por_indicador({id_ for id_, _, _ in puntos})
+    filas = {}
+    for id_, fecha, valor in puntos:
+        if id_ not in dias or valor is None:
+            continue
+        # Dentro del lote, el primer punto de cada período es el que se conserva
+        filas.setdefault((id_, inicio_periodo(fecha, dias[id_])), float(valor))
+
+    insertados = 0
+    if filas:
+        if db.engine.dialect.name == 'postgresql':
+            insertados = _copiar_postgresql(filas)
+        else:
+            insertados = _insertar_generico(filas)
+        ids = {id_ for id_, _ in filas}
+        _actualizar_ultimo_valor(ids)
+        reevaluar_ids(ids)
+        marcar_modificadas(db.session, IndicatorMeasurement.__tablename__)
+        marcar_series(db.session, ids)
+    db.session.commit()
+
+    if insertados is None or insertados < 0:
+        insertados = len(filas)
+    return {'recibidos': len(puntos), 'insertados': insertados,
+            'descartados': len(puntos) - insertados}
+
+
+def ingerir(puntos, tamano_lote=TAMANO_LOTE, progreso=None):
+    """Ingiere un iterable de puntos en lotes; ``progreso(resumen)`` se llama tras cada lote"""
+    puntos = iter(puntos)
+    total = {'recibidos': 0, 'insertados': 0, 'descartados': 0}
+    inicio = time.perf_counter()
+    while True:
+        lote = list(islice(puntos, tamano_lote))
+        if not lote:
+            break
+        for clave, valor in ingerir_lote(lote).items():
+            total[clave] += valor
+        if progreso is not None:
+            progreso(total)
+    total['segundos'] = time.perf_counter() - inicio
+    total['puntos_por_segundo'] = total['recibidos'] / total['segundos'] if total['segundos'] else 0.0
+    return total
+
+
+def _punto(fila, ids_por_codigo):
+    valor = fila.get('valor')
+    fecha = date.fromisoformat((fila.get('fecha') or '')[:10])
+    valor = float(valor) if valor not in (None, '') else None
+    if valor is not None and not math.isfinite(valor):
+        raise ValueError(f"valor no finito: {fila['valor']}")
+    return ids_por_codigo.get(fila['codigo']), fecha, valor
+
+
+def leer_csv(archivo, ids_por_codigo, al_error=None):
+    """Genera puntos a partir de un CSV con columnas codigo, fecha (ISO) y valor
+
+    Una fila con fecha o valor no válidos se salta y se informa a
+    ``al_error({'linea', 'codigo', 'error'})`` sin detener la carga.
+    """
+    for linea, fila in enumerate(csv.DictReader(archivo), start=2):
+        try:
+            yield _punto(fila, ids_por_codigo)
+        except ValueError as e:
+            if al_error is not None:
+                al_error({'linea': linea, 'codigo': fila.get('codigo'), 'error': str(e)})
@@ -0,0 +1,203 @@
+"""Métricas por endpoint: consultas SQL, tiempo de SQL, de render y total.
+
+Los eventos del engine suman cada sentencia a la petición en curso (``g``)
+y los hooks de Flask vuelcan el resultado en contadores por endpoint, que se
+publican en formato de texto de Prometheus. El coste por sentencia es un
+par de ``perf_counter``, una suma y, como mucho, una operación sobre un
+heap de cinco elementos. Los contadores son por proceso.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Límites (en segundos) de los buckets del histograma de duración
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SENTENCIAS_LENTAS = 5  # Por petición y por endpoint
+
+
+class _Endpoint:
+    def __init__(self):
+        self.peticiones = 0
+        self.segundos = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.consultas = 0
+        self.segundos_sql = 0.0
+        self.segundos_render = 0.0
+        self.max_consultas = 0
+        self.lentas = {}  # sentencia -> segundos de su ejecución más lenta
+
+
+class Metricas:
+    """Acumula las métricas de las peticiones terminadas"""
+
+    def __init__(self):
+        self._endpoints = defaultdict(_Endpoint)
+        self._lock = threading.Lock()
+
+    def registrar(self, endpoint, segundos, consultas, segundos_sql, segundos_render, lentas):
+        with self._lock:
+            e = self._endpoints[endpoint]
+            e.peticiones += 1
+            e.segundos += segundos
+            for i, limite in enumerate(BUCKETS):
+                if segundos <= limite:
+                    e.buckets[i] += 1
+            e.consultas += consultas
+            e.segundos_sql += segundos_sql
+            e.segundos_render += segundos_render
+            e.max_consultas = max(e.max_consultas, consultas)
+            for segundos_sentencia, sentencia in lentas:
+                if segundos_sentencia > e.lentas.get(sentencia, -1.0):
+                    e.lentas[sentencia] = segundos_sentencia
+            if len(e.lentas) > SENTENCIAS_LENTAS:
+                e.lentas = dict(heapq.nlargest(SENTENCIAS_LENTAS, e.lentas.items(), key=lambda x: x[1]))
+
+    def resumen(self):
+        """Copia de las métricas por endpoint, con las sentencias más lentas primero"""
+        with self._lock:
+            return {
+                nombre: {'peticiones': e.peticiones, 'segundos': e.segundos, 'consultas': e.consultas,
+                         'segundos_sql': e.segundos_sql, 'segundos_render': e.segundos_render,
+                         'max_consultas': e.max_consultas, 'buckets': list(e.buckets),
+                         'lentas': sorted(((t, sql) for sql, t in e.lentas.items()), reverse=True)}
+                for nombre, e in self._endpoints.items()
+            }
+
+    def reiniciar(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def prometheus(self):
+        """Texto en el formato de exposición de Prometheus"""
+        lineas = []
+
+        def metrica(nombre, tipo, ayuda, valores):
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            lineas.extend(valores)
+
+        datos = sorted(self.resumen().items())
+        etiqueta = lambda endpoint: 'endpoint="%s"' % endpoint.replace('\\', '\\\\').replace('"', '\\"')
+
+        histograma = []
+        for endpoint, e in datos:
+            for limite, n in zip(BUCKETS, e['buckets']):
+                histograma.append(f'kpi_http_request_seconds_bucket{{{etiqueta(endpoint)},le="{limite}"}} {n}')
+            histograma.append(f'kpi_http_request_seconds_bucket{{{etiqueta(endpoint)},le="+Inf"}} {e["peticiones"]}')
+            histograma.append(f'kpi_http_request_seconds_sum{{{etiqueta(endpoint)}}} {e["segundos"]}')
+            histograma.append(f'kpi_http_request_seconds_count{{{etiqueta(endpoint)}}} {e["peticiones"]}')
+        metrica('kpi_http_request_seconds', 'histogram', 'Duración de las peticiones', histograma)
+
+        for nombre, clave, tipo, ayuda in (
+                ('kpi_sql_queries_total', 'consultas', 'counter', 'Sentencias SQL ejecutadas'),
+                ('kpi_sql_seconds_total', 'segundos_sql', 'counter', 'Tiempo total en SQL'),
+                ('kpi_render_seconds_total', 'segundos_render', 'counter', 'Tiempo total de render de plantillas'),
+                ('kpi_sql_queries_max', 'max_consultas', 'gauge', 'Máximo de sentencias en una petición')):
+            metrica(nombre, tipo, ayuda, [f'{nombre}{{{etiqueta(endpoint)}}} {e[clave]}' for endpoint, e in datos])
+
+        lentas = []
+        for endpoint, e in datos:
+            vistas = set()
+            for segundos, sql in e['lentas']:
+                # Sentencias que solo difieren tras el recorte darían series duplicadas
+                sql = ' '.join(sql.split())[:200].replace('\\', '\\\\').replace('"', '\\"')
+                if sql in vistas:
+                    continue
+                vistas.add(sql)
+                lentas.append(f'kpi_sql_slowest_seconds{{{etiqueta(endpoint)},sql="{sql}"}} {segundos}')
+        metrica('kpi_sql_slowest_seconds', 'gauge', 'Sentencias más lentas por endpoint', lentas)
+        return '\n'.join(lineas) + '\n'
+
+
+metricas = Metricas()
+
+
+def _peticion():
+    return g.get('_metricas') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_sentencia(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metricas_inicio', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_sentencia(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info['_metricas_inicio'].pop()
+    datos = _peticion()
+    if datos is None:
+        return
+    segundos = time.perf_counter() - inicio
+    datos['consultas'] += 1
+    datos['segundos_sql'] += segundos
+    lentas = datos['lentas']
+    if len(lentas) < SENTENCIAS_LENTAS:
+        heapq.heappush(lentas, (segundos, statement))
+    elif segundos > lentas[0][0]:
+        heapq.heapreplace(lentas, (segundos, statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _error_de_sentencia(contexto):
+    if contexto.connection is not None and contexto.connection.info.get('_metricas_inicio'):
+        contexto.connection.info['_metricas_inicio'].pop()
+
+
+def _antes_de_render(sender, template, context, **extra):
+    datos = _peticion()
+    if datos is not None:
+        datos['render_inicio'] = time.perf_counter()
+
+
+def _despues_de_render(sender, template, context, **extra):
+    datos = _peticion()
+    if datos is not None and datos.get('render_inicio') is not None:
+        datos['segundos_render'] += time.perf_counter() - datos.pop('render_inicio')
+
+
+def instrumentar(app):
+    """Registra los hooks de métricas y el endpoint ``/metrics`` en la aplicación
+
+    Con ``METRICS_SLOW_REQUEST_MS`` (0 lo desactiva) las peticiones que lo
+    superan se registran en el log junto con sus sentencias SQL más lentas.
+    """
+    umbral_peticion = app.config.get('METRICS_SLOW_REQUEST_MS', 0) / 1000
+
+    @app.before_request
+    def _iniciar():
+        g._metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'segundos_sql': 0.0,
+                       'segundos_render': 0.0, 'lentas': []}
+
+    @app.after_request
+    def _registrar(respuesta):
+        datos = g.pop('_metricas', None)
+        if datos is None or request.endpoint == 'metrics':
+            return respuesta
+        segundos = time.perf_counter() - datos['inicio']
+        endpoint = request.endpoint or 'sin_endpoint'
+        metricas.registrar(endpoint, segundos, datos['consultas'], datos['segundos_sql'],
+                           datos['segundos_render'], datos['lentas'])
+        if umbral_peticion and segundos >= umbral_peticion:
+            logger.warning('Petición lenta %s %s: %.0f ms, %d consultas (%.0f ms en SQL). Sentencias lentas: %s',
+                           request.method, request.path, segundos * 1000, datos['consultas'],
+                           datos['segundos_sql'] * 1000,
+                           '; '.join(f'[{s * 1000:.0f} ms] {sql}' for s, sql in
+                                     sorted(datos['lentas'], reverse=True)) or '-')
+        return respuesta
+
+    before_render_template.connect(_antes_de_render, app)
+    template_rendered.connect(_despues_de_render, app)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(metricas.prometheus(), mimetype='text/plain; version=0.0.4')
+
+    return app
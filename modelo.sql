@@ -59,6 +59,10 @@ CREATE TABLE equipos_fisicos (
     codigo_activo VARCHAR(30) UNIQUE NOT NULL,
     nombre VARCHAR(50) NOT NULL,
     --coordenadas GEOGRAPHY(POINT, 4326),
+    coordenadas VARCHAR(50),
+    latitud DOUBLE PRECISION,
+    longitud DOUBLE PRECISION,
+    celda_geo VARCHAR(12),
     estructura_id INTEGER NOT NULL REFERENCES organizational_structures(id),
     fecha_adquisicion DATE,
     estado VARCHAR(20) CHECK (estado IN ('OPERATIVO', 'MANTENIMIENTO', 'BAJA')),
@@ -83,6 +87,14 @@ CREATE TABLE indicators (
     estructura_jerarquica_id INTEGER REFERENCES organizational_structures(id),
     centro_costo VARCHAR(50),
     parent_id INTEGER REFERENCES indicators(id),
+    ultima_evaluacion VARCHAR(20),
+    fecha_ultima_evaluacion TIMESTAMP,
+    evaluacion_automatica BOOLEAN DEFAULT TRUE,
+    evaluacion_reservada_hasta TIMESTAMP,
+    evaluacion_reservada_por VARCHAR(100),
+    latitud DOUBLE PRECISION,
+    longitud DOUBLE PRECISION,
+    celda_geo VARCHAR(12),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     creado_por VARCHAR(50),
@@ -113,13 +125,114 @@ CREATE TABLE indicator_history (
     fecha_cambio TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     usuario VARCHAR(50) NOT NULL
 );
+CREATE INDEX idx_indicator_history_indicador_fecha ON indicator_history(indicator_id, fecha_cambio);
+
+-- Cambios de estado de evaluación para el flujo SSE; se purgan tras la retención
+CREATE TABLE indicator_events (
+    id BIGSERIAL PRIMARY KEY,
+    indicator_id INTEGER NOT NULL,
+    estado_anterior VARCHAR(20),
+    estado_nuevo VARCHAR(20),
+    valor_real FLOAT,
+    perspective_id INTEGER,
+    estructura_id INTEGER,
+    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX ix_indicator_events_fecha ON indicator_events(fecha);
+
+-- Índice para recorrer la jerarquía de indicadores (agregación padre-hijos)
+CREATE INDEX idx_indicators_parent_id ON indicators(parent_id);
+
+-- Planificador: indicadores vencidos por periodicidad
+CREATE INDEX idx_indicators_periodicidad_evaluacion ON indicators(periodicity_id, fecha_ultima_evaluacion);
+
+-- Tabla de cierre de la jerarquía organizacional (ancestro -> descendiente)
+CREATE TABLE organizational_structure_paths (
+    ancestro_id INTEGER NOT NULL REFERENCES organizational_structures(id),
+    descendiente_id INTEGER NOT NULL REFERENCES organizational_structures(id),
+    profundidad INTEGER NOT NULL,
+    activo BOOLEAN NOT NULL DEFAULT TRUE, -- Todos los nodos de la ruta están activos
+    PRIMARY KEY (ancestro_id, descendiente_id)
+);
+CREATE INDEX idx_org_paths_descendiente ON organizational_structure_paths(descendiente_id);
+CREATE INDEX idx_indicators_estructura ON indicators(estructura_jerarquica_id);
+CREATE INDEX idx_equipos_estructura ON equipos_fisicos(estructura_id);
+
+-- Búsqueda por prefijo/subcadena (ILIKE) y paginación por nombre en los selectores
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_indicators_nombre ON indicators(nombre, id);
+CREATE INDEX idx_indicators_nombre_trgm ON indicators USING gin (nombre gin_trgm_ops);
+CREATE INDEX idx_indicators_codigo_trgm ON indicators USING gin (codigo gin_trgm_ops);
+CREATE INDEX idx_org_nombre ON organizational_structures(nombre, id);
+CREATE INDEX idx_org_nombre_trgm ON organizational_structures USING gin (nombre gin_trgm_ops);
+CREATE INDEX idx_org_codigo_trgm ON organizational_structures USING gin (codigo gin_trgm_ops);
+
+-- Serie histórica de mediciones: un punto por indicador y período (solo inserción)
+CREATE TABLE indicator_measurements (
+    indicator_id INTEGER NOT NULL REFERENCES indicators(id),
+    periodo_inicio DATE NOT NULL, -- Inicio del período según periodicities.dias
+    valor FLOAT NOT NULL,
+    registrado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (indicator_id, periodo_inicio)
+);
+
+-- Cubo dimensional: dimensiones extraídas por indicador y celdas preagregadas
+CREATE TABLE indicator_dimensions (
+    indicator_id INTEGER PRIMARY KEY,
+    clave VARCHAR(40) NOT NULL, -- Celda del cubo a la que pertenece
+    perspective_id INTEGER,
+    periodicity_id INTEGER,
+    estructura_id INTEGER,
+    anio INTEGER,
+    trimestre VARCHAR(10),
+    mes INTEGER,
+    provincia VARCHAR(100),
+    municipio VARCHAR(100),
+    centro_costo VARCHAR(50),
+    valor_real FLOAT,
+    valor_planificado FLOAT,
+    ultima_evaluacion VARCHAR(20)
+);
+CREATE INDEX idx_indicator_dimensions_clave ON indicator_dimensions(clave);
+
+CREATE TABLE indicator_cube (
+    clave VARCHAR(40) PRIMARY KEY,
+    perspective_id INTEGER,
+    periodicity_id INTEGER,
+    estructura_id INTEGER,
+    anio INTEGER,
+    trimestre VARCHAR(10),
+    mes INTEGER,
+    provincia VARCHAR(100),
+    municipio VARCHAR(100),
+    centro_costo VARCHAR(50),
+    indicadores INTEGER NOT NULL,
+    con_valor INTEGER NOT NULL,
+    suma_real FLOAT,
+    con_planificado INTEGER NOT NULL,
+    suma_planificado FLOAT,
+    bien INTEGER NOT NULL,
+    regular INTEGER NOT NULL,
+    mal INTEGER NOT NULL
+);
+CREATE INDEX idx_indicator_cube_perspective ON indicator_cube(perspective_id);
+CREATE INDEX idx_indicator_cube_estructura ON indicator_cube(estructura_id);
+
+-- Índice espacial: GiST sobre point(longitud, latitud) para consultas por rectángulo/radio;
+-- celda_geo (geohash) es el equivalente portable que usan los demás motores
+CREATE INDEX idx_equipos_punto ON equipos_fisicos USING gist (point(longitud, latitud));
+CREATE INDEX idx_indicators_punto ON indicators USING gist (point(longitud, latitud));
+CREATE INDEX idx_equipos_celda_geo ON equipos_fisicos(celda_geo);
+CREATE INDEX idx_indicator_equipment_equipo ON indicator_equipment(equipo_id);
+CREATE INDEX idx_indicators_celda_geo ON indicators(celda_geo);
+CREATE INDEX idx_indicator_dimensions_provincia ON indicator_dimensions(provincia);
 
 -- Insertar datos iniciales para tipos de comparación
 INSERT INTO comparison_types (codigo, nombre, descripcion, formula_evaluacion) VALUES
 ('TYPE1', 'Tipo 1: Mayor o igual Ref1', 'Bien si ≥ Ref1, Regular si > Ref2, Mal si ≤ Ref2', 'IF valor >= ref1 THEN "BIEN" ELSIF valor > ref2 THEN "REGULAR" ELSE "MAL" END'),
 ('TYPE2', 'Tipo 2: Menor o igual Ref1', 'Bien si ≤ Ref1, Regular si < Ref2, Mal si ≥ Ref2', 'IF valor <= ref1 THEN "BIEN" ELSIF valor < ref2 THEN "REGULAR" ELSE "MAL" END'),
-('TYPE3', 'Tipo 3: Entre Ref2 y Ref1', 'Bien si entre Ref2-Ref1, Regular si entre Ref1-Ref3 o Ref2-Ref4, Mal si entre Ref3-Ref4', 'Complex evaluation'),
-('TYPE4', 'Tipo 4: Entre Ref3 y Ref4', 'Bien si entre Ref3-Ref4, Regular si entre Ref1-Ref3 o Ref2-Ref4, Mal si entre Ref2-Ref1', 'Complex evaluation');
+('TYPE3', 'Tipo 3: Entre Ref2 y Ref1', 'Bien si entre Ref2-Ref1, Regular si entre Ref1-Ref3 o Ref2-Ref4, Mal si entre Ref3-Ref4', 'IF ref1 IS NULL OR ref2 IS NULL OR ref3 IS NULL OR ref4 IS NULL THEN "REFERENCIAS_INCOMPLETAS" ELSIF valor BETWEEN ref2 AND ref1 THEN "BIEN" ELSIF (ref1 < valor AND valor < ref3) OR (ref2 < valor AND valor < ref4) THEN "REGULAR" ELSIF valor BETWEEN ref3 AND ref4 THEN "MAL" ELSE "FUERA_DE_RANGO" END'),
+('TYPE4', 'Tipo 4: Entre Ref3 y Ref4', 'Bien si entre Ref3-Ref4, Regular si entre Ref1-Ref3 o Ref2-Ref4, Mal si entre Ref2-Ref1', 'IF ref1 IS NULL OR ref2 IS NULL OR ref3 IS NULL OR ref4 IS NULL THEN "REFERENCIAS_INCOMPLETAS" ELSIF valor BETWEEN ref3 AND ref4 THEN "BIEN" ELSIF (ref1 < valor AND valor < ref3) OR (ref2 < valor AND valor < ref4) THEN "REGULAR" ELSIF valor BETWEEN ref2 AND ref1 THEN "MAL" ELSE "FUERA_DE_RANGO" END');
 
 -- Insertar métodos de agregación
 INSERT INTO aggregation_methods (codigo, nombre, descripcion) VALUES
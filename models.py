@@ -1,13 +1,6 @@
-from enum import Enum
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Enum as SQLEnum, JSON
-from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from extensions import Config, db
+from extensions import db
 from datetime import datetime
 
-#db = SQLAlchemy()
 class Perspective(db.Model):
     __tablename__ = 'perspectives'
     
@@ -51,7 +44,7 @@ class OrganizationalStructure(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     codigo = db.Column(db.String(20), unique=True, nullable=False)
-    nombre = db.Column(db.String(50), nullable=False)
+    nombre = db.Column(db.String(50), nullable=False, index=True)
     parent_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'))
     level_id = db.Column(db.Integer, db.ForeignKey('hierarchy_levels.id'), nullable=False)
     activo = db.Column(db.Boolean, default=True)
@@ -69,10 +62,20 @@ class HierarchyLevel(db.Model):
     descripcion = db.Column(db.Text)
     nivel = db.Column(db.Integer, nullable=False)
 
+# Tabla de cierre de la jerarquía organizacional: una fila por cada par
+# ancestro-descendiente (incluido el propio nodo con profundidad 0)
+class OrganizationalStructurePath(db.Model):
+    __tablename__ = 'organizational_structure_paths'
+    
+    ancestro_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'), primary_key=True)
+    descendiente_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'), primary_key=True, index=True)
+    profundidad = db.Column(db.Integer, nullable=False)
+    activo = db.Column(db.Boolean, nullable=False, default=True)  # Todos los nodos de la ruta están activos
+
 # Tabla de relación muchos-a-muchos
 indicator_equipment = db.Table('indicator_equipment',
     db.Column('indicator_id', db.Integer, db.ForeignKey('indicators.id'), primary_key=True),
-    db.Column('equipo_id', db.Integer, db.ForeignKey('equipos_fisicos.id'), primary_key=True),
+    db.Column('equipo_id', db.Integer, db.ForeignKey('equipos_fisicos.id'), primary_key=True, index=True),
     db.Column('fecha_asociacion', db.DateTime, default=datetime.utcnow)
 )
 
@@ -83,7 +86,11 @@ class EquipoFisico(db.Model):
     codigo_activo = db.Column(db.String(30), unique=True, nullable=False)
     nombre = db.Column(db.String(50), nullable=False)
     coordenadas = db.Column(db.String(50))
-    estructura_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'), nullable=False)
+    # Derivadas de ``coordenadas`` al guardar (geografia.py)
+    latitud = db.Column(db.Float)
+    longitud = db.Column(db.Float)
+    celda_geo = db.Column(db.String(12), index=True)  # Geohash
+    estructura_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'), nullable=False, index=True)
     fecha_adquisicion = db.Column(db.Date)
     estado = db.Column(db.String(20))
     ultimo_mantenimiento = db.Column(db.Date)
@@ -94,10 +101,11 @@ class EquipoFisico(db.Model):
 
 class Indicator(db.Model):
     __tablename__ = 'indicators'
+    __table_args__ = (db.Index('idx_indicators_periodicidad_evaluacion', 'periodicity_id', 'fecha_ultima_evaluacion'),)
     
     id = db.Column(db.Integer, primary_key=True)
     codigo = db.Column(db.String(30), unique=True, nullable=False)
-    nombre = db.Column(db.String(100), nullable=False)
+    nombre = db.Column(db.String(100), nullable=False, index=True)
     
     # Relaciones con tablas de configuración
     perspective_id = db.Column(db.Integer, db.ForeignKey('perspectives.id'))
@@ -112,7 +120,7 @@ class Indicator(db.Model):
     aggregation_method_id = db.Column(db.Integer, db.ForeignKey('aggregation_methods.id'), nullable=False)
     aggregation_method = db.relationship('AggregationMethod')
     
-    estructura_jerarquica_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'))
+    estructura_jerarquica_id = db.Column(db.Integer, db.ForeignKey('organizational_structures.id'), index=True)
     organizational_structure = db.relationship('OrganizationalStructure')
     
     # Campos de valores y mediciones
@@ -125,14 +133,21 @@ class Indicator(db.Model):
     ultima_evaluacion = db.Column(db.String(20))
     fecha_ultima_evaluacion = db.Column(db.DateTime)
     evaluacion_automatica = db.Column(db.Boolean, default=True)
+    # Reserva del planificador: quién evalúa el indicador y hasta cuándo
+    evaluacion_reservada_hasta = db.Column(db.DateTime)
+    evaluacion_reservada_por = db.Column(db.String(100))
     
     # Campos dimensionales
     tiempo_dimension = db.Column(db.JSON)  # Ej: {"año": 2023, "trimestre": "Q1"}
     ubicacion_geografica = db.Column(db.JSON)
+    # Derivadas de ``ubicacion_geografica`` al guardar (geografia.py)
+    latitud = db.Column(db.Float)
+    longitud = db.Column(db.Float)
+    celda_geo = db.Column(db.String(12), index=True)  # Geohash
     centro_costo = db.Column(db.String(50))
     
     # Relación jerárquica entre indicadores
-    parent_id = db.Column(db.Integer, db.ForeignKey('indicators.id'))
+    parent_id = db.Column(db.Integer, db.ForeignKey('indicators.id'), index=True)
     children = db.relationship('Indicator', back_populates='parent', remote_side=[id])
     parent = db.relationship('Indicator', back_populates='children', remote_side=[parent_id])
     
@@ -151,61 +166,18 @@ class Indicator(db.Model):
         return f'<Indicator {self.codigo}: {self.nombre}>'
     
     def evaluar(self):
-        """Evalúa el indicador según su tipo de comparación"""
+        """Evalúa el indicador con la fórmula de su tipo de comparación"""
+        from reglas import cache_reglas
+        
         if not self.valor_real:
             return "SIN_VALOR"
-            
-        refs = self.referencias or {}
         
         try:
-            if self.comparison_type.codigo == 'TYPE1':
-                # Tipo 1: Mayor o igual Ref1 = Bien; >Ref2 = Regular; <=Ref2 = Mal
-                if self.valor_real >= refs.get('ref1', 0):
-                    return "BIEN"
-                elif self.valor_real > refs.get('ref2', 0):
-                    return "REGULAR"
-                else:
-                    return "MAL"
-                    
-            elif self.comparison_type.codigo == 'TYPE2':
-                # Tipo 2: Menor o igual Ref1 = Bien; <Ref2 = Regular; >=Ref2 = Mal
-                if self.valor_real <= refs.get('ref1', 0):
-                    return "BIEN"
-                elif self.valor_real < refs.get('ref2', 0):
-                    return "REGULAR"
-                else:
-                    return "MAL"
-                    
-            elif self.comparison_type.codigo == 'TYPE3':
-                # Tipo 3: Entre Ref2 y Ref1 = Bien; otros rangos específicos = Regular/Mal
-                if not all(k in refs for k in ['ref1', 'ref2', 'ref3', 'ref4']):
-                    return "REFERENCIAS_INCOMPLETAS"
-                
-                if refs['ref2'] <= self.valor_real <= refs['ref1']:
-                    return "BIEN"
-                elif (refs['ref1'] < self.valor_real < refs['ref3']) or (refs['ref2'] < self.valor_real < refs['ref4']):
-                    return "REGULAR"
-                elif refs['ref3'] <= self.valor_real <= refs['ref4']:
-                    return "MAL"
-                else:
-                    return "FUERA_DE_RANGO"
-                    
-            elif self.comparison_type.codigo == 'TYPE4':
-                # Tipo 4: Entre Ref3 y Ref4 = Bien; otros rangos específicos = Regular/Mal
-                if not all(k in refs for k in ['ref1', 'ref2', 'ref3', 'ref4']):
-                    return "REFERENCIAS_INCOMPLETAS"
-                
-                if refs['ref3'] <= self.valor_real <= refs['ref4']:
-                    return "BIEN"
-                elif (refs['ref1'] < self.valor_real < refs['ref3']) or (refs['ref2'] < self.valor_real < refs['ref4']):
-                    return "REGULAR"
-                elif refs['ref2'] <= self.valor_real <= refs['ref1']:
-                    return "MAL"
-                else:
-                    return "FUERA_DE_RANGO"
-                    
-            else:
+            regla = cache_reglas.regla(self.comparison_type.codigo,
+                                       getattr(self.comparison_type, 'formula_evaluacion', None))
+            if regla is None:
                 return "TIPO_NO_VALIDO"
+            return regla.evaluar(self.valor_real, self.referencias or {})
                 
         except Exception as e:
             return f"ERROR_EVALUACION: {str(e)}"
@@ -217,6 +189,15 @@ class Indicator(db.Model):
             self.fecha_ultima_evaluacion = datetime.utcnow()
             db.session.commit()
     
+    @staticmethod
+    def validar_referencias(codigo_tipo, refs):
+        """Verifica que estén las referencias que exige el tipo de comparación"""
+        if codigo_tipo in ['TYPE1', 'TYPE2'] and not all(k in refs for k in ['ref1', 'ref2']):
+            raise ValueError("Faltan referencias requeridas (ref1 y ref2)")
+        
+        if codigo_tipo in ['TYPE3', 'TYPE4'] and not all(k in refs for k in ['ref1', 'ref2', 'ref3', 'ref4']):
+            raise ValueError("Faltan referencias requeridas (ref1, ref2, ref3 y ref4)")
+    
     @classmethod
     def crear_con_referencias(cls, **kwargs):
         """Crea un indicador con validación de referencias"""
@@ -231,15 +212,88 @@ class Indicator(db.Model):
         if not comparison_type:
             raise ValueError("Tipo de comparación no válido")
         
-        if comparison_type.codigo in ['TYPE1', 'TYPE2'] and not all(k in refs for k in ['ref1', 'ref2']):
-            raise ValueError("Faltan referencias requeridas (ref1 y ref2)")
-        
-        if comparison_type.codigo in ['TYPE3', 'TYPE4'] and not all(k in refs for k in ['ref1', 'ref2', 'ref3', 'ref4']):
-            raise ValueError("Faltan referencias requeridas (ref1, ref2, ref3 y ref4)")
+        cls.validar_referencias(comparison_type.codigo, refs)
         
         indicador = cls(**kwargs)
         db.session.add(indicador)
         db.session.commit()
         indicador.actualizar_evaluacion()
         
-        return indicador
\ No newline at end of file
+        return indicador
+
+# Serie histórica de valores de un indicador (solo inserción, un punto por período)
+class IndicatorMeasurement(db.Model):
+    __tablename__ = 'indicator_measurements'
+    
+    indicator_id = db.Column(db.Integer, db.ForeignKey('indicators.id'), primary_key=True)
+    periodo_inicio = db.Column(db.Date, primary_key=True)  # Inicio del período según Periodicity.dias
+    valor = db.Column(db.Float, nullable=False)
+    registrado_en = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Dimensiones de cada indicador ya extraídas de sus campos JSON (hechos del cubo)
+class IndicatorDimension(db.Model):
+    __tablename__ = 'indicator_dimensions'
+    
+    indicator_id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(40), nullable=False, index=True)  # Celda del cubo a la que pertenece
+    perspective_id = db.Column(db.Integer)
+    periodicity_id = db.Column(db.Integer)
+    estructura_id = db.Column(db.Integer)
+    anio = db.Column(db.Integer)
+    trimestre = db.Column(db.String(10))
+    mes = db.Column(db.Integer)
+    provincia = db.Column(db.String(100), index=True)
+    municipio = db.Column(db.String(100))
+    centro_costo = db.Column(db.String(50))
+    valor_real = db.Column(db.Float)
+    valor_planificado = db.Column(db.Float)
+    ultima_evaluacion = db.Column(db.String(20))
+
+# Cubo preagregado: una fila por combinación de dimensiones
+class IndicatorCube(db.Model):
+    __tablename__ = 'indicator_cube'
+    
+    clave = db.Column(db.String(40), primary_key=True)
+    perspective_id = db.Column(db.Integer, index=True)
+    periodicity_id = db.Column(db.Integer)
+    estructura_id = db.Column(db.Integer, index=True)
+    anio = db.Column(db.Integer)
+    trimestre = db.Column(db.String(10))
+    mes = db.Column(db.Integer)
+    provincia = db.Column(db.String(100))
+    municipio = db.Column(db.String(100))
+    centro_costo = db.Column(db.String(50))
+    indicadores = db.Column(db.Integer, nullable=False)
+    con_valor = db.Column(db.Integer, nullable=False)
+    suma_real = db.Column(db.Float)
+    con_planificado = db.Column(db.Integer, nullable=False)
+    suma_planificado = db.Column(db.Float)
+    bien = db.Column(db.Integer, nullable=False)
+    regular = db.Column(db.Integer, nullable=False)
+    mal = db.Column(db.Integer, nullable=False)
+
+# Historial de cambios por campo de los indicadores (lo escribe historial.py)
+class IndicatorHistory(db.Model):
+    __tablename__ = 'indicator_history'
+    __table_args__ = (db.Index('idx_indicator_history_indicador_fecha', 'indicator_id', 'fecha_cambio'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    indicator_id = db.Column(db.Integer, db.ForeignKey('indicators.id'), nullable=False)
+    campo_modificado = db.Column(db.String(50), nullable=False)
+    valor_anterior = db.Column(db.Text)
+    valor_nuevo = db.Column(db.Text)
+    fecha_cambio = db.Column(db.DateTime, default=datetime.utcnow)
+    usuario = db.Column(db.String(50), nullable=False)
+
+# Cambios de estado de evaluación, en orden de id, para el flujo SSE (lo escribe eventos.py)
+class IndicatorEvent(db.Model):
+    __tablename__ = 'indicator_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    indicator_id = db.Column(db.Integer, nullable=False)
+    estado_anterior = db.Column(db.String(20))
+    estado_nuevo = db.Column(db.String(20))
+    valor_real = db.Column(db.Float)
+    perspective_id = db.Column(db.Integer)
+    estructura_id = db.Column(db.Integer)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, index=True)
\ No newline at end of file
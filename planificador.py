@@ -0,0 +1,178 @@
+"""Planificador de evaluaciones según la periodicidad de cada indicador.
+
+Un indicador vence cuando su ``fecha_ultima_evaluacion`` es anterior a
+ahora menos ``Periodicity.dias`` (o no se ha evaluado nunca). Cada ronda
+busca solo los vencidos, con un rango por periodicidad sobre el índice
+(periodicity_id, fecha_ultima_evaluacion), los reserva por lotes y los
+reparte entre un pool de hilos.
+
+La reserva vive en la propia fila (``evaluacion_reservada_hasta/por``): un
+UPDATE condicional solo se queda con filas libres o con la reserva caducada,
+así que varios planificadores pueden ejecutarse a la vez sin evaluar dos
+veces lo mismo, y las reservas de un proceso que muere caducan solas.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select, update
+
+from evaluacion_lote import reevaluar_ids
+from extensions import db
+from models import Indicator, Periodicity
+
+logger = logging.getLogger(__name__)
+
+
+def condicion_vencidos(ahora=None):
+    """Criterio de indicadores automáticos cuya evaluación ha vencido"""
+    ahora = ahora or datetime.utcnow()
+    rangos = [and_(Indicator.periodicity_id == periodicidad_id,
+                   or_(Indicator.fecha_ultima_evaluacion.is_(None),
+                       Indicator.fecha_ultima_evaluacion <= ahora - timedelta(days=dias)))
+              for periodicidad_id, dias in db.session.query(Periodicity.id, Periodicity.dias)]
+    return and_(Indicator.evaluacion_automatica.is_(True), or_(*rangos) if rangos else False)
+
+
+def _libre(ahora):
+    return or_(Indicator.evaluacion_reservada_hasta.is_(None), Indicator.evaluacion_reservada_hasta < ahora)
+
+
+def reservar(propietario, limite, duracion):
+    """Reserva hasta ``limite`` indicadores vencidos durante ``duracion`` segundos y hace commit
+
+    Devuelve los ids reservados por ``propietario``; los que otro proceso
+    reservó entre la lectura y el UPDATE quedan fuera.
+    """
+    ahora = datetime.utcnow()
+    hasta = ahora + timedelta(seconds=duracion)
+    candidatos = db.session.scalars(
+        select(Indicator.id)
+        .where(condicion_vencidos(ahora), _libre(ahora))
+        .order_by(Indicator.fecha_ultima_evaluacion.asc().nulls_first(), Indicator.id)
+        .limit(limite)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not candidatos:
+        db.session.commit()
+        return []
+    # updated_at se conserva: reservar no es modificar el indicador
+    db.session.execute(
+        update(Indicator)
+        .where(Indicator.id.in_(candidatos), _libre(ahora))
+        .values(evaluacion_reservada_hasta=hasta, evaluacion_reservada_por=propietario,
+                updated_at=Indicator.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.scalars(
+        select(Indicator.id).where(Indicator.id.in_(candidatos),
+                                   Indicator.evaluacion_reservada_por == propietario,
+                                   Indicator.evaluacion_reservada_hasta == hasta)
+    ).all()
+
+
+def liberar(ids, propietario):
+    """Quita las reservas de ``propietario`` sobre los indicadores. No hace commit."""
+    db.session.execute(
+        update(Indicator)
+        .where(Indicator.id.in_(list(ids)), Indicator.evaluacion_reservada_por == propietario)
+        .values(evaluacion_reservada_hasta=None, evaluacion_reservada_por=None,
+                updated_at=Indicator.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class Planificador:
+    """Bucle que reserva indicadores vencidos y los evalúa en un pool de hilos
+
+    ``max_pendientes`` limita los lotes reservados y aún sin terminar: si los
+    trabajadores no dan abasto, el bucle deja de reservar (contrapresión) en
+    lugar de acumular reservas que caducarían antes de evaluarse. El
+    intervalo entre rondas varía ±``jitter`` para que varios procesos no
+    consulten a la vez.
+    """
+
+    def __init__(self, app, trabajadores=4, tamano_lote=500, intervalo=60.0, jitter=0.1,
+                 duracion_reserva=300, max_pendientes=None, propietario=None):
+        self.app = app
+        self.trabajadores = trabajadores
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.jitter = jitter
+        self.duracion_reserva = duracion_reserva
+        self.max_pendientes = max_pendientes or trabajadores * 2
+        self.propietario = propietario or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._huecos = threading.BoundedSemaphore(self.max_pendientes)
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self.rondas = 0
+        self.lotes = 0
+        self.evaluados = 0
+        self.errores = 0
+
+    def _evaluar(self, ids):
+        with self.app.app_context():
+            try:
+                reevaluar_ids(ids)
+                liberar(ids, self.propietario)
+                db.session.commit()
+            except Exception:
+                # La reserva caduca sola y otro ciclo volverá a intentarlo
+                db.session.rollback()
+                logger.exception('Error evaluando un lote de %d indicadores', len(ids))
+                with self._lock:
+                    self.errores += len(ids)
+                return
+        with self._lock:
+            self.lotes += 1
+            self.evaluados += len(ids)
+
+    def _terminado(self, futuro):
+        self._huecos.release()
+
+    def ronda(self, pool):
+        """Reserva y despacha lotes hasta agotar los vencidos; devuelve cuántos indicadores despachó"""
+        despachados = 0
+        while not self._parar.is_set():
+            if not self._huecos.acquire(timeout=1):
+                continue
+            with self.app.app_context():
+                ids = reservar(self.propietario, self.tamano_lote, self.duracion_reserva)
+            if not ids:
+                self._huecos.release()
+                break
+            pool.submit(self._evaluar, ids).add_done_callback(self._terminado)
+            despachados += len(ids)
+        self.rondas += 1
+        return despachados
+
+    def ejecutar(self, una_vez=False):
+        """Ejecuta rondas hasta ``detener`` (o una sola) y espera a los lotes en curso"""
+        with ThreadPoolExecutor(max_workers=self.trabajadores, thread_name_prefix='planificador') as pool:
+            try:
+                if not una_vez:
+                    # Procesos arrancados a la vez no hacen la primera consulta juntos
+                    self._parar.wait(random.uniform(0, self.intervalo * self.jitter))
+                while not self._parar.is_set():
+                    despachados = self.ronda(pool)
+                    logger.info('Ronda %d: %d indicadores despachados', self.rondas, despachados)
+                    if una_vez:
+                        break
+                    self._parar.wait(self.intervalo * random.uniform(1 - self.jitter, 1 + self.jitter))
+            except KeyboardInterrupt:
+                self.detener()
+        return self.estadisticas()
+
+    def detener(self):
+        self._parar.set()
+
+    def estadisticas(self):
+        with self._lock:
+            return {'propietario': self.propietario, 'rondas': self.rondas, 'lotes': self.lotes,
+                    'evaluados': self.evaluados, 'errores': self.errores}
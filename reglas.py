@@ -0,0 +1,385 @@
+"""Motor de reglas para ``ComparisonType.formula_evaluacion``.
+
+Las fórmulas usan la misma sintaxis que ya guarda la tabla de tipos::
+
+    IF valor >= ref1 THEN "BIEN" ELSIF valor > ref2 THEN "REGULAR" ELSE "MAL" END
+
+Cada fórmula se analiza una sola vez y se compila a dos funciones de Python:
+una escalar, para ``Indicator.evaluar``, y otra vectorizada con NumPy, para
+clasificar lotes. Solo se generan expresiones a partir de los elementos
+permitidos por la gramática, nunca del texto original.
+
+Gramática (palabras clave sin distinguir mayúsculas)::
+
+    resultado  := "TEXTO" | IF condicion THEN resultado
+                  {ELSIF condicion THEN resultado} ELSE resultado END
+    condicion  := termino {OR termino};  termino := factor {AND factor}
+    factor     := NOT factor | "(" condicion ")" | variable IS [NOT] NULL
+                  | numero BETWEEN numero AND numero | numero op numero
+    numero     := valor | ref1..ref4 | literal, con + - * y paréntesis
+
+Una referencia ausente vale 0 en las comparaciones, como en la lógica
+original; ``IS NULL`` permite comprobar que exista. ``valor IS NULL`` es
+cierto cuando el indicador no tiene valor (el mismo criterio que
+``SIN_VALOR``).
+
+Las reglas compiladas se guardan por código de tipo. Los commits del proceso
+sobre ``comparison_types`` las descartan; los de otros procesos se detectan
+releyendo la fórmula guardada cada ``REGLAS_VERIFICACION`` segundos.
+"""
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+
+from cambios import suscribir
+from extensions import db
+from models import ComparisonType
+
+REFERENCIAS = ('ref1', 'ref2', 'ref3', 'ref4')
+VARIABLES = ('valor',) + REFERENCIAS
+VERIFICACION_POR_DEFECTO = 5  # Segundos entre lecturas de la fórmula guardada
+
+logger = logging.getLogger(__name__)
+
+_INCOMPLETAS = ' OR '.join(f'{r} IS NULL' for r in REFERENCIAS)
+
+# Fórmulas de los tipos de la carga inicial; se usan cuando la guardada en la
+# base de datos no es una fórmula válida (p. ej. 'Complex evaluation')
+FORMULAS_BASE = {
+    'TYPE1': 'IF valor >= ref1 THEN "BIEN" ELSIF valor > ref2 THEN "REGULAR" ELSE "MAL" END',
+    'TYPE2': 'IF valor <= ref1 THEN "BIEN" ELSIF valor < ref2 THEN "REGULAR" ELSE "MAL" END',
+    'TYPE3': (f'IF {_INCOMPLETAS} THEN "REFERENCIAS_INCOMPLETAS" '
+              'ELSIF valor BETWEEN ref2 AND ref1 THEN "BIEN" '
+              'ELSIF (ref1 < valor AND valor < ref3) OR (ref2 < valor AND valor < ref4) THEN "REGULAR" '
+              'ELSIF valor BETWEEN ref3 AND ref4 THEN "MAL" '
+              'ELSE "FUERA_DE_RANGO" END'),
+    'TYPE4': (f'IF {_INCOMPLETAS} THEN "REFERENCIAS_INCOMPLETAS" '
+              'ELSIF valor BETWEEN ref3 AND ref4 THEN "BIEN" '
+              'ELSIF (ref1 < valor AND valor < ref3) OR (ref2 < valor AND valor < ref4) THEN "REGULAR" '
+              'ELSIF valor BETWEEN ref2 AND ref1 THEN "MAL" '
+              'ELSE "FUERA_DE_RANGO" END'),
+}
+
+_PALABRAS = {'IF', 'THEN', 'ELSIF', 'ELSE', 'END', 'AND', 'OR', 'NOT', 'BETWEEN', 'IS', 'NULL'}
+_COMPARADORES = {'>=': '>=', '<=': '<=', '>': '>', '<': '<', '=': '==', '<>': '!=', '!=': '!='}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<numero>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<nombre>[A-Za-z_][A-Za-z_0-9]*)
+      | "(?P<texto>[^"]*)" | '(?P<texto2>[^']*)'
+      | (?P<simbolo>>=|<=|<>|!=|[<>=()+\-*])
+    )''', re.VERBOSE)
+
+
+def _tokens(formula):
+    posicion = 0
+    resultado = []
+    formula = formula.rstrip()
+    while posicion < len(formula):
+        m = _TOKEN.match(formula, posicion)
+        if m is None:
+            raise ValueError(f"Carácter inesperado en la posición {posicion}: {formula[posicion]!r}")
+        posicion = m.end()
+        if m.group('numero') is not None:
+            resultado.append(('numero', float(m.group('numero'))))
+        elif m.group('nombre') is not None:
+            nombre = m.group('nombre')
+            if nombre.upper() in _PALABRAS:
+                resultado.append(('palabra', nombre.upper()))
+            elif nombre.lower() in VARIABLES:
+                resultado.append(('variable', nombre.lower()))
+            else:
+                raise ValueError(f"Variable desconocida: {nombre}")
+        elif m.group('simbolo') is not None:
+            resultado.append(('simbolo', m.group('simbolo')))
+        else:
+            texto = m.group('texto') if m.group('texto') is not None else m.group('texto2')
+            resultado.append(('texto', texto))
+    return resultado
+
+
+class _Analizador:
+    """Descenso recursivo que produce un árbol de tuplas"""
+
+    def __init__(self, formula):
+        self.tokens = _tokens(formula)
+        self.i = 0
+
+    def _ver(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def _es(self, tipo, valor=None):
+        t, v = self._ver()
+        return t == tipo and (valor is None or v == valor)
+
+    def _tomar(self, tipo, valor=None):
+        if not self._es(tipo, valor):
+            encontrado = self._ver()[1]
+            raise ValueError(f"Se esperaba {valor or tipo} y se encontró {encontrado!r}")
+        token = self.tokens[self.i]
+        self.i += 1
+        return token[1]
+
+    def formula(self):
+        arbol = self.resultado()
+        if self.i != len(self.tokens):
+            raise ValueError(f"Texto sobrante después de la fórmula: {self._ver()[1]!r}")
+        return arbol
+
+    def resultado(self):
+        if self._es('texto'):
+            return ('texto', self._tomar('texto'))
+        self._tomar('palabra', 'IF')
+        ramas = [(self.condicion(), self._entonces())]
+        while self._es('palabra', 'ELSIF'):
+            self.i += 1
+            ramas.append((self.condicion(), self._entonces()))
+        self._tomar('palabra', 'ELSE')
+        defecto = self.resultado()
+        self._tomar('palabra', 'END')
+        return ('si', ramas, defecto)
+
+    def _entonces(self):
+        self._tomar('palabra', 'THEN')
+        return self.resultado()
+
+    def condicion(self):
+        partes = [self.termino()]
+        while self._es('palabra', 'OR'):
+            self.i += 1
+            partes.append(self.termino())
+        return partes[0] if len(partes) == 1 else ('o', partes)
+
+    def termino(self):
+        partes = [self.factor()]
+        while self._es('palabra', 'AND'):
+            self.i += 1
+            partes.append(self.factor())
+        return partes[0] if len(partes) == 1 else ('y', partes)
+
+    def factor(self):
+        if self._es('palabra', 'NOT'):
+            self.i += 1
+            return ('no', self.factor())
+        if self._es('simbolo', '('):
+            # Puede abrir una condición o una expresión numérica: se prueba primero la condición
+            inicio = self.i
+            self.i += 1
+            try:
+                condicion = self.condicion()
+                self._tomar('simbolo', ')')
+                if not (self._es('simbolo') and not self._es('simbolo', ')')) and \
+                        not self._es('palabra', 'BETWEEN'):
+                    return condicion
+            except ValueError:
+                pass
+            self.i = inicio
+        if self._es('variable') and self.tokens[self.i + 1:self.i + 2] == [('palabra', 'IS')]:
+            variable = self._tomar('variable')
+            self.i += 1
+            negado = self._es('palabra', 'NOT')
+            if negado:
+                self.i += 1
+            self._tomar('palabra', 'NULL')
+            nodo = ('nulo', variable)
+            return ('no', nodo) if negado else nodo
+
+        izquierda = self.expresion()
+        if self._es('palabra', 'BETWEEN'):
+            self.i += 1
+            desde = self.expresion()
+            self._tomar('palabra', 'AND')
+            return ('entre', izquierda, desde, self.expresion())
+        operador = self._tomar('simbolo')
+        if operador not in _COMPARADORES:
+            raise ValueError(f"Se esperaba un comparador y se encontró {operador!r}")
+        return ('comparar', _COMPARADORES[operador], izquierda, self.expresion())
+
+    def expresion(self):
+        nodo = self.producto()
+        while self._es('simbolo', '+') or self._es('simbolo', '-'):
+            operador = self._tomar('simbolo')
+            nodo = ('aritmetica', operador, nodo, self.producto())
+        return nodo
+
+    def producto(self):
+        nodo = self.unario()
+        while self._es('simbolo', '*'):
+            self.i += 1
+            nodo = ('aritmetica', '*', nodo, self.unario())
+        return nodo
+
+    def unario(self):
+        if self._es('simbolo', '-'):
+            self.i += 1
+            return ('negativo', self.unario())
+        if self._es('simbolo', '('):
+            self.i += 1
+            nodo = self.expresion()
+            self._tomar('simbolo', ')')
+            return nodo
+        if self._es('numero'):
+            return ('numero', self._tomar('numero'))
+        return ('variable', self._tomar('variable'))
+
+
+def analizar(formula):
+    """Devuelve el árbol de la fórmula o lanza ValueError si no es válida"""
+    if not formula or not formula.strip():
+        raise ValueError("Fórmula vacía")
+    return _Analizador(formula).formula()
+
+
+def _escalar(nodo):
+    """Código Python escalar; ``v`` es el valor y ``r`` el dict de referencias"""
+    tipo = nodo[0]
+    if tipo == 'texto':
+        return repr(nodo[1])
+    if tipo == 'si':
+        codigo = _escalar(nodo[2])
+        for condicion, resultado in reversed(nodo[1]):
+            codigo = f'({_escalar(resultado)} if {_escalar(condicion)} else {codigo})'
+        return codigo
+    if tipo == 'o':
+        return '(' + ' or '.join(_escalar(p) for p in nodo[1]) + ')'
+    if tipo == 'y':
+        return '(' + ' and '.join(_escalar(p) for p in nodo[1]) + ')'
+    if tipo == 'no':
+        return f'(not {_escalar(nodo[1])})'
+    if tipo == 'nulo':
+        if nodo[1] == 'valor':
+            return '(not v)'
+        return f'({nodo[1]!r} not in r)'
+    if tipo == 'entre':
+        return f'({_escalar(nodo[2])} <= {_escalar(nodo[1])} <= {_escalar(nodo[3])})'
+    if tipo == 'comparar':
+        return f'({_escalar(nodo[2])} {nodo[1]} {_escalar(nodo[3])})'
+    if tipo == 'aritmetica':
+        return f'({_escalar(nodo[2])} {nodo[1]} {_escalar(nodo[3])})'
+    if tipo == 'negativo':
+        return f'(-{_escalar(nodo[1])})'
+    if tipo == 'numero':
+        return repr(nodo[1])
+    if nodo[1] == 'valor':
+        return 'v'
+    return f'r.get({nodo[1]!r}, 0)'
+
+
+def _vectorial(nodo):
+    """Código NumPy; ``v`` son los valores, ``R``/``P`` las referencias y su presencia"""
+    tipo = nodo[0]
+    if tipo == 'texto':
+        return repr(nodo[1])
+    if tipo == 'si':
+        condiciones = ', '.join(f'({_vectorial(c)}) & u' for c, _ in nodo[1])
+        resultados = ', '.join(_vectorial(r) for _, r in nodo[1])
+        return f'np.select([{condiciones}], [{resultados}], {_vectorial(nodo[2])})'
+    if tipo == 'o':
+        return '(' + ' | '.join(_vectorial(p) for p in nodo[1]) + ')'
+    if tipo == 'y':
+        return '(' + ' & '.join(_vectorial(p) for p in nodo[1]) + ')'
+    if tipo == 'no':
+        return f'(~({_vectorial(nodo[1])} & u))'
+    if tipo == 'nulo':
+        # Las filas sin valor llegan con 0, igual que las marca ``sin_valor`` al construir las columnas
+        if nodo[1] == 'valor':
+            return '(v == 0)'
+        return f'(~P[:, {REFERENCIAS.index(nodo[1])}])'
+    if tipo == 'entre':
+        x = _vectorial(nodo[1])
+        return f'(({_vectorial(nodo[2])} <= {x}) & ({x} <= {_vectorial(nodo[3])}))'
+    if tipo in ('comparar', 'aritmetica'):
+        return f'({_vectorial(nodo[2])} {nodo[1]} {_vectorial(nodo[3])})'
+    if tipo == 'negativo':
+        return f'(-{_vectorial(nodo[1])})'
+    if tipo == 'numero':
+        return repr(nodo[1])
+    if nodo[1] == 'valor':
+        return 'v'
+    return f'R[:, {REFERENCIAS.index(nodo[1])}]'
+
+
+class Regla:
+    """Fórmula compilada: ``evaluar(valor, refs)`` y ``clasificar(v, R, P)``"""
+
+    def __init__(self, formula):
+        arbol = analizar(formula)
+        self.formula = formula
+        entorno = {'__builtins__': {}, 'np': np}
+        self.evaluar = eval(compile(f'lambda v, r: {_escalar(arbol)}', '<formula>', 'eval'), entorno)
+        vectorial = eval(compile(f'lambda v, R, P, u: {_vectorial(arbol)}', '<formula>', 'eval'), entorno)
+        self._vectorial = vectorial
+
+    def clasificar(self, valores, refs, presentes):
+        """Estados de un lote: ``valores`` (n,), ``refs`` y ``presentes`` (n, 4)"""
+        n = len(valores)
+        estados = np.empty(n, dtype=object)
+        estados[:] = self._vectorial(valores, refs, presentes, np.ones(n, dtype=bool))
+        return estados
+
+
+def compilar(formula, codigo=None):
+    """Compila una fórmula; si no es válida, usa la fórmula base del tipo o lanza ValueError"""
+    try:
+        return Regla(formula)
+    except ValueError as e:
+        if codigo in FORMULAS_BASE:
+            logger.warning('Fórmula de %s no válida (%s): se usa la fórmula base del tipo', codigo, e)
+            return Regla(FORMULAS_BASE[codigo])
+        raise
+
+
+class CacheReglas:
+    """Reglas compiladas por código de tipo, invalidadas al cambiar ``comparison_types``
+
+    Cada entrada es ``(formula, regla, verificar_en)``: pasado ``verificar_en``
+    se relee la fórmula del tipo y solo se recompila si cambió.
+    """
+
+    def __init__(self):
+        self._reglas = {}
+        self._lock = threading.Lock()
+        self._generacion = 0
+
+    def regla(self, codigo, formula=None):
+        """Devuelve la ``Regla`` del tipo o ``None`` si no existe o su fórmula no es válida
+
+        Si se pasa ``formula`` (la del objeto ya cargado) se compila esa; si
+        no, se lee de la base de datos.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._reglas.get(codigo)
+            generacion = self._generacion
+        if entrada is not None and (entrada[0] == formula if formula is not None else ahora < entrada[2]):
+            return entrada[1]
+
+        if formula is None:
+            formula = (db.session.query(ComparisonType.formula_evaluacion)
+                       .filter(ComparisonType.codigo == codigo).scalar())
+        if entrada is not None and entrada[0] == formula:
+            regla = entrada[1]
+        else:
+            try:
+                regla = compilar(formula or '', codigo)
+            except ValueError:
+                regla = None
+        verificar_en = ahora + current_app.config.get('REGLAS_VERIFICACION', VERIFICACION_POR_DEFECTO)
+        with self._lock:
+            if generacion == self._generacion:
+                self._reglas[codigo] = (formula, regla, verificar_en)
+        return regla
+
+    def invalidar(self, tabla=None):
+        with self._lock:
+            self._generacion += 1
+            self._reglas.clear()
+
+
+cache_reglas = CacheReglas()
+suscribir(ComparisonType.__tablename__, cache_reglas.invalidar)
@@ -0,0 +1,186 @@
+"""Simulación de cambios de referencias, valores y reglas sin guardar nada.
+
+Re-evalúa todo el catálogo en memoria con la clasificación vectorizada de
+``evaluacion_lote`` aplicando una propuesta:
+
+- ``indicadores``: lista ``[{codigo, valor_real?, referencias?}]`` con el
+  mismo formato que la actualización en bloque,
+- ``tipos``: ``{codigo_tipo: {formula?, desplazamiento?}}``,
+- ``perspectivas``: ``{id o codigo: desplazamiento}``.
+
+Un desplazamiento es un porcentaje sobre todas las referencias (``-10``) o
+un objeto por campo (``{"ref1": 5, "valor_real": -2}``). Los campos que
+fija un indicador prevalecen sobre los desplazamientos; las referencias no
+numéricas (filas que ya se evalúan con error) no se desplazan.
+El resultado compara el estado actual recalculado con el simulado: matriz
+de transiciones y lista de indicadores que cambian. Solo se lee de la base
+de datos.
+"""
+from numbers import Real
+
+import numpy as np
+from sqlalchemy import select
+
+from actualizacion import preparar
+from cuadro_mando import ESTADOS
+from evaluacion_lote import REFERENCIAS, Columnas, clasificar, construir_columnas
+from extensions import db
+from models import ComparisonType, Indicator, Perspective
+from reglas import Regla
+
+LIMITE_POR_DEFECTO = 1000
+MAX_LIMITE = 100000
+MAX_ELEMENTOS = 50000
+_CAMPOS_DESPLAZAMIENTO = (*REFERENCIAS, 'valor_real')
+
+
+def leer_desplazamiento(valor):
+    """Convierte un desplazamiento en {campo: factor}; lanza ValueError si no es válido"""
+    if not isinstance(valor, dict):
+        valor = {ref: valor for ref in REFERENCIAS}
+    factores = {}
+    for campo, porcentaje in valor.items():
+        if campo not in _CAMPOS_DESPLAZAMIENTO:
+            raise ValueError(f"Campos de desplazamiento admitidos: {', '.join(_CAMPOS_DESPLAZAMIENTO)}")
+        if isinstance(porcentaje, bool) or not isinstance(porcentaje, Real):
+            raise ValueError(f"El desplazamiento de '{campo}' debe ser un porcentaje numérico")
+        factores[campo] = 1 + porcentaje / 100
+    return factores
+
+
+def _cargar():
+    """Filas (id, codigo, valor_real, referencias, tipo, perspective_id) de todo el catálogo"""
+    return db.session.execute(
+        select(Indicator.id, Indicator.codigo, Indicator.valor_real, Indicator.referencias,
+               ComparisonType.codigo, Indicator.perspective_id)
+        .join(ComparisonType, Indicator.comparison_type_id == ComparisonType.id)
+        .order_by(Indicator.id)
+    ).all()
+
+
+def _perspectivas(claves):
+    """Resuelve claves de perspectiva (id o código) a ids"""
+    ids = dict(db.session.execute(select(Perspective.codigo, Perspective.id)).all())
+    resueltas = {}
+    for clave in claves:
+        if str(clave).isdigit() and int(clave) in ids.values():
+            resueltas[clave] = int(clave)
+        elif clave in ids:
+            resueltas[clave] = ids[clave]
+        else:
+            raise ValueError(f'Perspectiva desconocida: {clave}')
+    return resueltas
+
+
+def _desplazar(columnas, mascara, fijos, factores):
+    """Aplica los factores a las filas de ``mascara`` salvo a los campos fijados por indicador"""
+    for campo, factor in factores.items():
+        if campo == 'valor_real':
+            filas = mascara & ~fijos[:, 0]
+            columnas.valores[filas] *= factor
+            for i, (valor, referencias, codigo) in columnas.irregulares.items():
+                if filas[i]:
+                    columnas.irregulares[i] = (valor * factor, referencias, codigo)
+        else:
+            columnas.refs[mascara & ~fijos[:, 1], REFERENCIAS.index(campo)] *= factor
+
+
+def _matriz(antes, despues):
+    """{estado_antes: {estado_despues: n}} con las combinaciones que aparecen"""
+    etiquetas, inversa = np.unique(np.concatenate([antes, despues]).astype(str), return_inverse=True)
+    etiquetas = etiquetas.tolist()
+    k = len(etiquetas)
+    conteos = np.bincount(inversa[:len(antes)] * k + inversa[len(antes):], minlength=k * k).reshape(k, k)
+    orden = sorted(range(k), key=lambda i: (ESTADOS.index(etiquetas[i]) if etiquetas[i] in ESTADOS
+                                            else len(ESTADOS), etiquetas[i]))
+    return {etiquetas[a]: {etiquetas[b]: int(conteos[a, b]) for b in orden if conteos[a, b]}
+            for a in orden if conteos[a].any()}
+
+
+def simular(indicadores=(), tipos=None, perspectivas=None, limite=LIMITE_POR_DEFECTO):
+    """Evalúa la propuesta sobre todo el catálogo y devuelve transiciones y cambios
+
+    Lanza ValueError si la propuesta no es válida. No modifica la sesión.
+    """
+    tipos = tipos or {}
+    perspectivas = perspectivas or {}
+    if not isinstance(tipos, dict) or not isinstance(perspectivas, dict):
+        raise ValueError("'tipos' y 'perspectivas' deben ser objetos")
+    if not 0 <= limite <= MAX_LIMITE:
+        raise ValueError(f'El límite debe estar entre 0 y {MAX_LIMITE}')
+    if len(indicadores) > MAX_ELEMENTOS:
+        raise ValueError(f'Máximo {MAX_ELEMENTOS} indicadores por simulación')
+
+    filas = _cargar()
+    columnas = construir_columnas([(id_, valor, refs, tipo) for id_, _, valor, refs, tipo, _ in filas])
+    antes = clasificar(columnas)
+
+    # Copias: las columnas simuladas no comparten arreglos con las actuales
+    simulado = Columnas(columnas.ids, columnas.valores.copy(), columnas.sin_valor.copy(),
+                        columnas.refs.copy(), columnas.presentes.copy(), columnas.codigos,
+                        dict(columnas.irregulares))
+
+    # Campos fijados por indicador: los desplazamientos no los tocan
+    fijos = np.zeros((len(filas), 2), dtype=bool)
+    if indicadores:
+        posiciones = {codigo: i for i, (_, codigo, *_) in enumerate(filas)}
+        cambiadas = {}
+        for elemento in indicadores:
+            codigo, cambios = preparar(elemento)
+            if codigo not in posiciones:
+                raise ValueError(f'Indicador desconocido: {codigo}')
+            i = posiciones[codigo]
+            id_, _, valor, refs, tipo, _ = filas[i]
+            anterior = cambiadas.get(i, (id_, valor, refs, tipo))
+            valor = cambios.get('valor_real', anterior[1])
+            refs = cambios.get('referencias', anterior[2])
+            if 'referencias' in cambios:
+                try:
+                    Indicator.validar_referencias(tipo, refs)
+                except ValueError as e:
+                    raise ValueError(f'{codigo}: {e}') from None
+            cambiadas[i] = (id_, valor, refs, tipo)
+            fijos[i, 0] |= 'valor_real' in cambios
+            fijos[i, 1] |= 'referencias' in cambios
+        posiciones_cambiadas = np.fromiter(cambiadas, dtype=np.int64, count=len(cambiadas))
+        nuevas = construir_columnas(list(cambiadas.values()))
+        simulado.valores[posiciones_cambiadas] = nuevas.valores
+        simulado.sin_valor[posiciones_cambiadas] = nuevas.sin_valor
+        simulado.refs[posiciones_cambiadas] = nuevas.refs
+        simulado.presentes[posiciones_cambiadas] = nuevas.presentes
+        for i in cambiadas:
+            simulado.irregulares.pop(i, None)
+        for j, fila in nuevas.irregulares.items():
+            simulado.irregulares[int(posiciones_cambiadas[j])] = fila
+
+    reglas = {}
+    codigos_tipo = set(db.session.scalars(select(ComparisonType.codigo)))
+    for tipo, cambio in tipos.items():
+        if tipo not in codigos_tipo:
+            raise ValueError(f'Tipo de comparación desconocido: {tipo}')
+        if not isinstance(cambio, dict) or set(cambio) - {'formula', 'desplazamiento'}:
+            raise ValueError(f"El cambio del tipo {tipo} admite 'formula' y 'desplazamiento'")
+        if 'formula' in cambio:
+            try:
+                reglas[tipo] = Regla(cambio['formula'])
+            except ValueError as e:
+                raise ValueError(f'Fórmula no válida para {tipo}: {e}') from None
+        if 'desplazamiento' in cambio:
+            _desplazar(simulado, simulado.codigos == tipo, fijos, leer_desplazamiento(cambio['desplazamiento']))
+
+    if perspectivas:
+        perspective_ids = np.array([f[5] if f[5] is not None else -1 for f in filas], dtype=np.int64)
+        for clave, perspective_id in _perspectivas(perspectivas).items():
+            _desplazar(simulado, perspective_ids == perspective_id, fijos, leer_desplazamiento(perspectivas[clave]))
+
+    despues = clasificar(simulado, reglas)
+
+    distintos = np.flatnonzero(antes != despues)
+    return {
+        'indicadores': len(filas),
+        'cambiados': len(distintos),
+        'matriz': _matriz(antes, despues),
+        'cambios': [{'id': filas[i][0], 'codigo': filas[i][1], 'antes': antes[i], 'despues': despues[i]}
+                    for i in distintos[:limite].tolist()],
+        'truncado': len(distintos) > limite,
+    }
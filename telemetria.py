@@ -0,0 +1,311 @@
+"""Ingesta de telemetría de equipos físicos hacia sus indicadores.
+
+Cada lectura ``{"codigo_activo", "valor", "fecha"?}`` se traduce a los
+indicadores vinculados al equipo con un índice en memoria
+codigo_activo -> ids (``indicator_equipment``), que se recarga tras un TTL o
+cuando se confirma un cambio de equipos. Las lecturas no se escriben una a
+una: se acumulan en un ``Coalescedor`` que guarda solo el último valor de
+cada indicador y se vuelca cada ``ventana`` segundos con un UPDATE por
+bloque, la re-evaluación y un único commit. Si el volcado falla, lo tomado
+vuelve al coalescedor (sin pisar lecturas más recientes llegadas mientras
+tanto) y se reintenta en el siguiente, hasta ``MAX_INTENTOS`` veces.
+
+Hay dos entradas: ``POST /api/telemetria`` (JSON o NDJSON), que vuelca con un
+hilo en segundo plano, y ``flask kpi telemetry``, un servidor asyncio que
+recibe flujos NDJSON por TCP.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import case, select, update
+
+from agregacion import marcar_sucios
+from cambios import marcar_modificadas, suscribir
+from cubo import marcar_indicadores
+from evaluacion_lote import reevaluar_ids
+from extensions import db
+from historial import registrar_cambios
+from models import EquipoFisico, Indicator, indicator_equipment
+
+logger = logging.getLogger(__name__)
+
+TTL_INDICE = 60  # Segundos
+VENTANA = 0.5  # Segundos entre volcados
+MAX_INTENTOS = 20  # Volcados fallidos antes de descartar el valor de un indicador
+_TAMANO_BLOQUE = 900
+
+
+def _en_bloques(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), _TAMANO_BLOQUE):
+        yield ids[inicio:inicio + _TAMANO_BLOQUE]
+
+
+class IndiceEquipos:
+    """codigo_activo -> ids de indicadores vinculados, cargado de una vez y con TTL"""
+
+    def __init__(self, ttl=TTL_INDICE):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._indice = None
+        self._vence = 0.0
+
+    def _cargar(self):
+        indice = {}
+        consulta = (select(EquipoFisico.codigo_activo, indicator_equipment.c.indicator_id)
+                    .join(indicator_equipment, indicator_equipment.c.equipo_id == EquipoFisico.id))
+        for codigo, indicador_id in db.session.execute(consulta):
+            indice.setdefault(codigo, []).append(indicador_id)
+        return {codigo: tuple(ids) for codigo, ids in indice.items()}
+
+    def indicadores(self, codigo_activo):
+        """Ids de los indicadores del equipo; tupla vacía si no existe o no tiene vínculos"""
+        indice = self._indice
+        if indice is None or time.monotonic() >= self._vence:
+            with self._lock:
+                if self._indice is None or time.monotonic() >= self._vence:
+                    self._indice = self._cargar()
+                    self._vence = time.monotonic() + self.ttl
+                indice = self._indice
+        return indice.get(codigo_activo, ())
+
+    def invalidar(self, tabla=None):
+        with self._lock:
+            self._indice = None
+
+
+indice_equipos = IndiceEquipos()
+
+for _tabla in ('equipos_fisicos', 'indicator_equipment'):
+    suscribir(_tabla, indice_equipos.invalidar)
+
+
+class Coalescedor:
+    """Último valor pendiente de cada indicador
+
+    Las lecturas de un mismo indicador dentro de la ventana se reducen a una;
+    gana la de ``fecha`` más reciente (o la última recibida si no traen fecha).
+    """
+
+    def __init__(self, max_intentos=MAX_INTENTOS):
+        self.max_intentos = max_intentos
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._intentos = {}
+        self.recibidas = 0
+        self.escritas = 0
+        self.errores = 0
+
+    def agregar(self, indicador_id, valor, fecha):
+        with self._lock:
+            self.recibidas += 1
+            anterior = self._pendientes.get(indicador_id)
+            if anterior is None or anterior[1] is None or fecha is None or fecha >= anterior[1]:
+                self._pendientes[indicador_id] = (valor, fecha)
+
+    def tomar(self):
+        """Devuelve y vacía los valores pendientes"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            return pendientes
+
+    def devolver(self, pendientes):
+        """Reincorpora lo tomado por un volcado fallido y devuelve cuántos valores se descartan
+
+        Una lectura recibida después de ``tomar`` se conserva salvo que la
+        devuelta tenga una ``fecha`` posterior. El valor de un indicador que
+        ya falló ``max_intentos`` veces se descarta.
+        """
+        descartados = 0
+        with self._lock:
+            for indicador_id, (valor, fecha) in pendientes.items():
+                intentos = self._intentos.get(indicador_id, 0) + 1
+                if intentos >= self.max_intentos:
+                    self._intentos.pop(indicador_id, None)
+                    descartados += 1
+                    continue
+                self._intentos[indicador_id] = intentos
+                actual = self._pendientes.get(indicador_id)
+                if actual is None or (fecha is not None and actual[1] is not None and fecha > actual[1]):
+                    self._pendientes[indicador_id] = (valor, fecha)
+            self.errores += descartados
+        return descartados
+
+    def confirmar(self, pendientes):
+        """Olvida los intentos fallidos de los indicadores ya escritos"""
+        with self._lock:
+            for indicador_id in pendientes:
+                self._intentos.pop(indicador_id, None)
+
+    def __len__(self):
+        return len(self._pendientes)
+
+
+def leer_lectura(registro):
+    """Valida una lectura (dict o línea JSON) y devuelve ``(codigo_activo, valor, fecha)``
+
+    Lanza ValueError si la lectura no es válida.
+    """
+    if isinstance(registro, (str, bytes)):
+        try:
+            registro = json.loads(registro)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'JSON no válido: {e}')
+    if not isinstance(registro, dict) or not registro.get('codigo_activo'):
+        raise ValueError("Falta 'codigo_activo'")
+    try:
+        valor = float(registro['valor'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("'valor' debe ser numérico")
+    if not math.isfinite(valor):
+        raise ValueError("'valor' debe ser un número finito")
+    fecha = registro.get('fecha')
+    if fecha is not None:
+        fecha = datetime.fromisoformat(str(fecha).replace('Z', '+00:00'))
+        # Las fechas se comparan y guardan en UTC sin zona, como ``datetime.utcnow()``
+        if fecha.tzinfo is not None:
+            fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return str(registro['codigo_activo']), valor, fecha
+
+
+def registrar(lecturas, coalescedor, indice=indice_equipos):
+    """Añade las lecturas al coalescedor; devuelve cuántas se aceptaron, desconocidas o inválidas"""
+    resumen = {'aceptadas': 0, 'desconocidas': 0, 'invalidas': 0}
+    for registro in lecturas:
+        try:
+            codigo, valor, fecha = leer_lectura(registro)
+        except ValueError:
+            resumen['invalidas'] += 1
+            continue
+        ids = indice.indicadores(codigo)
+        if not ids:
+            resumen['desconocidas'] += 1
+            continue
+        for indicador_id in ids:
+            coalescedor.agregar(indicador_id, valor, fecha)
+        resumen['aceptadas'] += 1
+    return resumen
+
+
+def volcar(pendientes):
+    """Escribe ``valor_real`` de los indicadores pendientes y los re-evalúa en una transacción"""
+    if not pendientes:
+        return 0
+    valores = {id_: valor for id_, (valor, _) in pendientes.items()}
+    padres = set()
+    for bloque in _en_bloques(valores):
+        anteriores = db.session.execute(
+            select(Indicator.id, Indicator.parent_id, Indicator.valor_real).where(Indicator.id.in_(bloque))).all()
+        padres.update(padre for _, padre, _ in anteriores)
+        registrar_cambios(db.session, ((id_, 'valor_real', anterior, valores[id_]) for id_, _, anterior in anteriores))
+        db.session.execute(
+            update(Indicator)
+            .where(Indicator.id.in_(bloque))
+            .values(valor_real=case({id_: valores[id_] for id_ in bloque}, value=Indicator.id))
+            .execution_options(synchronize_session=False)
+        )
+    marcar_indicadores(db.session, valores)
+    marcar_sucios(db.session, padres)
+    marcar_modificadas(db.session, Indicator.__tablename__)
+    reevaluar_ids(valores)
+    db.session.commit()
+    return len(valores)
+
+
+def volcar_en_contexto(app, coalescedor):
+    """Vuelca lo pendiente dentro de un contexto de aplicación; si falla, lo devuelve al coalescedor"""
+    pendientes = coalescedor.tomar()
+    if not pendientes:
+        return 0
+    with app.app_context():
+        try:
+            escritas = volcar(pendientes)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Error volcando la telemetría de %d indicadores; se reintentará', len(pendientes))
+            descartados = coalescedor.devolver(pendientes)
+            if descartados:
+                logger.error('Telemetría descartada de %d indicadores tras %d intentos', descartados,
+                             coalescedor.max_intentos)
+            return 0
+    coalescedor.confirmar(pendientes)
+    coalescedor.escritas += escritas
+    return escritas
+
+
+class VolcadorTelemetria:
+    """Hilo que vuelca el coalescedor cada ``ventana`` segundos (entrada HTTP)"""
+
+    def __init__(self, coalescedor, ventana=VENTANA):
+        self.coalescedor = coalescedor
+        self.ventana = ventana
+        self._app = None
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def iniciar(self, app):
+        with self._lock:
+            self._app = app
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='volcador-telemetria', daemon=True)
+                self._hilo.start()
+
+    def _ejecutar(self):
+        while True:
+            time.sleep(self.ventana)
+            volcar_en_contexto(self._app, self.coalescedor)
+
+    def vaciar(self):
+        if self._app is not None:
+            volcar_en_contexto(self._app, self.coalescedor)
+
+
+coalescedor = Coalescedor()
+volcador = VolcadorTelemetria(coalescedor)
+atexit.register(volcador.vaciar)
+
+
+async def servir(app, host='0.0.0.0', puerto=9100, ventana=VENTANA):
+    """Servidor asyncio de lecturas NDJSON por TCP
+
+    Cada conexión envía una lectura por línea; al cerrar su lado de escritura
+    recibe una línea JSON con el resumen. Los volcados se ejecutan en un hilo
+    aparte, uno cada vez, mientras el bucle sigue aceptando lecturas.
+    """
+    propio = Coalescedor()
+    bucle = asyncio.get_running_loop()
+
+    async def atender(lector, escritor):
+        resumen = {'aceptadas': 0, 'desconocidas': 0, 'invalidas': 0}
+        with app.app_context():
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                if linea.strip():
+                    for clave, n in registrar((linea,), propio).items():
+                        resumen[clave] += n
+        escritor.write(json.dumps(resumen).encode() + b'\n')
+        await escritor.drain()
+        escritor.close()
+
+    async def volcar_periodicamente():
+        while True:
+            await asyncio.sleep(ventana)
+            await bucle.run_in_executor(None, volcar_en_contexto, app, propio)
+
+    servidor = await asyncio.start_server(atender, host, puerto)
+    tarea = asyncio.create_task(volcar_periodicamente())
+    logger.info('Telemetría escuchando en %s:%s', host, puerto)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        tarea.cancel()
+        await bucle.run_in_executor(None, volcar_en_contexto, app, propio)
@@ -0,0 +1,80 @@
+"""Fixtures comunes: aplicación sobre un SQLite temporal y catálogos mínimos."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+_ARCHIVO_BD = os.path.join(tempfile.mkdtemp(prefix='kpis-tests-'), 'kpis.db')
+# La configuración se lee al importar extensions
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_ARCHIVO_BD}')
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    return create_app({'SQLALCHEMY_DATABASE_URI': os.environ['DATABASE_URL'], 'TESTING': True,
+                       'WTF_CSRF_ENABLED': False, 'LISTADO_TOTAL_ESTIMADO': False})
+
+
+def _vaciar_caches():
+    """Avisa a todas las cachés del proceso como si cada tabla hubiera cambiado"""
+    import cambios
+
+    for tabla, funciones in list(cambios._suscriptores.items()):
+        for funcion in funciones:
+            funcion(tabla)
+
+
+@pytest.fixture
+def bd(app):
+    """Base de datos vacía con el esquema actual, dentro de un contexto de aplicación"""
+    import historial
+    from extensions import db
+
+    # Filas de historial que la prueba anterior dejó en cola: se escriben antes de borrar las tablas
+    historial.escritor.vaciar()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        _vaciar_caches()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def catalogos(bd):
+    """Catálogos mínimos: {'perspectiva', 'periodicidad', 'metodo', 'estructura', 'tipos': {codigo: id}}"""
+    from models import (AggregationMethod, ComparisonType, HierarchyLevel, OrganizationalStructure, Periodicity,
+                        Perspective)
+    from reglas import FORMULAS_BASE
+
+    perspectiva = Perspective(codigo='FIN', nombre='Financiera')
+    periodicidad = Periodicity(codigo='MENSUAL', nombre='Mensual', dias=30)
+    metodo = AggregationMethod(codigo='SUM', nombre='Suma')
+    nivel = HierarchyLevel(codigo='N1', nombre='Nivel 1', nivel=1)
+    tipos = [ComparisonType(codigo=codigo, nombre=codigo, descripcion=codigo, formula_evaluacion=formula)
+             for codigo, formula in FORMULAS_BASE.items()]
+    bd.session.add_all([perspectiva, periodicidad, metodo, nivel, *tipos])
+    bd.session.flush()
+    estructura = OrganizationalStructure(codigo='E0', nombre='Estructura 0', level_id=nivel.id)
+    bd.session.add(estructura)
+    bd.session.commit()
+    return {'perspectiva': perspectiva.id, 'periodicidad': periodicidad.id, 'metodo': metodo.id,
+            'estructura': estructura.id, 'tipos': {t.codigo: t.id for t in tipos}}
+
+
+@pytest.fixture
+def nuevo_indicador(catalogos):
+    """Fábrica de valores de columna para un indicador válido (para ``insert``)"""
+    def crear(codigo, tipo='TYPE1', **columnas):
+        return dict({'codigo': codigo, 'nombre': f'Indicador {codigo}', 'unidad_medida': '%',
+                     'perspective_id': catalogos['perspectiva'], 'periodicity_id': catalogos['periodicidad'],
+                     'aggregation_method_id': catalogos['metodo'], 'comparison_type_id': catalogos['tipos'][tipo],
+                     'estructura_jerarquica_id': catalogos['estructura'], 'evaluacion_automatica': True},
+                    **columnas)
+    return crear
@@ -0,0 +1,19 @@
+"""Validación de los elementos de la actualización en bloque."""
+import pytest
+
+from actualizacion import preparar
+
+
+@pytest.mark.parametrize('elemento', [
+    {'codigo': 'K1', 'valor_real': 'nan'},
+    {'codigo': 'K1', 'valor_planificado': float('inf')},
+    {'codigo': 'K1', 'referencias': {'ref1': '-inf'}},
+])
+def test_valores_no_finitos_se_rechazan(elemento):
+    with pytest.raises(ValueError, match='finito'):
+        preparar(elemento)
+
+
+def test_numeros_en_texto_se_aceptan():
+    assert preparar({'codigo': ' K1 ', 'valor_real': '12.5', 'referencias': {'ref1': 10}}) == \
+        ('K1', {'valor_real': 12.5, 'referencias': {'ref1': 10.0}})
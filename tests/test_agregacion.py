@@ -0,0 +1,85 @@
+"""Agregación jerárquica al borrar o mover hijos, también desde la importación."""
+from extensions import db
+from importacion import importar
+from models import Indicator
+
+
+def _crear(nuevo_indicador, codigo, valor=None, padre=None):
+    indicador = Indicator(**nuevo_indicador(codigo, valor_real=valor, referencias={'ref1': 50, 'ref2': 20}))
+    indicador.parent_id = padre.id if padre is not None else None
+    db.session.add(indicador)
+    db.session.commit()
+    return indicador
+
+
+def _valor(indicador):
+    db.session.expire_all()
+    return db.session.get(Indicator, indicador.id).valor_real
+
+
+def test_borrar_hijos_recalcula_y_vacia_el_padre(bd, nuevo_indicador):
+    padre = _crear(nuevo_indicador, 'P')
+    a = _crear(nuevo_indicador, 'A', 10, padre)
+    b = _crear(nuevo_indicador, 'B', 5, padre)
+    assert _valor(padre) == 15
+
+    db.session.delete(a)
+    db.session.commit()
+    assert _valor(padre) == 5
+
+    db.session.delete(db.session.get(Indicator, b.id))
+    db.session.commit()
+    assert _valor(padre) is None
+
+
+def test_mover_el_ultimo_hijo_vacia_el_padre_anterior(bd, nuevo_indicador):
+    p, q = _crear(nuevo_indicador, 'P'), _crear(nuevo_indicador, 'Q')
+    hijo = _crear(nuevo_indicador, 'H', 7, p)
+    assert _valor(p) == 7
+
+    hijo = db.session.get(Indicator, hijo.id)
+    hijo.parent_id = q.id
+    db.session.commit()
+    assert _valor(p) is None
+    assert _valor(q) == 7
+
+
+def test_hoja_sin_hijos_conserva_su_valor(bd, nuevo_indicador):
+    hoja = _crear(nuevo_indicador, 'L', 3)
+    hoja = db.session.get(Indicator, hoja.id)
+    hoja.valor_planificado = 9
+    db.session.commit()
+    assert _valor(hoja) == 3
+
+
+def _registro(codigo, padre='', valor=''):
+    return {'codigo': codigo, 'nombre': codigo, 'unidad_medida': '%', 'perspectiva': 'FIN',
+            'tipo_comparacion': 'TYPE1', 'periodicidad': 'MENSUAL', 'metodo_agregacion': 'SUM',
+            'padre': padre, 'valor_real': valor, 'ref1': '50', 'ref2': '20'}
+
+
+def test_importar_cambio_de_padre_recalcula_el_anterior(bd, nuevo_indicador):
+    p, q = _crear(nuevo_indicador, 'P'), _crear(nuevo_indicador, 'Q')
+    _crear(nuevo_indicador, 'H', 4, p)
+    assert _valor(p) == 4
+
+    resumen = importar(enumerate([_registro('H', 'Q', '4')]))
+    assert resumen['errores'] == 0
+    assert _valor(p) is None
+    assert _valor(q) == 4
+
+
+def test_importar_rechaza_ciclos(bd, nuevo_indicador):
+    a = _crear(nuevo_indicador, 'A')
+    _crear(nuevo_indicador, 'X', 1, a)
+    errores = []
+    resumen = importar(enumerate([_registro('B', 'C'), _registro('C', 'B'),  # Ciclo dentro del archivo
+                                  _registro('A', 'X'),  # Ciclo con un descendiente ya guardado
+                                  _registro('D', 'A', '2')]), al_error=errores.append)
+
+    assert sorted(e['codigo'] for e in errores) == ['A', 'B', 'C']
+    assert all('ciclo' in e['error'] for e in errores)
+    assert resumen['insertados'] == 1
+    db.session.expire_all()
+    assert db.session.get(Indicator, a.id).parent_id is None
+    assert _valor(a) == 3
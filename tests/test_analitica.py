@@ -0,0 +1,95 @@
+"""Series de la analítica y su caché frente a cambios hechos en otros procesos."""
+from datetime import date
+
+import pytest
+from sqlalchemy import insert, select, update
+
+import analitica
+from models import Indicator, IndicatorMeasurement
+
+
+@pytest.fixture
+def indicador(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', valor_planificado=100.0,
+                                                           referencias={'ref1': 50, 'ref2': 20})])
+    id_ = bd.session.scalar(select(Indicator.id))
+    bd.session.execute(insert(IndicatorMeasurement), [
+        {'indicator_id': id_, 'periodo_inicio': date(2025, 1, 1), 'valor': 10.0},
+        {'indicator_id': id_, 'periodo_inicio': date(2025, 1, 31), 'valor': 20.0}])
+    bd.session.commit()
+    return id_
+
+
+def test_serie_de_un_indicador_y_de_su_subarbol(bd, indicador, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K2', parent_id=indicador)])
+    hijo = bd.session.scalar(select(Indicator.id).where(Indicator.codigo == 'K2'))
+    bd.session.execute(insert(IndicatorMeasurement), [
+        {'indicator_id': indicador, 'periodo_inicio': date(2025, 3, 2), 'valor': 60.0},
+        {'indicator_id': hijo, 'periodo_inicio': date(2025, 1, 1), 'valor': 5.0}])
+    bd.session.commit()
+
+    resultado = analitica.analizar(indicador, ventana=2)
+    serie = resultado['indicadores'][0]['serie']
+    assert serie['media_movil'] == [10.0, 15.0, 40.0]
+    assert serie['variacion'] == [None, 10.0, 40.0]
+    assert serie['cumplimiento'] == [0.1, 0.2, 0.6]
+    assert serie['estado'] == ['MAL', 'MAL', 'BIEN']
+    assert resultado['indicadores'][0]['racha'] == {'estado': 'BIEN', 'periodos': 1, 'dias': 30}
+    assert resultado['tiempo_en_estado']['MAL'] == 60
+
+    subarbol = analitica.analizar(indicador, ventana=2, subarbol=True)
+    assert [i['codigo'] for i in subarbol['indicadores']] == ['K1', 'K2'] and subarbol['puntos'] == 4
+
+
+def _otro_proceso(bd, sentencia):
+    """Ejecuta la sentencia en una conexión propia, sin sesión: la caché no recibe aviso"""
+    with bd.engine.begin() as conexion:
+        conexion.execute(sentencia)
+
+
+def _configurar(app, monkeypatch, verificacion, ttl=300):
+    monkeypatch.setitem(app.config, 'ANALITICA_VERIFICACION', verificacion)
+    monkeypatch.setitem(app.config, 'ANALITICA_TTL', ttl)
+
+
+def test_medicion_de_otro_proceso_se_ve_al_revalidar(app, bd, indicador, monkeypatch):
+    _configurar(app, monkeypatch, verificacion=0)
+    assert analitica.analizar(indicador)['puntos'] == 2
+
+    _otro_proceso(bd, insert(IndicatorMeasurement).values(indicator_id=indicador, periodo_inicio=date(2025, 3, 2),
+                                                          valor=30.0))
+    assert analitica.analizar(indicador)['puntos'] == 3
+
+
+def test_dentro_del_intervalo_no_se_revalida(app, bd, indicador, monkeypatch):
+    _configurar(app, monkeypatch, verificacion=300)
+    analitica.analizar(indicador)
+    monkeypatch.setattr(analitica, 'huella', lambda *args: pytest.fail('no debía revalidar'))
+
+    assert analitica.analizar(indicador)['puntos'] == 2
+
+
+def test_plan_cambiado_en_otro_proceso_recalcula(app, bd, indicador, monkeypatch):
+    _configurar(app, monkeypatch, verificacion=0)
+    assert analitica.analizar(indicador)['indicadores'][0]['valor_planificado'] == 100.0
+
+    _otro_proceso(bd, update(Indicator).where(Indicator.id == indicador).values(valor_planificado=80.0))
+    assert analitica.analizar(indicador)['indicadores'][0]['valor_planificado'] == 80.0
+
+
+def test_sin_cambios_la_revalidacion_no_recalcula(app, bd, indicador, monkeypatch):
+    _configurar(app, monkeypatch, verificacion=0)
+    analitica.analizar(indicador)
+    fallos = analitica.cache_analitica.fallos
+
+    analitica.analizar(indicador)
+    assert analitica.cache_analitica.fallos == fallos
+
+
+def test_resultado_caduca_con_el_ttl(app, bd, indicador, monkeypatch):
+    _configurar(app, monkeypatch, verificacion=300, ttl=0)
+    analitica.analizar(indicador)
+    fallos = analitica.cache_analitica.fallos
+
+    analitica.analizar(indicador)
+    assert analitica.cache_analitica.fallos == fallos + 1
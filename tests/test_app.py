@@ -0,0 +1,16 @@
+"""Configuración obligatoria al crear la aplicación."""
+import pytest
+
+from app import create_app
+from extensions import BD_DESARROLLO
+
+
+def test_sin_database_url_no_arranca():
+    with pytest.raises(RuntimeError, match='DATABASE_URL'):
+        create_app({'SQLALCHEMY_DATABASE_URI': None, 'DESARROLLO': False})
+
+
+@pytest.mark.parametrize('config', [{'DESARROLLO': True}, {'DEBUG': True}])
+def test_en_desarrollo_usa_sqlite_local(config):
+    app = create_app(dict(config, SQLALCHEMY_DATABASE_URI=None))
+    assert app.config['SQLALCHEMY_DATABASE_URI'] == BD_DESARROLLO
@@ -0,0 +1,33 @@
+"""Caché de catálogos: aciertos, invalidación al confirmar y TTL."""
+from catalogos import cache_catalogos, opciones
+from models import Perspective
+
+
+def test_commit_en_el_catalogo_invalida_la_cache(bd, catalogos):
+    assert opciones('perspectives') == [(catalogos['perspectiva'], 'Financiera')]
+    aciertos = cache_catalogos.aciertos
+    assert opciones('perspectives') == [(catalogos['perspectiva'], 'Financiera')]
+    assert cache_catalogos.aciertos == aciertos + 1
+
+    bd.session.add(Perspective(codigo='CLI', nombre='Clientes'))
+    bd.session.commit()
+    assert [nombre for _, nombre in opciones('perspectives')] == ['Clientes', 'Financiera']
+
+
+def test_rollback_no_invalida(bd, catalogos):
+    opciones('perspectives')
+    bd.session.add(Perspective(codigo='CLI', nombre='Clientes'))
+    bd.session.flush()
+    bd.session.rollback()
+
+    aciertos = cache_catalogos.aciertos
+    assert [nombre for _, nombre in opciones('perspectives')] == ['Financiera']
+    assert cache_catalogos.aciertos == aciertos + 1
+
+
+def test_entrada_caducada_se_vuelve_a_leer(app, bd, catalogos, monkeypatch):
+    monkeypatch.setitem(app.config, 'CATALOG_CACHE_TTL', 0)
+    opciones('periodicities')
+    fallos = cache_catalogos.fallos
+    opciones('periodicities')
+    assert cache_catalogos.fallos == fallos + 1
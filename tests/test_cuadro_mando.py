@@ -0,0 +1,79 @@
+"""Caché del resumen del cuadro de mando frente a cambios hechos en otros procesos."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, update
+
+import cuadro_mando
+from models import Indicator, IndicatorEvent
+
+
+@pytest.fixture
+def verificar_siempre(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RESUMEN_VERIFICACION', 0)
+    monkeypatch.setitem(app.config, 'RESUMEN_TTL', 300)
+
+
+def _otro_proceso(bd, *sentencias):
+    """Ejecuta las sentencias en una conexión propia, sin sesión: ninguna caché del proceso se entera"""
+    with bd.engine.begin() as conexion:
+        for sentencia in sentencias:
+            conexion.execute(sentencia)
+
+
+def _bien(datos):
+    return datos['totales']['BIEN']
+
+
+def test_transicion_en_otro_proceso_cambia_etag_y_resumen(bd, nuevo_indicador, verificar_siempre):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1'), nuevo_indicador('K2')])
+    bd.session.commit()
+    datos, etag, _ = cuadro_mando.resumen()
+    assert _bien(datos) == 0
+    assert cuadro_mando.cache_resumen.etag()[0] == etag
+
+    # Lo que hace ``guardar_estados`` en otro worker: estado nuevo y su evento en la misma transacción
+    _otro_proceso(bd, update(Indicator).where(Indicator.codigo == 'K1').values(ultima_evaluacion='BIEN'),
+                  insert(IndicatorEvent).values(indicator_id=1, estado_anterior=None, estado_nuevo='BIEN',
+                                                fecha=datetime.utcnow()))
+
+    assert cuadro_mando.cache_resumen.etag()[0] != etag
+    datos, nuevo_etag, _ = cuadro_mando.resumen()
+    assert _bien(datos) == 1
+    assert nuevo_etag != etag
+
+
+def test_alta_en_otro_proceso_cambia_el_total(bd, nuevo_indicador, verificar_siempre):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1')])
+    bd.session.commit()
+    assert cuadro_mando.resumen()[0]['total'] == 1
+
+    _otro_proceso(bd, insert(Indicator).values(nuevo_indicador('K2')))
+
+    assert cuadro_mando.resumen()[0]['total'] == 2
+
+
+def test_sin_cambios_la_huella_no_recalcula(bd, nuevo_indicador, verificar_siempre):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1')])
+    bd.session.commit()
+    _, etag, _ = cuadro_mando.resumen()
+    fallos = cuadro_mando.cache_resumen.fallos
+
+    assert cuadro_mando.resumen()[1] == etag
+    assert cuadro_mando.cache_resumen.fallos == fallos
+
+
+def test_lo_que_la_huella_no_ve_caduca_con_el_ttl(app, bd, nuevo_indicador, monkeypatch):
+    monkeypatch.setitem(app.config, 'RESUMEN_VERIFICACION', 300)
+    monkeypatch.setitem(app.config, 'RESUMEN_TTL', 300)
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', ultima_evaluacion='BIEN')])
+    bd.session.commit()
+    cuadro_mando.cache_resumen.sincronizar()
+    assert _bien(cuadro_mando.resumen()[0]) == 1
+
+    # Sin evento ni alta: la huella no cambia, así que solo el TTL lo hace visible
+    _otro_proceso(bd, update(Indicator).values(ultima_evaluacion='MAL'))
+    assert _bien(cuadro_mando.resumen()[0]) == 1
+
+    monkeypatch.setattr(cuadro_mando.cache_resumen, '_vence', 0.0)
+    assert _bien(cuadro_mando.resumen()[0]) == 0
@@ -0,0 +1,101 @@
+"""El cubo mantenido con incrementos coincide con el cubo reconstruido desde cero."""
+import random
+
+import pytest
+from sqlalchemy import insert, select, update
+
+import cubo
+from evaluacion_lote import reevaluar
+from extensions import db
+from models import Indicator, IndicatorCube
+
+
+def _celdas():
+    db.session.expire_all()
+    return {f.clave: (f.indicadores, f.con_valor, f.suma_real, f.con_planificado, f.suma_planificado,
+                      f.bien, f.regular, f.mal)
+            for f in db.session.scalars(select(IndicatorCube))}
+
+
+def _comparar(obtenido, esperado):
+    assert obtenido.keys() == esperado.keys()
+    for clave, fila in esperado.items():
+        assert obtenido[clave] == pytest.approx(fila), clave
+
+
+def _lugar(azar):
+    return {'provincia': azar.choice(['La Habana', 'Matanzas', None]), 'municipio': azar.choice(['Centro', None])}
+
+
+def test_incrementos_equivalen_a_reconstruir(bd, nuevo_indicador):
+    azar = random.Random(7)
+    bd.session.execute(insert(Indicator), [
+        nuevo_indicador(f'K{i:03d}', valor_real=azar.choice([None, azar.uniform(0, 100)]),
+                        valor_planificado=azar.choice([None, 80.0]), referencias={'ref1': 60, 'ref2': 30},
+                        tiempo_dimension={'año': azar.choice([2024, 2025]), 'trimestre': azar.randint(1, 4)},
+                        ubicacion_geografica=_lugar(azar), centro_costo=azar.choice(['CC1', 'CC2']))
+        for i in range(120)])
+    cubo.marcar_indicadores(bd.session, bd.session.scalars(select(Indicator.id)).all())
+    bd.session.commit()
+    reevaluar()
+
+    indicadores = bd.session.scalars(select(Indicator).order_by(Indicator.id)).all()
+    for indicador in azar.sample(indicadores, 40):  # Cambios por el ORM: celdas y medidas
+        indicador.valor_real = azar.choice([None, azar.uniform(0, 100)])
+        indicador.ubicacion_geografica = _lugar(azar)
+        if azar.random() < 0.3:
+            indicador.valor_planificado = None
+    for indicador in azar.sample(indicadores, 10):
+        bd.session.delete(indicador)
+    bd.session.commit()
+
+    # Cambios en bloque (Core) registrados con marcar_indicadores
+    ids = bd.session.scalars(select(Indicator.id).order_by(Indicator.id)).all()[:30]
+    bd.session.execute(update(Indicator).where(Indicator.id.in_(ids)).values(centro_costo='CC9'))
+    cubo.marcar_indicadores(bd.session, ids)
+    bd.session.commit()
+    reevaluar()
+
+    incremental = _celdas()
+    assert incremental and all(f[0] > 0 for f in incremental.values())
+    cubo.reconstruir()
+    bd.session.commit()
+    _comparar(incremental, _celdas())
+
+    totales = cubo.consultar(['provincia'])
+    assert sum(f['indicadores'] for f in totales) == 110
+
+
+def test_celda_vacia_desaparece_y_suma_vuelve_a_null(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('A', valor_real=5.0, referencias={'ref1': 1, 'ref2': 0},
+                                                           centro_costo='X')])
+    cubo.marcar_indicadores(bd.session, bd.session.scalars(select(Indicator.id)).all())
+    bd.session.commit()
+    (fila,) = cubo.consultar(['centro_costo'])
+    assert (fila['indicadores'], fila['suma_real']) == (1, 5.0)
+
+    indicador = bd.session.scalar(select(Indicator))
+    indicador.valor_real = None
+    bd.session.commit()
+    (fila,) = cubo.consultar(['centro_costo'])
+    assert (fila['con_valor'], fila['suma_real'], fila['cumplimiento']) == (0, None, None)
+
+    indicador.centro_costo = 'Y'
+    bd.session.commit()
+    assert [f['centro_costo'] for f in cubo.consultar(['centro_costo'])] == ['Y']
+    assert len(_celdas()) == 1
+
+
+def test_reconstruir_con_una_conexion(bd, nuevo_indicador):
+    # Sin marcar_indicadores: filas previas a la migración que crea el cubo
+    bd.session.execute(insert(Indicator), [
+        nuevo_indicador(f'K{i}', valor_real=float(i), centro_costo=centro)
+        for i, centro in enumerate(['CC1', 'CC1', 'CC2'])])
+    bd.session.commit()
+    assert _celdas() == {}
+
+    with bd.engine.begin() as conexion:
+        assert cubo.reconstruir(tamano_bloque=2, conexion=conexion) == 2
+
+    totales = {f['centro_costo']: (f['indicadores'], f['suma_real']) for f in cubo.consultar(['centro_costo'])}
+    assert totales == {'CC1': (2, 1.0), 'CC2': (1, 2.0)}
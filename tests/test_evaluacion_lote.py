@@ -0,0 +1,71 @@
+"""Equivalencia de la evaluación vectorizada con ``Indicator.actualizar_evaluacion``."""
+import random
+
+import pytest
+from sqlalchemy import insert, select
+
+from evaluacion_lote import cargar_columnas, evaluar_lote, reevaluar
+from models import ComparisonType, Indicator
+
+_NO_NUMERICAS = ['abc', '5', None, [1], {'a': 1}, 2 ** 60, -(2 ** 60)]
+
+
+def _valor(azar):
+    return azar.choice([None, 0, 0.0, -1.5, 2 ** 60, azar.randint(-5, 105), azar.uniform(-10, 110),
+                        azar.choice([10, 20, 30, 40])])
+
+
+def _referencias(azar):
+    """Referencias completas, incompletas, no numéricas o que no son un dict"""
+    forma = azar.random()
+    if forma < 0.05:
+        return None
+    if forma < 0.1:
+        return azar.choice([[10, 20], 'ref1', 7])
+    refs = {}
+    for clave in ('ref1', 'ref2', 'ref3', 'ref4'):
+        if azar.random() < 0.15:
+            continue  # Falta la referencia
+        if azar.random() < 0.08:
+            refs[clave] = azar.choice(_NO_NUMERICAS)
+        else:
+            refs[clave] = azar.choice([10, 20, 30, 40, azar.uniform(0, 100), True])
+    return refs
+
+
+@pytest.mark.parametrize('semilla', [1, 2, 3])
+def test_clasificar_coincide_con_actualizar_evaluacion(bd, catalogos, nuevo_indicador, semilla):
+    azar = random.Random(semilla)
+    # Un tipo sin fórmula válida ni fórmula base: TIPO_NO_VALIDO en ambos caminos
+    bd.session.add(ComparisonType(codigo='TYPEX', nombre='X', descripcion='X', formula_evaluacion='no es fórmula'))
+    bd.session.commit()
+    tipos = list(catalogos['tipos']) + ['TYPEX']
+    tipo_x = bd.session.scalar(select(ComparisonType.id).filter_by(codigo='TYPEX'))
+
+    filas = []
+    for i in range(400):
+        tipo = azar.choice(tipos)
+        fila = nuevo_indicador(f'K{i:04d}', tipo if tipo != 'TYPEX' else 'TYPE1',
+                               valor_real=_valor(azar), referencias=_referencias(azar))
+        if tipo == 'TYPEX':
+            fila['comparison_type_id'] = tipo_x
+        filas.append(fila)
+    bd.session.execute(insert(Indicator), filas)
+    bd.session.commit()
+
+    # Algunas filas deben ir por el camino fila a fila
+    assert cargar_columnas().irregulares
+
+    esperado = {}
+    for indicador in Indicator.query.order_by(Indicator.id):
+        indicador.actualizar_evaluacion()
+        esperado[indicador.id] = indicador.ultima_evaluacion
+
+    assert evaluar_lote() == esperado
+
+    # Y lo que guarda la re-evaluación en bloque es lo mismo
+    bd.session.execute(Indicator.__table__.update().values(ultima_evaluacion=None))
+    bd.session.commit()
+    reevaluar(tamano_lote=97)
+    bd.session.expire_all()
+    assert dict(bd.session.execute(select(Indicator.id, Indicator.ultima_evaluacion)).all()) == esperado
@@ -0,0 +1,82 @@
+"""Lectura de eventos cuando las transacciones confirman en distinto orden que sus ids."""
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+import eventos
+from eventos import Cursor, SIN_FILTRO, inicio
+from models import IndicatorEvent
+
+
+def _confirmar(bd, id_, perspectiva=None, fecha=None):
+    """Confirma en su propia sesión el evento con el id que le dio la secuencia al insertar"""
+    with Session(bd.engine) as sesion:
+        sesion.add(IndicatorEvent(id=id_, indicator_id=id_, estado_anterior=None, estado_nuevo='BIEN',
+                                  perspective_id=perspectiva, fecha=fecha or datetime.utcnow()))
+        sesion.commit()
+
+
+def _ids(lista):
+    return [e['id'] for e in lista]
+
+
+def test_commit_fuera_de_orden_no_pierde_eventos(bd):
+    _confirmar(bd, 1)
+    _confirmar(bd, 2)
+    cursor = Cursor(0)
+    assert _ids(cursor.leer()) == [1, 2]
+
+    # A obtuvo el id 3 y B el 4, pero B confirma primero. SQLite serializa las escrituras, así que el
+    # orden de la secuencia de PostgreSQL se reproduce con ids explícitos.
+    _confirmar(bd, 4)
+    assert cursor.leer() == []
+    assert cursor.ultimo == 2
+
+    _confirmar(bd, 3)
+    assert _ids(cursor.leer()) == [3, 4]
+    assert cursor.leer() == []
+
+
+def test_repeticion_con_last_event_id_se_detiene_en_el_hueco(bd):
+    for id_ in (1, 2, 4):
+        _confirmar(bd, id_)
+
+    mensajes, cursor = inicio(SIN_FILTRO, 1)
+    assert [m.split('\n')[0] for m in mensajes[1:]] == ['id: 2']
+    assert cursor.ultimo == 2
+
+    _confirmar(bd, 3)
+    assert _ids(cursor.leer()) == [3, 4]
+
+
+def test_suscriptor_nuevo_no_salta_un_evento_que_confirma_tarde(bd):
+    _confirmar(bd, 1, fecha=datetime.utcnow() - timedelta(minutes=5))
+    _confirmar(bd, 2)
+    _confirmar(bd, 4)  # El 3 sigue en una transacción abierta
+
+    mensajes, cursor = inicio(SIN_FILTRO, None)
+    assert mensajes == [f'retry: {eventos.REINTENTO_MS}\n\n']
+    assert cursor.ultimo == 1
+    assert _ids(cursor.leer()) == [2]
+
+    _confirmar(bd, 3)
+    assert _ids(cursor.leer()) == [3, 4]
+
+
+def test_hueco_que_no_se_llena_se_salta_tras_el_horizonte(bd):
+    for id_ in (1, 2, 5):
+        _confirmar(bd, id_)
+
+    cursor = Cursor(2, horizonte=0)
+    assert _ids(cursor.leer()) == [5]
+
+
+def test_eventos_que_no_cumplen_el_filtro_no_cuentan_como_hueco(bd):
+    _confirmar(bd, 1, perspectiva=1)
+    _confirmar(bd, 2, perspectiva=2)
+    _confirmar(bd, 3, perspectiva=1)
+    filtro = eventos.Filtro(1, None, None)
+
+    mensajes, cursor = inicio(filtro, 0)
+    assert len(mensajes) == 3  # retry y los eventos 1 y 3
+    assert cursor.ultimo == 3
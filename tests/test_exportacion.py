@@ -0,0 +1,45 @@
+"""Exportación: el CSV vuelve a importarse y el JSONL respeta los filtros del listado."""
+import io
+import json
+
+from sqlalchemy import insert, select, update
+
+from exportacion import exportar
+from importacion import importar, leer_registros
+from models import Indicator
+
+
+def test_csv_exportado_se_vuelve_a_importar(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', referencias={'ref1': 50, 'ref2': 20})])
+    padre = bd.session.scalar(select(Indicator.id))
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K2', parent_id=padre, valor_real=7.5,
+                                                           referencias={'ref1': 5, 'ref2': 2},
+                                                           ubicacion_geografica={'provincia': 'Matanzas'})])
+    bd.session.commit()
+
+    # Un trozo por fila: la cabecera solo va en el primero
+    trozos = list(exportar('csv', tamano_bloque=1))
+    assert trozos[0].startswith('codigo,') and ''.join(trozos).count('codigo,') == 1
+    bd.session.execute(update(Indicator).values(valor_real=None, referencias=None))
+    bd.session.commit()
+
+    resumen = importar(leer_registros(io.StringIO(''.join(trozos)), 'csv'))
+    assert (resumen['actualizados'], resumen['errores']) == (2, 0)
+    bd.session.expire_all()
+    filas = {f.codigo: f for f in bd.session.scalars(select(Indicator))}
+    assert (filas['K2'].valor_real, filas['K2'].referencias) == (7.5, {'ref1': 5.0, 'ref2': 2.0})
+    assert (filas['K2'].ubicacion_geografica, filas['K2'].parent_id) == ({'provincia': 'Matanzas'}, padre)
+
+
+def test_jsonl_con_los_filtros_del_listado(app, bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', ultima_evaluacion='BIEN'),
+                                           nuevo_indicador('K2', ultima_evaluacion='MAL')])
+    bd.session.commit()
+    cliente = app.test_client()
+
+    respuesta = cliente.get('/kpis/exportar?formato=jsonl&estado=BIEN')
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'application/x-ndjson'
+    registros = [json.loads(linea) for linea in respuesta.get_data(as_text=True).splitlines()]
+    assert [(r['codigo'], r['perspectiva'], r['ultima_evaluacion']) for r in registros] == [('K1', 'FIN', 'BIEN')]
+
+    assert cliente.get('/kpis/exportar?formato=xml').status_code == 400
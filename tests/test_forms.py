@@ -0,0 +1,35 @@
+"""Validación del indicador padre en el formulario de KPIs."""
+import pytest
+from sqlalchemy import insert, select
+
+from forms import KPIForm
+from models import Indicator
+
+
+@pytest.fixture
+def cadena(bd, nuevo_indicador):
+    """K1 <- K2 <- K3: devuelve {codigo: id}"""
+    ids = {}
+    padre = None
+    for codigo in ('K1', 'K2', 'K3'):
+        bd.session.execute(insert(Indicator), [nuevo_indicador(codigo, parent_id=padre)])
+        padre = ids[codigo] = bd.session.scalar(select(Indicator.id).where(Indicator.codigo == codigo))
+    bd.session.commit()
+    return ids
+
+
+def _errores_padre(app, indicador_id, parent_id):
+    with app.test_request_context(method='POST', data={'parent_id': str(parent_id)}):
+        form = KPIForm(indicador_id=indicador_id)
+        form.parent_id.validate(form)
+        return form.parent_id.errors
+
+
+@pytest.mark.parametrize('editado, padre', [('K1', 'K3'), ('K1', 'K2'), ('K2', 'K2')])
+def test_padre_en_el_subarbol_se_rechaza(app, cadena, editado, padre):
+    assert _errores_padre(app, cadena[editado], cadena[padre])
+
+
+@pytest.mark.parametrize('editado, padre', [('K3', 'K1'), (None, 'K3')])
+def test_padre_fuera_del_subarbol_se_acepta(app, cadena, editado, padre):
+    assert _errores_padre(app, cadena.get(editado), cadena[padre]) == []
@@ -0,0 +1,42 @@
+"""Caducidad de los fragmentos cacheados frente a cambios de otros procesos."""
+from types import SimpleNamespace
+
+import pytest
+
+import fragmentos
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj manual para ``fragmentos``; ``reloj.ahora`` se puede adelantar"""
+    reloj = SimpleNamespace(ahora=1000.0)
+    monkeypatch.setattr(fragmentos, 'time', SimpleNamespace(time=lambda: reloj.ahora))
+    monkeypatch.setattr(fragmentos, 'backend', fragmentos.CacheLRU())
+    return reloj
+
+
+def _render(generados):
+    def generar():
+        generados.append(1)
+        return f'<tr>{len(generados)}</tr>'
+    return fragmentos.cacheado('tabla', ['indicators'], ['p'], generar)
+
+
+def test_fragmento_caduca_al_pasar_el_ttl(reloj, monkeypatch):
+    monkeypatch.setattr(fragmentos, 'ttl', 30)
+    generados = []
+
+    assert _render(generados) == _render(generados) == '<tr>1</tr>'
+    reloj.ahora += 30
+    assert _render(generados) == '<tr>2</tr>'
+
+
+def test_sin_ttl_solo_invalida_la_version(reloj, monkeypatch):
+    monkeypatch.setattr(fragmentos, 'ttl', 0)
+    generados = []
+
+    _render(generados)
+    reloj.ahora += 3600
+    assert _render(generados) == '<tr>1</tr>'
+    fragmentos.backend.incrementar('indicators')
+    assert _render(generados) == '<tr>2</tr>'
@@ -0,0 +1,56 @@
+"""Coordenadas, búsqueda por área y relleno de las columnas espaciales (también sin sesión, en la migración)."""
+import pytest
+from sqlalchemy import insert, select
+
+import geografia
+from models import EquipoFisico, Indicator
+
+
+def test_reconstruir_con_una_conexion_rellena_filas_escritas_en_bloque(bd, catalogos, nuevo_indicador):
+    # Las inserciones Core no pasan por los eventos del mapper: quedan como filas previas a la migración
+    bd.session.execute(insert(Indicator), [
+        nuevo_indicador('K1', ubicacion_geografica={'lat': 23.1136, 'lon': -82.3666}),
+        nuevo_indicador('K2', ubicacion_geografica={'provincia': 'Matanzas'})])
+    bd.session.execute(insert(EquipoFisico), [
+        {'codigo_activo': 'EQ1', 'nombre': 'Equipo 1', 'coordenadas': 'POINT(-81.5775 23.0411)',
+         'estructura_id': catalogos['estructura']}])
+    bd.session.commit()
+    assert bd.session.scalar(select(Indicator.celda_geo).where(Indicator.codigo == 'K1')) is None
+
+    with bd.engine.begin() as conexion:
+        assert geografia.reconstruir(tamano_bloque=1, conexion=conexion) == 3
+
+    bd.session.expire_all()
+    indicadores = {f.codigo: (f.latitud, f.longitud, f.celda_geo) for f in bd.session.scalars(select(Indicator))}
+    assert indicadores == {'K1': (23.1136, -82.3666, geografia.geohash(23.1136, -82.3666)),
+                           'K2': (None, None, None)}
+    equipo = bd.session.scalars(select(EquipoFisico)).one()
+    assert (equipo.latitud, equipo.longitud, equipo.celda_geo) == \
+        (23.0411, -81.5775, geografia.geohash(23.0411, -81.5775))
+
+
+@pytest.mark.parametrize('texto, punto', [('23.1,-82.3', (23.1, -82.3)), ('23.1 -82.3', (23.1, -82.3)),
+                                          ('POINT(-82.3 23.1)', (23.1, -82.3)), ('95,10', None),
+                                          ('23.1', None), ('a,b', None), (None, None)])
+def test_leer_coordenadas(texto, punto):
+    assert geografia.leer_coordenadas(texto) == punto
+
+
+def test_buscar_por_rectangulo_y_por_radio(bd, catalogos, nuevo_indicador):
+    # La Habana y, a unos 80 km, Matanzas; las altas ORM derivan las columnas espaciales
+    bd.session.add_all([
+        Indicator(**nuevo_indicador('K1', ubicacion_geografica={'lat': 23.1136, 'lon': -82.3666})),
+        EquipoFisico(codigo_activo='EQ1', nombre='Equipo 1', coordenadas='23.0411,-81.5775',
+                     estructura_id=catalogos['estructura'])])
+    bd.session.commit()
+
+    resultado = geografia.buscar(rectangulo=(-83, 22.5, -81, 23.5))
+    assert [f['codigo'] for f in resultado['indicadores']] == ['K1']
+    assert [f['codigo_activo'] for f in resultado['equipos']] == ['EQ1']
+
+    resultado = geografia.buscar(centro=(23.1136, -82.3666), radio_km=10)
+    assert [f['codigo'] for f in resultado['indicadores']] == ['K1'] and resultado['equipos'] == []
+    assert geografia.buscar(centro=(23.1136, -82.3666), radio_km=100)['equipos'][0]['distancia_km'] > 70
+
+    with pytest.raises(ValueError):
+        geografia.buscar(rectangulo=(-81, 22.5, -83, 23.5))
@@ -0,0 +1,133 @@
+"""Historial de indicadores: reintentos del escritor y cambios hechos con sentencias Core."""
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import insert, select
+
+import historial
+import telemetria
+from actualizacion import actualizar
+from historial import EscritorHistorial
+from importacion import importar
+from mediciones import ingerir_lote
+from models import Indicator, IndicatorHistory
+
+
+def _fila(id_, campo='valor_real'):
+    return {'indicator_id': id_, 'campo_modificado': campo, 'valor_anterior': '1', 'valor_nuevo': '2',
+            'fecha_cambio': datetime.utcnow(), 'usuario': 'prueba'}
+
+
+def _filas_guardadas(bd):
+    bd.session.expire_all()
+    return bd.session.scalars(select(IndicatorHistory).order_by(IndicatorHistory.id)).all()
+
+
+def test_escritor_reintenta_tras_un_fallo_transitorio(bd, nuevo_indicador, monkeypatch, caplog):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1')])
+    bd.session.commit()
+    escritor = EscritorHistorial(intervalo=0.01, reintentos=3, espera=0)
+    insertar = EscritorHistorial._insertar
+    fallos = iter([True, True])
+
+    def insertar_con_fallos(engine, filas):
+        if next(fallos, False):
+            raise RuntimeError('conexión perdida')
+        insertar(engine, filas)
+
+    monkeypatch.setattr(escritor, '_insertar', insertar_con_fallos)
+    with caplog.at_level(logging.ERROR, logger='historial'):
+        escritor.encolar(bd.engine, [_fila(1), _fila(1, 'nombre')])
+        escritor.vaciar()
+
+    assert (escritor.escritas, escritor.errores) == (2, 0)
+    assert len(_filas_guardadas(bd)) == 2
+    assert sum('reintento' in r.getMessage() for r in caplog.records) == 2
+
+
+def test_escritor_aisla_la_fila_que_no_se_puede_escribir(bd, nuevo_indicador, caplog):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1')])
+    bd.session.commit()
+    escritor = EscritorHistorial(intervalo=0.01, reintentos=1, espera=0)
+    with caplog.at_level(logging.ERROR, logger='historial'):
+        escritor.encolar(bd.engine, [_fila(1), _fila(1, None), _fila(1, 'nombre')])  # NOT NULL
+        escritor.vaciar()
+
+    assert (escritor.escritas, escritor.errores) == (2, 1)
+    assert [f.campo_modificado for f in _filas_guardadas(bd)] == ['valor_real', 'nombre']
+    assert any('descartada' in r.getMessage() for r in caplog.records)
+
+
+def test_ingesta_de_mediciones_queda_en_el_historial(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', valor_real=10.0,
+                                                           referencias={'ref1': 50, 'ref2': 20})])
+    bd.session.commit()
+    id_ = bd.session.scalar(select(Indicator.id))
+
+    ingerir_lote([(id_, date(2025, 1, 15), 42.0)])
+    historial.escritor.vaciar()
+
+    (fila,) = _filas_guardadas(bd)
+    assert (fila.indicator_id, fila.campo_modificado, fila.valor_anterior, fila.valor_nuevo) == \
+        (id_, 'valor_real', '10.0', '42.0')
+
+
+def _cambios_de(bd, id_):
+    historial.escritor.vaciar()
+    return {f.campo_modificado: (f.valor_anterior, f.valor_nuevo) for f in _filas_guardadas(bd)
+            if f.indicator_id == id_}
+
+
+def test_agregacion_del_padre_queda_en_el_historial(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('P')])
+    bd.session.commit()
+    padre = bd.session.scalar(select(Indicator.id))
+
+    bd.session.add_all([Indicator(**nuevo_indicador('K1', valor_real=10.0, parent_id=padre)),
+                        Indicator(**nuevo_indicador('K2', valor_real=20.0, parent_id=padre))])
+    bd.session.commit()
+    assert _cambios_de(bd, padre) == {'valor_real': (None, '30.0')}
+
+
+def test_actualizacion_en_bloque_queda_en_el_historial(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', valor_real=10.0, referencias={'ref1': 50, 'ref2': 20}),
+                                           nuevo_indicador('K2', valor_real=1.0, referencias={'ref1': 50, 'ref2': 20})])
+    bd.session.commit()
+    ids = dict(bd.session.execute(select(Indicator.codigo, Indicator.id)).all())
+
+    resultado = actualizar([{'codigo': 'K1', 'valor_real': 12, 'valor_planificado': 10.0,
+                             'referencias': {'ref1': 60, 'ref2': 20}},
+                            {'codigo': 'K2', 'valor_real': 1.0},  # Sin cambio real: nada que auditar
+                            {'codigo': 'K2', 'referencias': {'ref1': 60}}])  # Rechazado
+    assert resultado['actualizados'] == 1
+
+    assert _cambios_de(bd, ids['K1']) == {
+        'valor_real': ('10.0', '12.0'), 'valor_planificado': (None, '10.0'),
+        'referencias': ('{"ref1": 50, "ref2": 20}', '{"ref1": 60.0, "ref2": 20.0}')}
+    assert _cambios_de(bd, ids['K2']) == {}
+
+
+def test_volcado_de_telemetria_queda_en_el_historial(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', referencias={'ref1': 50, 'ref2': 20})])
+    bd.session.commit()
+    id_ = bd.session.scalar(select(Indicator.id))
+
+    assert telemetria.volcar({id_: (7.5, None)}) == 1
+    assert _cambios_de(bd, id_) == {'valor_real': (None, '7.5')}
+
+
+def test_importacion_de_existentes_queda_en_el_historial(bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('P'),
+                                           nuevo_indicador('K1', valor_real=3.0, referencias={'ref1': 50, 'ref2': 20})])
+    bd.session.commit()
+    ids = dict(bd.session.execute(select(Indicator.codigo, Indicator.id)).all())
+
+    resumen = importar(enumerate([{'codigo': 'K1', 'nombre': 'Nuevo nombre', 'unidad_medida': '%',
+                                   'perspectiva': 'FIN', 'tipo_comparacion': 'TYPE1', 'periodicidad': 'MENSUAL',
+                                   'metodo_agregacion': 'SUM', 'estructura': 'E0', 'padre': 'P',
+                                   'valor_real': '4', 'ref1': '50', 'ref2': '20'}]))
+    assert (resumen['actualizados'], resumen['errores']) == (1, 0)
+
+    assert _cambios_de(bd, ids['K1']) == {'nombre': ('Indicador K1', 'Nuevo nombre'),
+                                          'valor_real': ('3.0', '4.0'),
+                                          'parent_id': (None, str(ids['P']))}
@@ -0,0 +1,23 @@
+"""Regeneración de la tabla de cierre con ``reconstruir_cierre``, también sin sesión (migración)."""
+from sqlalchemy import insert, select
+
+from jerarquia import Ruta, reconstruir_cierre
+from models import OrganizationalStructure
+
+
+def test_reconstruir_cierre_con_una_conexion(bd, catalogos):
+    # Las inserciones Core no pasan por los eventos del mapper: quedan como filas previas a la migración
+    raiz = catalogos['estructura']
+    nivel = bd.session.scalar(select(OrganizationalStructure.level_id))
+    bd.session.execute(insert(OrganizationalStructure), [
+        {'id': 10, 'codigo': 'E1', 'nombre': 'Estructura 1', 'level_id': nivel, 'parent_id': raiz},
+        {'id': 11, 'codigo': 'E2', 'nombre': 'Estructura 2', 'level_id': nivel, 'parent_id': 10, 'activo': False}])
+    bd.session.commit()
+
+    with bd.engine.begin() as conexion:
+        assert reconstruir_cierre(conexion=conexion) == 6
+
+    rutas = {(f.ancestro_id, f.descendiente_id): (f.profundidad, f.activo)
+             for f in bd.session.execute(select(Ruta))}
+    assert rutas == {(raiz, raiz): (0, True), (10, 10): (0, True), (11, 11): (0, False),
+                     (raiz, 10): (1, True), (10, 11): (1, False), (raiz, 11): (2, False)}
@@ -0,0 +1,39 @@
+"""Listado de KPIs con texto de búsqueda que contiene caracteres especiales."""
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql
+
+import listado
+from models import Indicator
+
+_TEXTOS = ['foo :bar', 'a:b', '50% :x', "o'neil :y_z"]
+
+
+@pytest.mark.parametrize('dialecto', [postgresql.psycopg2.dialect(), postgresql.psycopg.dialect(),
+                                      postgresql.pg8000.dialect()], ids=lambda d: d.driver)
+@pytest.mark.parametrize('texto', _TEXTOS)
+def test_sql_explain_no_incrusta_el_texto(app, dialecto, texto):
+    criterios = listado.criterios(perspective_id=1, texto=texto) + [Indicator.id.in_([1, 2])]
+    sql, parametros = listado.sql_explain(select(Indicator.id).where(*criterios), dialecto)
+
+    # El SQL no depende del texto buscado: el texto solo va en los parámetros
+    neutro, _ = listado.sql_explain(select(Indicator.id).where(
+        *listado.criterios(perspective_id=1, texto='x'), Indicator.id.in_([1, 2])), dialecto)
+    assert sql == neutro and sql.startswith('EXPLAIN (FORMAT JSON) SELECT')
+    valores = list(parametros.values()) if isinstance(parametros, dict) else list(parametros)
+    assert listado.patron_like(texto, contiene=True) in valores
+    assert valores.count(1) == 2 and 2 in valores  # perspectiva e IN expandido
+
+
+@pytest.mark.parametrize('texto', _TEXTOS)
+def test_listado_con_dos_puntos_en_la_busqueda(app, bd, nuevo_indicador, texto):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1', nombre=f'Indicador {texto}'),
+                                           nuevo_indicador('K2', nombre='Otro')])
+    bd.session.commit()
+    app.config['LISTADO_TOTAL_ESTIMADO'] = True
+    try:
+        respuesta = app.test_client().get('/kpis', query_string={'q': texto})
+    finally:
+        app.config['LISTADO_TOTAL_ESTIMADO'] = False
+    assert respuesta.status_code == 200
+    assert b'K1' in respuesta.data and b'K2' not in respuesta.data
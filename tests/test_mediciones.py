@@ -0,0 +1,20 @@
+"""Lectura del CSV de mediciones: las filas no válidas se rechazan una a una."""
+import io
+from datetime import date
+
+from mediciones import leer_csv
+
+
+def test_filas_no_validas_se_informan_sin_detener_la_carga():
+    archivo = io.StringIO('codigo,fecha,valor\n'
+                          'K1,2025-01-15,10\n'
+                          'K1,15/01/2025,11\n'
+                          'K2,2025-02-01,abc\n'
+                          'K2,2025-02-01,nan\n'
+                          'K2,,12\n'
+                          'K3,2025-03-01T10:00:00,\n')
+    errores = []
+
+    puntos = list(leer_csv(archivo, {'K1': 1, 'K2': 2}, errores.append))
+    assert puntos == [(1, date(2025, 1, 15), 10.0), (None, date(2025, 3, 1), None)]
+    assert [(e['linea'], e['codigo']) for e in errores] == [(3, 'K1'), (4, 'K2'), (5, 'K2'), (6, 'K2')]
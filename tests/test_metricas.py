@@ -0,0 +1,38 @@
+"""Métricas por endpoint: contadores de una petición real y formato de Prometheus."""
+from metricas import SENTENCIAS_LENTAS, Metricas, metricas
+
+
+def test_peticion_suma_consultas_y_render_a_su_endpoint(app, bd, catalogos):
+    metricas.reiniciar()
+    cliente = app.test_client()
+    assert cliente.get('/kpis').status_code == 200
+
+    nombre, datos = next((n, d) for n, d in metricas.resumen().items() if n.endswith('list_kpis'))
+    assert datos['peticiones'] == 1 and datos['consultas'] > 0 and datos['max_consultas'] == datos['consultas']
+    assert 0 < datos['segundos_sql'] <= datos['segundos'] and datos['segundos_render'] > 0
+    assert 0 < len(datos['lentas']) <= SENTENCIAS_LENTAS
+
+    # /metrics no se cuenta a sí mismo
+    texto = cliente.get('/metrics').get_data(as_text=True)
+    assert f'kpi_http_request_seconds_count{{endpoint="{nombre}"}} 1' in texto
+    assert 'endpoint="metrics"' not in texto
+
+
+def test_solo_se_guardan_las_sentencias_mas_lentas():
+    registro = Metricas()
+    for i in range(SENTENCIAS_LENTAS + 3):
+        registro.registrar('x', 0.02, 1, 0.01, 0.0, [(i / 1000, f'SELECT {i}')])
+    registro.registrar('x', 0.5, 1, 0.01, 0.0, [(0.1, 'SELECT 0')])
+
+    datos = registro.resumen()['x']
+    assert [sql for _, sql in datos['lentas']] == ['SELECT 0', 'SELECT 7', 'SELECT 6', 'SELECT 5', 'SELECT 4']
+    assert (datos['peticiones'], datos['consultas'], datos['buckets'][3], datos['buckets'][6]) == (9, 9, 8, 9)
+
+
+def test_etiquetas_escapadas_en_prometheus():
+    registro = Metricas()
+    registro.registrar('api."raro"', 0.01, 1, 0.01, 0.0, [(0.01, 'SELECT "a"\n  FROM  b')])
+
+    texto = registro.prometheus()
+    assert 'kpi_sql_queries_total{endpoint="api.\\"raro\\""} 1' in texto
+    assert 'sql="SELECT \\"a\\" FROM b"' in texto
@@ -0,0 +1,43 @@
+"""Planificador: solo reserva indicadores vencidos y libres, y libera lo que evalúa."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from models import Indicator
+from planificador import Planificador, reservar
+
+
+def _ids(bd, *codigos):
+    return sorted(bd.session.scalars(select(Indicator.id).where(Indicator.codigo.in_(codigos))))
+
+
+def test_reserva_solo_vencidos_libres_o_caducados(bd, nuevo_indicador):
+    ahora = datetime.utcnow()
+    bd.session.execute(insert(Indicator), [
+        nuevo_indicador('NUNCA', fecha_ultima_evaluacion=None),
+        nuevo_indicador('VENCIDO', fecha_ultima_evaluacion=ahora - timedelta(days=31)),
+        nuevo_indicador('AL_DIA', fecha_ultima_evaluacion=ahora - timedelta(days=1)),
+        nuevo_indicador('MANUAL', fecha_ultima_evaluacion=None, evaluacion_automatica=False),
+        nuevo_indicador('RESERVADO', fecha_ultima_evaluacion=None,
+                        evaluacion_reservada_hasta=ahora + timedelta(minutes=5), evaluacion_reservada_por='otro'),
+        nuevo_indicador('CADUCADO', fecha_ultima_evaluacion=None,
+                        evaluacion_reservada_hasta=ahora - timedelta(minutes=5), evaluacion_reservada_por='otro'),
+    ])
+    bd.session.commit()
+
+    assert sorted(reservar('yo', 10, 60)) == _ids(bd, 'NUNCA', 'VENCIDO', 'CADUCADO')
+    # Ya reservados por 'yo': otro proceso no se los lleva
+    assert reservar('otro proceso', 10, 60) == []
+
+
+def test_una_ronda_evalua_y_libera_las_reservas(app, bd, nuevo_indicador):
+    bd.session.execute(insert(Indicator), [nuevo_indicador(f'K{i}', valor=i) for i in range(5)])
+    bd.session.commit()
+
+    estadisticas = Planificador(app, trabajadores=2, tamano_lote=2).ejecutar(una_vez=True)
+    assert (estadisticas['evaluados'], estadisticas['lotes'], estadisticas['errores']) == (5, 3, 0)
+    bd.session.expire_all()
+    filas = bd.session.execute(select(Indicator.fecha_ultima_evaluacion, Indicator.evaluacion_reservada_por)).all()
+    assert all(fecha is not None and propietario is None for fecha, propietario in filas)
+    # Evaluados hace un momento: ya no vencen
+    assert reservar('yo', 10, 60) == []
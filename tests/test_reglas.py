@@ -0,0 +1,58 @@
+"""Reglas compiladas: ``valor IS NULL``, fórmulas no válidas y cambios de fórmula en otros procesos."""
+import logging
+
+import numpy as np
+import pytest
+from sqlalchemy import update
+
+from models import ComparisonType
+from reglas import FORMULAS_BASE, Regla, cache_reglas, compilar
+
+
+def _clasificar(regla, valores):
+    valores = np.array(valores, dtype=np.float64)
+    n = len(valores)
+    return regla.clasificar(valores, np.zeros((n, 4)), np.zeros((n, 4), dtype=bool)).tolist()
+
+
+def test_valor_is_null_usa_el_criterio_de_sin_valor():
+    regla = Regla('IF valor IS NULL THEN "A" ELSE "B" END')
+    assert [regla.evaluar(v, {}) for v in (None, 0, 5)] == ['A', 'A', 'B']
+    assert _clasificar(regla, [0, 5]) == ['A', 'B']
+
+    regla = Regla('IF valor IS NOT NULL AND ref1 IS NULL THEN "A" ELSE "B" END')
+    assert regla.evaluar(5, {}) == 'A'
+    assert _clasificar(regla, [0, 5]) == ['B', 'A']
+
+
+def test_formula_no_valida_usa_la_base_y_lo_avisa(caplog):
+    with caplog.at_level(logging.WARNING, logger='reglas'):
+        regla = compilar('Complex evaluation', 'TYPE1')
+    assert regla.formula == FORMULAS_BASE['TYPE1']
+    assert 'TYPE1' in caplog.text
+
+    with pytest.raises(ValueError):
+        compilar('Complex evaluation', 'TYPEX')
+
+
+def _otro_proceso(bd, codigo, formula):
+    """Cambia la fórmula en una conexión propia: la caché no recibe el aviso del commit"""
+    with bd.engine.begin() as conexion:
+        conexion.execute(update(ComparisonType).where(ComparisonType.codigo == codigo)
+                         .values(formula_evaluacion=formula))
+
+
+def test_formula_cambiada_en_otro_proceso_se_recompila(app, bd, catalogos, monkeypatch):
+    monkeypatch.setitem(app.config, 'REGLAS_VERIFICACION', 0)
+    assert cache_reglas.regla('TYPE1').evaluar(5, {'ref1': 10, 'ref2': 1}) == 'REGULAR'
+
+    _otro_proceso(bd, 'TYPE1', 'IF valor > ref2 THEN "BIEN" ELSE "MAL" END')
+    assert cache_reglas.regla('TYPE1').evaluar(5, {'ref1': 10, 'ref2': 1}) == 'BIEN'
+
+
+def test_dentro_del_intervalo_no_se_relee_la_formula(app, bd, catalogos, monkeypatch):
+    monkeypatch.setitem(app.config, 'REGLAS_VERIFICACION', 300)
+    regla = cache_reglas.regla('TYPE1')
+
+    _otro_proceso(bd, 'TYPE1', 'IF valor > ref2 THEN "BIEN" ELSE "MAL" END')
+    assert cache_reglas.regla('TYPE1') is regla
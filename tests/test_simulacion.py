@@ -0,0 +1,45 @@
+"""Simulación: transiciones de estado sin tocar la base de datos ni la caché de reglas."""
+import pytest
+from sqlalchemy import insert, select
+
+from models import Indicator
+from reglas import FORMULAS_BASE, cache_reglas
+from simulacion import simular
+
+_REFERENCIAS = {'ref1': 50, 'ref2': 20}
+
+
+@pytest.fixture
+def catalogo(bd, nuevo_indicador):
+    """K1 BIEN, K2 REGULAR y K3 MAL con las mismas referencias de TYPE1"""
+    bd.session.execute(insert(Indicator), [nuevo_indicador(codigo, valor_real=valor, referencias=_REFERENCIAS)
+                                           for codigo, valor in (('K1', 60.0), ('K2', 30.0), ('K3', 10.0))])
+    bd.session.commit()
+
+
+def test_valor_propuesto_no_se_guarda(bd, catalogo):
+    resultado = simular([{'codigo': 'K3', 'valor_real': 55}])
+    assert resultado['matriz'] == {'BIEN': {'BIEN': 1}, 'REGULAR': {'REGULAR': 1}, 'MAL': {'BIEN': 1}}
+    assert [(c['codigo'], c['antes'], c['despues']) for c in resultado['cambios']] == [('K3', 'MAL', 'BIEN')]
+    assert bd.session.scalar(select(Indicator.valor_real).where(Indicator.codigo == 'K3')) == 10.0
+
+
+def test_desplazamiento_respeta_las_referencias_fijadas(bd, catalogo):
+    # +100 %: ref1 100 y ref2 40, salvo en K1, que fija las suyas
+    resultado = simular([{'codigo': 'K1', 'referencias': _REFERENCIAS}], tipos={'TYPE1': {'desplazamiento': 100}})
+    assert [(c['codigo'], c['despues']) for c in resultado['cambios']] == [('K2', 'MAL')]
+
+
+def test_formula_simulada_no_entra_en_la_cache(bd, catalogo):
+    resultado = simular(tipos={'TYPE1': {'formula': 'IF valor > 0 THEN "BIEN" ELSE "MAL" END'}})
+    assert resultado['cambiados'] == 2 and resultado['matriz']['MAL'] == {'BIEN': 1}
+    assert cache_reglas.regla('TYPE1').formula == FORMULAS_BASE['TYPE1']
+
+
+@pytest.mark.parametrize('propuesta', [{'indicadores': [{'codigo': 'KX', 'valor_real': 1}]},
+                                       {'tipos': {'TYPEX': {'desplazamiento': 10}}},
+                                       {'tipos': {'TYPE1': {'formula': 'no es fórmula'}}},
+                                       {'perspectivas': {'FIN': {'ref9': 10}}}])
+def test_propuesta_no_valida(bd, catalogo, propuesta):
+    with pytest.raises(ValueError):
+        simular(**propuesta)
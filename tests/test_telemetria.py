@@ -0,0 +1,81 @@
+"""Telemetría: validación de lecturas y reintento de volcados fallidos."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select
+
+import telemetria
+from models import Indicator
+from telemetria import Coalescedor, leer_lectura, volcar_en_contexto
+
+
+@pytest.mark.parametrize('fecha, esperada', [
+    ('2025-03-01T12:00:00Z', datetime(2025, 3, 1, 12)),
+    ('2025-03-01T12:00:00+02:00', datetime(2025, 3, 1, 10)),
+    ('2025-03-01T00:30:00-05:00', datetime(2025, 3, 1, 5, 30)),
+    ('2025-03-01T12:00:00', datetime(2025, 3, 1, 12)),
+])
+def test_fecha_con_zona_pasa_a_utc(fecha, esperada):
+    assert leer_lectura({'codigo_activo': 'EQ1', 'valor': 1, 'fecha': fecha})[2] == esperada
+
+
+@pytest.mark.parametrize('lectura', [
+    '{"codigo_activo": "EQ1", "valor": NaN}',
+    '{"codigo_activo": "EQ1", "valor": Infinity}',
+    {'codigo_activo': 'EQ1', 'valor': '-inf'},
+    {'codigo_activo': 'EQ1', 'valor': float('nan')},
+])
+def test_valores_no_finitos_se_rechazan(lectura):
+    with pytest.raises(ValueError):
+        leer_lectura(lectura)
+
+
+def _valor(bd, codigo):
+    bd.session.expire_all()
+    return bd.session.scalar(select(Indicator.valor_real).where(Indicator.codigo == codigo))
+
+
+def _volcado_que_falla(coalescedor, *lecturas):
+    """Sustituto de ``volcar`` que recibe ``lecturas`` mientras se vuelca y luego falla"""
+    def volcar(pendientes):
+        for lectura in lecturas:
+            coalescedor.agregar(*lectura)
+        raise RuntimeError('base de datos no disponible')
+    return volcar
+
+
+def test_volcado_fallido_se_reintenta_sin_pisar_lecturas_nuevas(app, bd, nuevo_indicador, monkeypatch):
+    bd.session.execute(insert(Indicator), [nuevo_indicador('K1'), nuevo_indicador('K2'), nuevo_indicador('K3')])
+    bd.session.commit()
+    ids = dict(bd.session.execute(select(Indicator.codigo, Indicator.id)).all())
+    antes, despues = datetime(2025, 1, 1, 10), datetime(2025, 1, 1, 11)
+    coalescedor = Coalescedor()
+    coalescedor.agregar(ids['K1'], 1.0, antes)
+    coalescedor.agregar(ids['K2'], 2.0, despues)
+    coalescedor.agregar(ids['K3'], 3.0, antes)
+
+    volcar = telemetria.volcar
+    # Durante el volcado llegan K1 más reciente (gana) y K2 más antigua (pierde)
+    monkeypatch.setattr(telemetria, 'volcar', _volcado_que_falla(
+        coalescedor, (ids['K1'], 10.0, despues), (ids['K2'], 20.0, antes)))
+    assert volcar_en_contexto(app, coalescedor) == 0
+    assert coalescedor.errores == 0
+    assert len(coalescedor) == 3
+
+    monkeypatch.setattr(telemetria, 'volcar', volcar)
+    assert volcar_en_contexto(app, coalescedor) == 3
+    assert (_valor(bd, 'K1'), _valor(bd, 'K2'), _valor(bd, 'K3')) == (10.0, 2.0, 3.0)
+    assert len(coalescedor) == 0
+
+
+def test_volcado_que_siempre_falla_se_descarta_tras_max_intentos(app, bd, monkeypatch):
+    coalescedor = Coalescedor(max_intentos=3)
+    coalescedor.agregar(1, 1.0, None)
+    monkeypatch.setattr(telemetria, 'volcar', _volcado_que_falla(coalescedor))
+
+    for _ in range(2):
+        volcar_en_contexto(app, coalescedor)
+        assert len(coalescedor) == 1
+    volcar_en_contexto(app, coalescedor)
+    assert len(coalescedor) == 0
+    assert coalescedor.errores == 1
@@ -0,0 +1,188 @@
+"""Vistas HTML de indicadores (blueprint ``kpis``): listado, exportación y formularios."""
+import json
+
+from flask import Blueprint, Response, current_app, flash, jsonify, redirect, render_template, request, \
+    stream_with_context, url_for
+from sqlalchemy.exc import SQLAlchemyError
+
+import fragmentos
+import listado
+from catalogos import opciones
+from extensions import db
+from models import Indicator, OrganizationalStructure
+
+kpis = Blueprint('kpis', __name__)
+
+# Tablas de las que depende la tabla del listado (nombres de catálogos incluidos)
+TABLAS_LISTADO = ('indicators', 'perspectives', 'periodicities', 'organizational_structures')
+
+# Funciones auxiliares para obtener opciones de la BD (vía caché de catálogos)
+def get_perspective_choices():
+    return opciones('perspectives')
+
+def get_aggregation_method_choices():
+    return opciones('aggregation_methods')
+
+def get_comparison_type_choices():
+    return opciones('comparison_types')
+
+def get_periodicity_choices():
+    return opciones('periodicities')
+
+def get_organizational_structure_choices():
+    return opciones('organizational_structures')
+
+def datos_formulario(kpi):
+    """Valores iniciales del formulario a partir de las columnas del indicador"""
+    refs = kpi.referencias or {}
+    return {
+        'codigo': kpi.codigo,
+        'nombre': kpi.nombre,
+        'perspective': kpi.perspective_id,
+        'periodicity': kpi.periodicity_id,
+        'comparison_type': kpi.comparison_type_id,
+        'aggregation_method': kpi.aggregation_method_id,
+        'unidad_medida': kpi.unidad_medida,
+        'valor_real': kpi.valor_real,
+        'organizational_structure_id': kpi.estructura_jerarquica_id,
+        'referencia1': refs.get('ref1'),
+        'referencia2': refs.get('ref2'),
+        'referencia3': refs.get('ref3'),
+        'referencia4': refs.get('ref4'),
+        'centro_costo': kpi.centro_costo,
+        'parent_id': kpi.parent_id,
+        'tiempo_dimension': json.dumps(kpi.tiempo_dimension) if kpi.tiempo_dimension else None,
+        'ubicacion_geografica': json.dumps(kpi.ubicacion_geografica) if kpi.ubicacion_geografica else None,
+    }
+
+def aplicar_formulario(kpi, form):
+    """Copia los datos del formulario a las columnas del indicador"""
+    kpi.codigo = form.codigo.data
+    kpi.nombre = form.nombre.data
+    kpi.perspective_id = form.perspective.data
+    kpi.periodicity_id = form.periodicity.data
+    kpi.comparison_type_id = form.comparison_type.data
+    kpi.aggregation_method_id = form.aggregation_method.data
+    kpi.unidad_medida = form.unidad_medida.data
+    kpi.valor_real = form.valor_real.data
+    kpi.estructura_jerarquica_id = form.organizational_structure_id.data
+    kpi.parent_id = form.parent_id.data
+    kpi.centro_costo = form.centro_costo.data or None
+    refs = [form.referencia1, form.referencia2, form.referencia3, form.referencia4]
+    kpi.referencias = {f'ref{i}': campo.data for i, campo in enumerate(refs, 1) if campo.data is not None}
+    # Los campos JSON solo se sobrescriben si se envió contenido
+    if form.tiempo_dimension.data:
+        kpi.tiempo_dimension = json.loads(form.tiempo_dimension.data)
+    if form.ubicacion_geografica.data:
+        kpi.ubicacion_geografica = json.loads(form.ubicacion_geografica.data)
+
+@kpis.route('/')
+def index():
+    return redirect(url_for('kpis.list_kpis'))
+
+@kpis.route('/kpis')
+def list_kpis():
+    filtros = listado.filtros_desde_args(request.args)
+    criterios = listado.criterios(**filtros)
+    orden = request.args.get('orden', 'nombre')
+    # Parámetros actuales sin el cursor, para construir los enlaces de paginación
+    parametros = {k: v for k, v in request.args.items() if k != 'cursor' and v}
+
+    def tabla():
+        kpis, siguiente = listado.pagina(criterios, orden, request.args.get('cursor'),
+                                         request.args.get('limit', listado.LIMITE_POR_DEFECTO, type=int))
+        total, total_estimado = listado.total(criterios,
+                                              estimado=current_app.config.get('LISTADO_TOTAL_ESTIMADO', True))
+        return render_template('tabla_kpis.html', kpis=kpis, siguiente=siguiente, parametros=parametros,
+                               total=total, total_estimado=total_estimado)
+
+    try:
+        # Consulta y render se saltan si la tabla ya está en caché para estos parámetros
+        tabla = fragmentos.cacheado('tabla_kpis', TABLAS_LISTADO, sorted(request.args.items()), tabla)
+    except ValueError as e:
+        flash(f'Parámetros de listado no válidos: {str(e)}', 'warning')
+        return redirect(url_for('kpis.list_kpis'))
+
+    estructura = None
+    if filtros['estructura_id'] is not None:
+        estructura = db.session.query(OrganizationalStructure.id, OrganizationalStructure.nombre).filter(
+            OrganizationalStructure.id == filtros['estructura_id']).first()
+
+    return render_template('list_kpis.html', tabla=tabla, parametros=parametros, filtros=filtros, orden=orden,
+                           perspectivas=get_perspective_choices(), periodicidades=get_periodicity_choices(),
+                           estados=listado.ESTADOS, estructura=estructura)
+
+@kpis.route('/kpis/exportar')
+def exportar_kpis():
+    import exportacion
+
+    formato = request.args.get('formato', 'csv')
+    if formato not in exportacion.FORMATOS:
+        return jsonify(error=f'Formato no soportado: {formato}'), 400
+    criterios = listado.criterios(**listado.filtros_desde_args(request.args))
+    contenido = exportacion.exportar(formato, criterios)
+    return Response(stream_with_context(contenido), mimetype=exportacion.FORMATOS[formato],
+                    headers={'Content-Disposition': f'attachment; filename=indicadores.{formato}'})
+
+@kpis.route('/kpi/create', methods=['GET', 'POST'])
+def create_kpi():
+    from forms import KPIForm
+
+    form = KPIForm()
+
+    # Poblar todos los campos select
+    form.perspective.choices = [('', '-- Seleccione Perspectiva --')] + get_perspective_choices()
+    form.aggregation_method.choices = [('', '-- Seleccione Método --')] + get_aggregation_method_choices()
+    form.comparison_type.choices = [('', '-- Seleccione Tipo --')] + get_comparison_type_choices()
+    form.periodicity.choices = [('', '-- Seleccione Periodicidad --')] + get_periodicity_choices()
+    form.organizational_structure_id.choices = [('', '-- Ninguna --')] + form.organizational_structure_id.choices
+    form.parent_id.choices = [('', '-- Ninguno --')] + form.parent_id.choices
+
+    if form.validate_on_submit():
+        try:
+            kpi = Indicator()
+            aplicar_formulario(kpi, form)
+
+            db.session.add(kpi)
+            db.session.commit()
+            flash('KPI creado exitosamente!', 'success')
+            return redirect(url_for('kpis.list_kpis'))
+
+        except ValueError as e:
+            db.session.rollback()
+            flash(f'Error en valores numéricos: {str(e)}', 'danger')
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            flash(f'Error de base de datos: {str(e)}', 'danger')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error inesperado: {str(e)}', 'danger')
+
+    return render_template('create_kpi.html', form=form)
+
+@kpis.route('/kpi/edit/<int:id>', methods=['GET', 'POST'])
+def edit_kpi(id):
+    from forms import KPIForm
+
+    kpi = Indicator.query.get_or_404(id)
+    form = KPIForm(data=datos_formulario(kpi), indicador_id=kpi.id)
+
+    # Poblar los mismos campos que en create
+    form.perspective.choices = get_perspective_choices()
+    form.aggregation_method.choices = get_aggregation_method_choices()
+    form.comparison_type.choices = get_comparison_type_choices()
+    form.periodicity.choices = get_periodicity_choices()
+    form.organizational_structure_id.choices = [('', '-- Ninguna --')] + form.organizational_structure_id.choices
+    form.parent_id.choices = [('', '-- Ninguno --')] + form.parent_id.choices
+
+    if form.validate_on_submit():
+        try:
+            aplicar_formulario(kpi, form)
+            db.session.commit()
+            flash('KPI actualizado exitosamente!', 'success')
+            return redirect(url_for('kpis.list_kpis'))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al actualizar KPI: {str(e)}', 'danger')
+
+    return render_template('edit_kpi.html', form=form, kpi=kpi)